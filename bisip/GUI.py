@@ -75,6 +75,7 @@ import tkinter.filedialog, tkinter.messagebox, tkinter.font
 print("BISIP imports")
 from bisip.models import mcmcinv
 import bisip.invResults as iR
+from bisip.exporter import FigureExporter
 
 print("Other imports")
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2TkAgg
@@ -298,81 +299,79 @@ class MainApplication(object):
         self.all_results = {}
         self.draw_drop_down()
         self.var_review.set("Working...")
-        for (i, self.f_n) in enumerate(self.files):
+        # Figures are saved in the background while the next file is sampled
+        figures = [f for (f, o) in [("fit", "Save fit figures"),
+                                    ("rtd", "Save Debye RTD"),
+                                    ("histograms", "Save histograms"),
+                                    ("traces", "Save traces figure"),
+                                    ("summary", "Save summaries"),
+                                    ("autocorrelation", "Save autocorrelations"),
+                                    ("deviance", "Save deviance"),
+                                    ("log_likelihood", "Save loglikelihood"),
+                                    ] if self.save_options[o].get()]
+        no_subplots = {"no_subplots": self.save_options["No subplots"].get()}
+        exporter = FigureExporter(figures, save_as_png=self.save_options["PNG figures"].get(),
+                                  options={"histograms": no_subplots, "traces": no_subplots})
+        try:
+            for (i, self.f_n) in enumerate(self.files):
             
-            if self.model.get() == "CCD":
-                print("\nRemoving data from CCDtools config")
-                self.ccdt_config = cfg_single.cfg_single()
-                self.ccdt_config['fixed_lambda'] = self.lamb_da.get()
-                self.ccdt_config['norm'] = 10   
-            else:
-                self.ccdt_config = None
+                if self.model.get() == "CCD":
+                    print("\nRemoving data from CCDtools config")
+                    self.ccdt_config = cfg_single.cfg_single()
+                    self.ccdt_config['fixed_lambda'] = self.lamb_da.get()
+                    self.ccdt_config['norm'] = 10   
+                else:
+                    self.ccdt_config = None
             
-            print("=====================")
-            self.activity()
-            self.var_review.set(self.f_n)
-            self.sol = mcmcinv(self.model.get(), self.sel_files[i], 
-                               mcmc = self.mcmc_params,
-                               headers=self.head.get(), 
-                               ph_units=self.units.get(),
-                               cc_modes=self.modes_n.get(), 
-                               decomp_poly=self.poly_n.get(),
-                               c_exp=self.c_exp.get(), 
-                               keep_traces=self.save_options["Save traces as txt"].get(),
-                               ccdt_priors='auto', 
-                               ccdt_cfg=self.ccdt_config,
-                               )
-#            print(self.model.get(), self.sel_files[i])
-            self.all_results[self.f_n] = {"pm":self.sol.pm,"MDL":self.sol.MDL,"data":self.sol.data,"fit":self.sol.fit, "sol":self.sol}
-#           Impression ou non des résultats, graphiques, histogrammes
-            try:            
-                self.update_results()        
-            except:
-                print("PROBLEM")
-            if self.run_options["Print results in console"].get():
-                self.sol.print_results()
-            if self.run_options["Save CSV results"].get():
-                self.sol.save_results()
-            if self.save_options["Save traces in CSV"].get():
-                self.sol.save_csv_traces()
-                
-            if self.save_options["Save fit figures"].get():
-                self.sol.plot_fit(save=True, save_as_png=self.save_options["PNG figures"].get(), draw=False)
+                print("=====================")
+                self.activity()
+                self.var_review.set(self.f_n)
+                self.sol = mcmcinv(self.model.get(), self.sel_files[i], 
+                                   mcmc = self.mcmc_params,
+                                   headers=self.head.get(), 
+                                   ph_units=self.units.get(),
+                                   cc_modes=self.modes_n.get(), 
+                                   decomp_poly=self.poly_n.get(),
+                                   c_exp=self.c_exp.get(), 
+                                   keep_traces=self.save_options["Save traces as txt"].get(),
+                                   ccdt_priors='auto', 
+                                   ccdt_cfg=self.ccdt_config,
+                                   )
+#                print(self.model.get(), self.sel_files[i])
+                self.all_results[self.f_n] = {"pm":self.sol.pm,"MDL":self.sol.MDL,"data":self.sol.data,"fit":self.sol.fit, "sol":self.sol}
+#               Impression ou non des résultats, graphiques, histogrammes
+                try:            
+                    self.update_results()        
+                except:
+                    print("PROBLEM")
+                if self.run_options["Print results in console"].get():
+                    self.sol.print_results()
+                if self.run_options["Save CSV results"].get():
+                    self.sol.save_results()
+                    self.sol.save_results_db()
+                if self.save_options["Save traces in CSV"].get():
+                    self.sol.save_csv_traces()
+                if figures:
+                    exporter.put(self.sol)
             
-            if self.run_options["Auto draw fit"].get():
-                fig_fit = self.sol.plot_fit(save=False, draw=True)
-                self.plot_window(fig_fit, "Inversion results: "+self.f_n)
+                if self.run_options["Auto draw fit"].get():
+                    fig_fit = self.sol.plot_fit(save=False, draw=True)
+                    self.plot_window(fig_fit, "Inversion results: "+self.f_n)
                 
-            if self.model.get() in ["PDecomp", "CCD"]:
-                if self.save_options["Save Debye RTD"].get():
-                    self.sol.plot_rtd(save=True, save_as_png=self.save_options["PNG figures"].get(), draw=False)
-            if self.save_options["Save all hexbins (will make error)"].get():
-                for v1, v2 in list(combinations(self.list_of_parameters, 2)):
-                    self.all_results[self.f_n]["sol"].plot_hexbin(v1, v2, save=True, save_as_png=self.save_options["PNG figures"].get())
-            if self.save_options["Save all bivariate KDE (will make error)"].get():
-                for v1, v2 in list(combinations(self.list_of_parameters, 2)):
-                    self.all_results[self.f_n]["sol"].plot_KDE(v1, v2, save=True, save_as_png=self.save_options["PNG figures"].get())
-            if self.save_options["Save histograms"].get():
-                    self.all_results[self.f_n]["sol"].plot_histograms(no_subplots=self.save_options["No subplots"].get(), save=True, save_as_png=self.save_options["PNG figures"].get())
-            if self.save_options["Save traces figure"].get():
-                self.all_results[self.f_n]["sol"].plot_traces(no_subplots=self.save_options["No subplots"].get(), save=True, save_as_png=self.save_options["PNG figures"].get())
-            if self.save_options["Save summaries"].get():
-                try:
-                    self.all_results[self.f_n]["sol"].plot_summary(save=True, save_as_png=self.save_options["PNG figures"].get())
-                except:
-                    print("\nError plotting summary: need more than 1 chain for Gelman-Rubin stats")
-            if self.save_options["Save autocorrelations"].get():
-                self.all_results[self.f_n]["sol"].plot_autocorrelation(save=True, save_as_png=self.save_options["PNG figures"].get())
-            if self.save_options["Save deviance"].get():
-                self.all_results[self.f_n]["sol"].plot_model_deviance(save=True, save_as_png=self.save_options["PNG figures"].get())
-            if self.save_options["Save loglikelihood"].get():
-                self.all_results[self.f_n]["sol"].plot_log_likelihood(save=True, save_as_png=self.save_options["PNG figures"].get())
-#            
-            if self.files.index(self.f_n)+1 == len(self.files):
-                self.activity(done=True)
-                self.diagn_buttons()
-                self.write_output_path()
-                print("=====================")
+                if self.save_options["Save all hexbins (will make error)"].get():
+                    for v1, v2 in list(combinations(self.list_of_parameters, 2)):
+                        self.all_results[self.f_n]["sol"].plot_hexbin(v1, v2, save=True, save_as_png=self.save_options["PNG figures"].get())
+                if self.save_options["Save all bivariate KDE (will make error)"].get():
+                    for v1, v2 in list(combinations(self.list_of_parameters, 2)):
+                        self.all_results[self.f_n]["sol"].plot_KDE(v1, v2, save=True, save_as_png=self.save_options["PNG figures"].get())
+        finally: # Also stops the exporter threads if a file fails
+            print("\nWaiting for figures to be saved")
+            exporter.close()
+        if self.files:
+            self.activity(done=True)
+            self.diagn_buttons()
+            self.write_output_path()
+            print("=====================")
 
 #==============================================================================
 # Result frame
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:45:53 2026
+
+Batch inversion with a pool of worker processes
+Workers import pymc and the compiled forward models once when they start,
+run one job per data file and write the outputs themselves
+Finished files are listed in a ledger so they are skipped on restart
+
+Use:
+watch('/Documents/DataFiles/', model='ColeCole', n_workers=4,
+      options={"cc_modes":2, "ph_units":"mrad"},
+      outputs={"results":True, "figures":["fit"]})
+Jobs of a survey container (see survey_jobs) read their spectrum from the
+memory-mapped container instead of a .dat file
+With options["mcmc"]["pool"] set to a folder, the workers share the
+posteriors of finished files to start the next ones (see bisip.proposals)
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import hashlib
+import traceback
+import multiprocessing as mp
+import numpy as np
+
+# Arrays shared by the parent (see init_worker)
+_shared = {}
+
+# Survey containers opened by this worker, by path
+_surveys = {}
+
+# Default outputs of a job
+default_outputs = {"results"     : True,  # INV and STATS csv files
+                   "db"          : True,  # Append to the result store
+                   "traces"      : None,  # None, "csv", "npz", "parquet" or "feather"
+                   "figures"     : [],    # Names in exporter.all_figures
+                   "save_as_png" : False,
+                   "dpi"         : None,
+                   }
+
+#==============================================================================
+def init_worker(work_dir=None, shared=None):
+    """
+    Pool initializer
+    Pays the imports of pymc, the Cython kernels and matplotlib once
+    per worker instead of once per file
+    shared is the handle of a packed data dictionary (see utils.load_data)
+    in shared memory: jobs with a data_index read their data from it
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    if work_dir is not None:
+        os.chdir(work_dir)
+    import pymc
+    import bisip.cython_funcs
+    from bisip import models, exporter
+    if shared is not None:
+        from bisip.sharedmem import attach
+        _shared.update(attach(shared))
+
+def make_job(filepath, model, options=None, outputs=None):
+    """
+    Returns the job dictionary of one data file
+    options are keyword arguments of mcmcinv (mcmc, headers, ph_units, ...)
+    outputs update default_outputs
+    Missing MCMC parameters take the mcmcinv defaults
+    """
+    options = dict(options or {})
+    if "mcmc" in options:
+        from bisip.models import mcmcinv
+        mcmc = dict(mcmcinv.default_mcmc)
+        mcmc.update(options["mcmc"])
+        options["mcmc"] = mcmc
+    out = dict(default_outputs)
+    out.update(outputs or {})
+    return {"file": filepath, "model": model,
+            "options": options, "outputs": out}
+
+def survey_jobs(survey_file, model, options=None, outputs=None, select=None):
+    """
+    Returns the jobs of the spectra of a survey container (see bisip.survey)
+    select: list of indices or sample names, default all spectra
+    The outputs are named after the original files of the spectra
+    """
+    from bisip.survey import open_survey
+    survey = open_survey(survey_file)
+    if select is None:
+        select = range(len(survey))
+    idx = [i if isinstance(i, (int, np.integer)) else survey.index(i) for i in select]
+    return [dict(make_job(str(survey.files[i]), model, options, outputs),
+                 survey=os.path.abspath(survey_file), index=int(i)) for i in idx]
+
+def job_data(job):
+    """
+    Data dictionary of a job from shared memory or from its survey
+    container, None if the job reads its .dat file
+    """
+    from bisip.utils import unpack_data
+    if "data_index" in job:
+        return unpack_data(_shared, job["data_index"])
+    if "survey" in job:
+        if job["survey"] not in _surveys:
+            from bisip.survey import open_survey
+            _surveys[job["survey"]] = open_survey(job["survey"])
+        return _surveys[job["survey"]].get_data(job["index"])
+    return None
+
+def run_job(job):
+    """
+    Inverts the file of one job and writes its outputs
+    Runs in the worker: only a short report goes back to the parent
+    Returns (job, error message or None, elapsed seconds, figure errors)
+    The results are saved before the figures: a figure that fails is only
+    reported in the figure errors, the job is done
+    """
+    from bisip.models import mcmcinv
+    from bisip.exporter import export_figures
+    start = time.time()
+    figure_errors = []
+    try:
+        options = dict(job["options"])
+        data = job_data(job)
+        if data is not None:
+            options["data"] = data
+        sol = mcmcinv(job["model"], job["file"], **options)
+        out = job["outputs"]
+        if out["results"]:
+            sol.save_results()
+        if out["db"]:
+            sol.save_results_db()
+        if out["traces"] == "csv":
+            sol.save_csv_traces()
+        elif out["traces"]:
+            sol.save_binary_traces(fmt=out["traces"])
+        error = None
+    except Exception:
+        return job, traceback.format_exc(), time.time() - start, figure_errors
+    try:
+        figure_errors = export_figures(sol, out["figures"], out["save_as_png"], out["dpi"])
+    except Exception:
+        figure_errors = [traceback.format_exc()]
+    return job, error, time.time() - start, figure_errors
+
+#==============================================================================
+class Ledger(object):
+    """
+    Append-only list of finished jobs kept on disk
+    One line per job: model, absolute file path and a hash of the job
+    options (mcmc, cc_modes, decomp_poly, ...) separated by tabs, and the
+    survey container and index of survey jobs
+    The same file run with other options is a new job
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.done = set()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.done = set(l.rstrip("\n") for l in f if l.strip())
+
+    @staticmethod
+    def key(job):
+        options = json.dumps(job["options"], sort_keys=True, default=str)
+        key = "%s\t%s\t%s" %(job["model"], os.path.abspath(job["file"]),
+                             hashlib.sha1(options.encode()).hexdigest()[:16])
+        if "survey" in job:
+            key += "\t%s:%d" %(job["survey"], job["index"])
+        return key
+
+    def __contains__(self, job):
+        return self.key(job) in self.done
+
+    def add(self, job):
+        k = self.key(job)
+        if k not in self.done:
+            self.done.add(k)
+            with open(self.filename, "a") as f:
+                f.write(k+"\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+#==============================================================================
+def watch(folder, model="ColeCole", options=None, outputs=None, n_workers=None,
+          interval=10, ext=".dat", work_dir=None, ledger=None, stop_after=None):
+    """
+    Watches a folder and inverts new data files as they arrive
+    A file is queued once its size and modification time stay the same
+    for one polling interval (seconds), so partly written files are left alone
+    Outputs are written by the workers relative to work_dir
+    (default: current working directory)
+    Files listed in the ledger (default: work_dir/Results/.bisip_ledger)
+    are skipped, failed files are retried on the next start
+    Runs until interrupted or until stop_after seconds without new files
+    """
+    work_dir = os.path.abspath(work_dir or os.getcwd())
+    if ledger is None:
+        ledger = os.path.join(work_dir, "Results", ".bisip_ledger")
+    if not os.path.exists(os.path.dirname(ledger)):
+        os.makedirs(os.path.dirname(ledger))
+    ledger = Ledger(ledger)
+    pool = mp.Pool(n_workers, initializer=init_worker, initargs=(work_dir,))
+    seen, pending, failed = {}, {}, set()
+    last_new = time.time()
+    print("\nWatching %s (Ctrl-C to stop)" %folder)
+    try:
+        while True:
+            for f in sorted(os.listdir(folder)):
+                path = os.path.abspath(os.path.join(folder, f))
+                if (not f.lower().endswith(ext)) or f.startswith(".") or (path in pending) or (path in failed):
+                    continue
+                job = make_job(path, model, options, outputs)
+                if job in ledger:
+                    continue
+                st = os.stat(path)
+                stamp = (st.st_size, st.st_mtime)
+                if seen.get(path) != stamp: # New or still being written
+                    seen[path] = stamp
+                    continue
+                pending[path] = pool.apply_async(run_job, (job,))
+                last_new = time.time()
+                print("\nQueued file:", path)
+            for path, res in list(pending.items()):
+                if res.ready():
+                    job, error, elapsed, figure_errors = res.get()
+                    del pending[path]
+                    if error is None:
+                        ledger.add(job)
+                        print("\nFinished %s in %.1f s" %(path, elapsed))
+                        if figure_errors:
+                            print("Figure errors of %s: %s" %(path, "; ".join(figure_errors)))
+                    else:
+                        failed.add(path)
+                        print("\nFailed %s:\n%s" %(path, error))
+            if (stop_after is not None) and (not pending) and (time.time() - last_new > stop_after):
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nStopping, %d files left in progress" %len(pending))
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
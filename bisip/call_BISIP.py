@@ -13,6 +13,7 @@ from builtins import str
 from builtins import range
 
 from bisip import mcmcinv
+from bisip.exporter import FigureExporter
 #from models import mcmcinv
 #import bisip.invResults as iR
 import pickle as pickle
@@ -108,40 +109,46 @@ for noise in [1]:
     ph_units = "mrad"
     
     #==============================================================================
-    # Call to the inversion function for every file
-    for i, fn in enumerate(filename):
-#    for i in range(repeat):
-#        fn = filename[0]
-        print('\nReading file:', fn, '(#%d/%d)' %(i+1,len(filename)))
-        sol.append(mcmcinv(model, fn, mcmc=mcmc_p, headers=skip_header, 
-                           ph_units=ph_units, decomp_poly=4, cc_modes=2, 
-                           c_exp=1.0, log_min_tau=None, guess_noise=False, 
-                           keep_traces=False))
+    # Figures are saved by worker threads while the next file is sampled
+    # (waits for the last figures and stops the threads, also on errors)
+    with FigureExporter(figures=["summary"]) as exporter:
     
-        """Plot fit and data ?"""
-#        sol[i].plot_fit(save=True, draw=True)
-        """Save results ?"""
-#        sol[i].save_results()
-#        print(sol[i].pm['peak_m'])
-        sol[i].plot_summary(save=True)
-        """Plot Debye relaxation time distribution ?"""
-#        sol[i].plot_rtd(save=True, draw=False)
+        #==============================================================================
+        # Call to the inversion function for every file
+        for i, fn in enumerate(filename):
+#        for i in range(repeat):
+#            fn = filename[0]
+            print('\nReading file:', fn, '(#%d/%d)' %(i+1,len(filename)))
+            sol.append(mcmcinv(model, fn, mcmc=mcmc_p, headers=skip_header, 
+                               ph_units=ph_units, decomp_poly=4, cc_modes=2, 
+                               c_exp=1.0, log_min_tau=None, guess_noise=False, 
+                               keep_traces=False))
     
-        # rhats for n = 2...N chains
-#        r_hats = [gelman_rubin([sol[0].MDL.trace("R0", x)[:] for x in range(y)]) for y in range(2,sol[0].mcmc['nb_chain'])]
+            """Plot fit and data ?"""
+#            sol[i].plot_fit(save=True, draw=True)
+            """Save results ?"""
+#            sol[i].save_results()
+#            print(sol[i].pm['peak_m'])
+            exporter.put(sol[i])
+            """Plot Debye relaxation time distribution ?"""
+#            sol[i].plot_rtd(save=True, draw=False)
     
-        """Print numerical results ?"""
-#        sol[i].print_results()
+            # rhats for n = 2...N chains
+#            r_hats = [gelman_rubin([sol[0].MDL.trace("R0", x)[:] for x in range(y)]) for y in range(2,sol[0].mcmc['nb_chain'])]
     
-        """Plot parameter histograms ?"""
-#        fig_histo = sol[i].plot_histograms(save=True)
-#        fig_trace = sol[i].plot_traces(save=True)
+            """Print numerical results ?"""
+#            sol[i].print_results()
     
+            """Plot parameter histograms ?"""
+#            fig_histo = sol[i].plot_histograms(save=True)
+#            fig_trace = sol[i].plot_traces(save=True)
     
     
-#        """Plot parameter summary and Gelman-Rubin convergence test ?"""
-#        if False:
-#            fig_kde = iR.plot_KDE(sol, "a0", "a1", save=False)
+    
+#            """Plot parameter summary and Gelman-Rubin convergence test ?"""
+#            if False:
+#                fig_kde = iR.plot_KDE(sol, "a0", "a1", save=False)
+
 
 sol = sol[0]
 
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 09:12:44 2026
+
+Command line entry point
+bisip run manifest.json -j 8     Inverts the files of a job manifest
+bisip watch /data/folder -j 4    Inverts new files as they arrive
+bisip submit manifest.json /shared/queue    Puts the jobs of a manifest in a queue
+                                            (result store off unless --db)
+bisip worker /shared/queue -j 8  Runs jobs of a queue (on any number of nodes)
+
+Manifest (JSON):
+{"files"   : ["/data/SIP-K389055.dat", "/data/SIP-K389056.dat"],
+ "model"   : "ColeCole",
+ "options" : {"cc_modes": 2, "ph_units": "mrad", "headers": 1,
+              "mcmc": {"nb_chain": 2, "nb_iter": 20000, "nb_burn": 15000}},
+ "outputs" : {"results": true, "db": true, "traces": "npz",
+              "figures": ["fit", "traces"]},
+ "jobs"    : [{"file": "/data/Other.dat", "model": "PDecomp",
+               "options": {"decomp_poly": 4, "c_exp": 0.5}}]
+}
+"files" can also be a folder or a text file with one path per line
+"survey": a survey container (see bisip.survey) whose spectra are jobs,
+"stations": optional list of indices or sample names of the survey
+Entries of "jobs" override the manifest level model, options and outputs
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+import multiprocessing as mp
+
+from bisip.batch import init_worker, make_job, survey_jobs, run_job, watch, Ledger
+from bisip.exporter import all_figures
+from bisip import workqueue
+
+#==============================================================================
+def read_manifest(filename):
+    """
+    Returns the list of jobs of a manifest file
+    """
+    from bisip.utils import list_data_files
+    with open(filename) as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(filename))
+    model = manifest.get("model", "ColeCole")
+    options = manifest.get("options", {})
+    outputs = manifest.get("outputs", {})
+    entries = []
+    if "files" in manifest:
+        files = manifest["files"]
+        if isinstance(files, list):
+            files = [os.path.join(base, f) for f in files]
+        else:
+            files = os.path.join(base, files)
+        entries += [{"file": f} for f in list_data_files(files)]
+    entries += manifest.get("jobs", [])
+    jobs = []
+    for e in entries:
+        opt = dict(options)
+        opt.update(e.get("options", {}))
+        out = dict(outputs)
+        out.update(e.get("outputs", {}))
+        jobs.append(make_job(os.path.join(base, e["file"]), e.get("model", model), opt, out))
+    if "survey" in manifest:
+        jobs += survey_jobs(os.path.join(base, manifest["survey"]), model, options,
+                            outputs, manifest.get("stations"))
+    return jobs
+
+def share_data(jobs):
+    """
+    Loads the data of all jobs at once and puts it in shared memory
+    Returns the SharedArrays, or None if the jobs read their files
+    with different headers or phase units, or read a survey container
+    (already memory-mapped)
+    """
+    from bisip.utils import load_data
+    from bisip.sharedmem import SharedArrays
+    formats = set((j["options"].get("headers", 1), j["options"].get("ph_units", "mrad")) for j in jobs)
+    if (len(formats) != 1) or (not jobs) or any("survey" in j for j in jobs):
+        return None
+    headers, ph_units = formats.pop()
+    shared = SharedArrays(load_data([j["file"] for j in jobs], headers, ph_units))
+    for i, j in enumerate(jobs):
+        j["data_index"] = i
+    return shared
+
+def run_jobs(jobs, n_workers=1, work_dir=None, resume=True, ledger=None):
+    """
+    Runs a list of jobs on n_workers processes
+    The data files are parsed once by the parent and shared with the workers
+    With resume=True the jobs already in the ledger are skipped
+    Returns the list of (file, error) of failed jobs
+    """
+    work_dir = os.path.abspath(work_dir or os.getcwd())
+    if ledger is None:
+        ledger = os.path.join(work_dir, "Results", ".bisip_ledger")
+    if not os.path.exists(os.path.dirname(ledger)):
+        os.makedirs(os.path.dirname(ledger))
+    ledger = Ledger(ledger)
+    todo = [j for j in jobs if not (resume and (j in ledger))]
+    print("\n%d jobs, %d already done, %d to run on %d workers"
+          %(len(jobs), len(jobs)-len(todo), len(todo), n_workers))
+    shared = None
+    if n_workers > 1:
+        try:
+            shared = share_data(todo)
+        except Exception as e: # Workers read their own files
+            print("\nCould not load the data of all jobs at once (%s)" %e)
+        handle = shared.handle if shared is not None else None
+        pool = mp.Pool(n_workers, initializer=init_worker, initargs=(work_dir, handle))
+        reports = pool.imap_unordered(run_job, todo)
+    else:
+        init_worker(work_dir)
+        pool, reports = None, (run_job(j) for j in todo)
+    failed = []
+    try:
+        for i, (job, error, elapsed, figure_errors) in enumerate(reports):
+            if error is None:
+                ledger.add(job)
+                print("\n[%d/%d] Finished %s in %.1f s" %(i+1, len(todo), job["file"], elapsed))
+                if figure_errors:
+                    print("Figure errors: %s" %"; ".join(figure_errors))
+            else:
+                failed.append((job["file"], error))
+                print("\n[%d/%d] Failed %s:\n%s" %(i+1, len(todo), job["file"], error))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if shared is not None:
+            shared.close()
+    return failed
+
+#==============================================================================
+def output_flags(args):
+    """
+    Output flags of the command line that override the manifest
+    """
+    out = {}
+    if args.results is not None:
+        out["results"] = args.results
+    if args.db is not None:
+        out["db"] = args.db
+    if args.traces is not None:
+        out["traces"] = None if args.traces == "none" else args.traces
+    if args.figures is not None:
+        figures = [f for f in args.figures.split(",") if f]
+        out["figures"] = all_figures if figures == ["all"] else figures
+    if args.png:
+        out["save_as_png"] = True
+    if args.dpi is not None:
+        out["dpi"] = args.dpi
+    return out
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bisip", description="Bayesian inversion of SIP data")
+    sub = parser.add_subparsers(dest="command")
+
+    def add_common(p):
+        p.add_argument("-j", "--workers", type=int, default=1, help="number of worker processes")
+        p.add_argument("-C", "--work-dir", default=None, help="folder where outputs are written (default: current folder)")
+        p.add_argument("--ledger", default=None, help="list of finished jobs (default: WORK_DIR/Results/.bisip_ledger)")
+        add_outputs(p)
+
+    def add_outputs(p):
+        p.add_argument("--results", dest="results", action="store_true", default=None, help="save INV and STATS csv files")
+        p.add_argument("--no-results", dest="results", action="store_false")
+        p.add_argument("--db", dest="db", action="store_true", default=None, help="append results to the result store")
+        p.add_argument("--no-db", dest="db", action="store_false")
+        p.add_argument("--traces", choices=["none", "csv", "npz", "parquet", "feather"], default=None, help="save traces")
+        p.add_argument("--figures", default=None, help="comma separated figures to save (%s or all)" %",".join(all_figures))
+        p.add_argument("--png", action="store_true", help="save figures as png instead of pdf")
+        p.add_argument("--dpi", type=int, default=None)
+
+    p_run = sub.add_parser("run", help="invert the files of a job manifest")
+    p_run.add_argument("manifest", help="JSON job manifest")
+    p_run.add_argument("--no-resume", dest="resume", action="store_false", help="run jobs already in the ledger again")
+    add_common(p_run)
+
+    p_watch = sub.add_parser("watch", help="invert new files of a folder as they arrive")
+    p_watch.add_argument("folder")
+    p_watch.add_argument("-m", "--model", default="ColeCole")
+    p_watch.add_argument("--options", default="{}", help="JSON dictionary of mcmcinv options")
+    p_watch.add_argument("--interval", type=float, default=10, help="polling interval in seconds")
+    add_common(p_watch)
+
+    p_submit = sub.add_parser("submit", help="put the jobs of a manifest in a shared queue")
+    p_submit.add_argument("manifest", help="JSON job manifest")
+    p_submit.add_argument("queue", help="queue folder")
+    add_outputs(p_submit) # Workers choose their processes and folder
+
+    p_worker = sub.add_parser("worker", help="run jobs of a shared queue")
+    p_worker.add_argument("queue", help="queue folder")
+    p_worker.add_argument("-j", "--workers", type=int, default=1, help="number of worker processes")
+    p_worker.add_argument("-C", "--work-dir", default=None, help="folder where outputs are written (default: current folder)")
+    p_worker.add_argument("--ttl", type=float, default=300, help="seconds without heartbeat before a lease expires")
+    p_worker.add_argument("--max-attempts", type=int, default=3)
+    p_worker.add_argument("--poll", type=float, default=30, help="polling interval in seconds")
+    p_worker.add_argument("--wait", action="store_true", help="keep waiting for new jobs when the queue is empty")
+
+    p_status = sub.add_parser("status", help="count the jobs of a shared queue")
+    p_status.add_argument("queue", help="queue folder")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        jobs = read_manifest(args.manifest)
+        for j in jobs:
+            j["outputs"].update(output_flags(args))
+        failed = run_jobs(jobs, args.workers, args.work_dir, args.resume, args.ledger)
+        if failed:
+            print("\n%d jobs failed:" %len(failed))
+            for f, _ in failed:
+                print(f)
+        return 1 if failed else 0
+    elif args.command == "watch":
+        watch(args.folder, args.model, json.loads(args.options), output_flags(args),
+              args.workers, args.interval, work_dir=args.work_dir, ledger=args.ledger)
+        return 0
+    elif args.command == "submit":
+        jobs = read_manifest(args.manifest)
+        flags = output_flags(args)
+        flags.setdefault("db", False) # SQLite locking is unreliable on NFS, see workqueue
+        for j in jobs:
+            j["outputs"].update(flags)
+        workqueue.submit(args.queue, jobs)
+        return 0
+    elif args.command == "worker":
+        workqueue.run_workers(args.queue, args.workers, args.work_dir, args.ttl,
+                              args.max_attempts, args.poll, args.wait)
+        return 0
+    elif args.command == "status":
+        for k, v in sorted(workqueue.status(args.queue).items()):
+            print("%-7s %d" %(k, v))
+        return 0
+    parser.print_help()
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:40:12 2026
+
+Figure export pipeline
+Finished mcmcinv objects are put in a queue and worker threads render
+and save their figures while the next file is being sampled
+"""
+
+from __future__ import print_function
+
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from bisip import invResults as iR
+
+# Figures that can be exported and the plot function that draws them
+figure_functions = {"fit"             : iR.plot_fit,
+                    "rtd"             : iR.plot_rtd,
+                    "histograms"      : iR.plot_histo,
+                    "traces"          : iR.plot_traces,
+                    "summary"         : iR.plot_summary,
+                    "autocorrelation" : iR.plot_autocorr,
+                    "deviance"        : iR.plot_deviance,
+                    "log_likelihood"  : iR.plot_logp,
+                    }
+all_figures = ["fit", "rtd", "histograms", "traces", "summary",
+               "autocorrelation", "deviance", "log_likelihood"]
+
+# Usual cause of a failed figure
+failure_hints = {"summary": "need more than 1 chain for Gelman-Rubin stats"}
+
+# Matplotlib is not thread-safe: figures are rendered one at a time,
+# exporter threads only overlap rendering with sampling
+render_lock = threading.Lock()
+
+#==============================================================================
+def export_figures(sol, figures=all_figures, save_as_png=False, dpi=None, options=None):
+    """
+    Saves the listed figures of mcmcinv object (sol)
+    options: keyword arguments of the plot function of each figure,
+    e.g. {"histograms": {"no_subplots": True}}
+    A figure that fails is reported and skipped
+    Returns the list of error messages
+    """
+    options = options or {}
+    errors = []
+    for name in figures:
+        if (name == "rtd") and (sol.model not in ["PDecomp", "CCD", "RTD"]):
+            continue # No RTD for this model
+        try:
+            with render_lock:
+                figure_functions[name](sol, save=True, draw=False,
+                                       save_as_png=save_as_png, dpi=dpi,
+                                       **options.get(name, {}))
+        except Exception as e:
+            hint = ": %s" %failure_hints[name] if name in failure_hints else ""
+            errors.append("File %s: failed to save %s figure (%s)%s" %(sol.filename, name, e, hint))
+            print("\n"+errors[-1])
+    return errors
+
+#==============================================================================
+class FigureExporter(object):
+    """
+    Renders and saves figures of finished inversions in worker threads
+    All plot functions of invResults draw on their own Agg canvas, so
+    they never touch the pyplot figures of the main thread
+    Figures are rendered one at a time (see render_lock)
+
+    Use:
+    with FigureExporter(["fit", "traces"]) as exporter:
+        for f in files:
+            sol = mcmcinv('ColeCole', f)
+            exporter.put(sol)    # Returns right away
+    """
+
+    def __init__(self, figures=all_figures, n_workers=1, save_as_png=False, dpi=None, options=None):
+        self.figures = figures
+        self.save_as_png = save_as_png
+        self.dpi = dpi
+        self.options = options
+        self.errors = []
+        self._queue = Queue()
+        self._workers = [threading.Thread(target=self._work) for _ in range(n_workers)]
+        for t in self._workers:
+            t.daemon = True
+            t.start()
+
+    def put(self, sol, figures=None):
+        """
+        Queues the figures of a finished mcmcinv object
+        Pass figures to override the figures of the exporter
+        """
+        if figures is None:
+            figures = self.figures
+        self._queue.put((sol, figures))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None: # Stop signal
+                    return
+                sol, figures = job
+                self.errors += export_figures(sol, figures, self.save_as_png, self.dpi, self.options)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """
+        Blocks until all queued figures are saved
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Waits for the queue to empty and stops the workers
+        """
+        for _ in self._workers:
+            self._queue.put(None)
+        for t in self._workers:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
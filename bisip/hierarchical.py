@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 29 14:02:36 2026
+
+Hierarchical joint inversion of many spectra
+Instead of fixed priors for every sample (e.g. the prior sd of 0.01 of
+the coefficients a of PDecomp), the pooled parameters of the K samples
+share a population distribution with unknown mean and variance:
+    y_kj ~ Normal(mu_j, sigma_j**2)
+    mu_j ~ flat, sigma_j**2 ~ InverseGamma(hyper_shape, hyper_shape*s0_j**2)
+y is the parameter for Normal priors and logit((x - lower)/(upper - lower))
+for Uniform priors (so the population is unbounded, see BatchPosterior.to_free)
+and s0_j is 1 or the sd of the Normal prior
+Weakly informative spectra borrow strength from the others
+
+The K per-sample likelihoods are evaluated together: one batched forward
+call per frequency list for all samples and chains. Each iteration
+updates the parameters of every sample with random walk Metropolis
+(proposal covariance and scale tuned per sample during burn-in), then
+draws mu and sigma**2 from their conjugate conditionals
+
+Use:
+res = invert_hierarchical('/Documents/DataFiles/', 'PDecomp',
+                          mcmc={"nb_chain": 4, "nb_iter": 20000, "nb_burn": 15000})
+res.population()            # Population means and sds of the pooled parameters
+sol = res.to_mcmcinv(0)     # Results, plots, ... of sample 0
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import numpy as np
+
+from bisip.utils import load_data, unpack_data
+from bisip.kernels import decomp_kernel
+from bisip.posterior import batch_forward
+from bisip.priors import model_priors
+from bisip.library import open_library, _sort_modes
+from bisip.samplers import n_kept
+
+def tune_scales(scale, acc_rate):
+    """
+    Vectorized samplers.tune_scale
+    """
+    return scale*np.select([acc_rate < 0.001, acc_rate < 0.05, acc_rate < 0.2,
+                            acc_rate > 0.95, acc_rate > 0.75, acc_rate > 0.5],
+                           [0.1, 0.5, 0.9, 10.0, 2.0, 1.1], 1.0)
+
+#==============================================================================
+class JointPosterior(object):
+    """
+    Joint log-density of the parameters of K spectra of the same model
+    theta, y: parameters of shape (..., K, ndim), same layout as
+    BatchPosterior (names sorted), y in the unbounded parameters
+    pooled: boolean mask of the parameters with a population distribution
+    """
+
+    def __init__(self, datas, model, pooled=None, cc_modes=2, decomp_poly=4, c_exp=1.0, hyper_shape=1.0):
+        priors = model_priors(model, cc_modes, decomp_poly)
+        self.model, self.c_exp = model, c_exp
+        self.names = [p[0] for p in priors]
+        self.sizes = [p[1] for p in priors]
+        i = np.cumsum([0] + self.sizes)
+        self.slices = [slice(a, b) for (a, b) in zip(i[:-1], i[1:])]
+        self.ndim = int(i[-1])
+        self.lower, self.upper = -np.inf*np.ones(self.ndim), np.inf*np.ones(self.ndim)
+        self.mu0, self.sd0 = np.zeros(self.ndim), np.ones(self.ndim)
+        self.normal = np.zeros(self.ndim, dtype=bool)
+        for (name, size, kind, a, b), sl in zip(priors, self.slices):
+            if kind == "Uniform":
+                self.lower[sl], self.upper[sl] = a, b
+            else:
+                self.normal[sl], self.mu0[sl], self.sd0[sl] = True, a, b
+        if pooled is None: # All but the resistivity
+            pooled = [k for k in self.names if k != "R0"]
+        self.pooled = np.zeros(self.ndim, dtype=bool)
+        for k in pooled:
+            self.pooled[self.slices[self.names.index(k)]] = True
+        self.hyper_shape = hyper_shape
+        self.hyper_scale = hyper_shape*self.sd0[self.pooled]**2
+        # Data of the K spectra, grouped by frequency list
+        self.K = len(datas)
+        self.groups = []
+        for k, d in enumerate(datas):
+            freq = np.asarray(d["freq"], dtype=float)
+            for g in self.groups:
+                if np.array_equal(g["freq"], freq):
+                    g["idx"].append(k)
+                    break
+            else:
+                self.groups.append({"freq": freq, "idx": [k]})
+        for g in self.groups:
+            g["idx"] = np.array(g["idx"])
+            g["w"] = 2*np.pi*g["freq"]
+            g["zn"] = np.array([datas[k]["zn"] for k in g["idx"]])
+            g["tau"] = 1.0/np.array([datas[k]["zn_err"] for k in g["idx"]])**2
+            g["kernel"] = decomp_kernel(g["w"], decomp_poly, c_exp) if model == "PDecomp" else None
+
+    #==========================================================================
+    def from_free(self, y):
+        """
+        Parameters theta and log-determinant of the transform, per sample
+        """
+        theta = y.copy()
+        b = ~self.normal
+        width = self.upper[b] - self.lower[b]
+        s = 0.5*(1.0 + np.tanh(0.5*y[...,b]))
+        theta[...,b] = self.lower[b] + width*s
+        with np.errstate(divide="ignore"):
+            log_det = np.sum(np.log(width*s*(1.0 - s)), axis=-1)
+        return theta, log_det
+
+    def to_free(self, theta):
+        y = theta.copy()
+        b = ~self.normal
+        with np.errstate(all="ignore"):
+            s = (theta[...,b] - self.lower[b])/(self.upper[b] - self.lower[b])
+            y[...,b] = np.log(s) - np.log1p(-s)
+        return y
+
+    def unpack(self, theta):
+        return dict((k, theta[:,sl]) for (k, sl) in zip(self.names, self.slices))
+
+    def log_like(self, theta):
+        """
+        Log-likelihood (..., K) of each spectrum
+        """
+        shape = theta.shape[:-1]
+        theta = theta.reshape(-1, self.K, self.ndim)
+        ll = np.empty(theta.shape[:2])
+        with np.errstate(all="ignore"):
+            for g in self.groups:
+                p = self.unpack(theta[:,g["idx"]].reshape(-1, self.ndim))
+                for k, n in zip(self.names, self.sizes):
+                    if n == 1: # Scalar stochastics
+                        p[k] = p[k][:,0]
+                zmod = batch_forward(self.model, g["w"], p, g["kernel"], c_exp=self.c_exp)
+                r2 = (zmod.reshape((len(theta),) + g["zn"].shape) - g["zn"][np.newaxis])**2
+                ll[:,g["idx"]] = np.sum(0.5*np.log(g["tau"]/(2*np.pi)) - 0.5*g["tau"]*r2, axis=(2, 3))
+        ll[~np.isfinite(ll)] = -np.inf
+        return ll.reshape(shape)
+
+    def log_prior(self, y, mu, sigma2):
+        """
+        Log-prior (C, K) of the unbounded parameters y (C, K, ndim) of
+        every sample, given the population means mu and variances sigma2
+        (C, n_pooled) of each chain
+        """
+        p, n = self.pooled, self.normal & ~self.pooled
+        u = ~self.normal & ~self.pooled
+        lp = np.sum(-0.5*np.log(2*np.pi*sigma2[:,np.newaxis]) - 0.5*(y[...,p] - mu[:,np.newaxis])**2/sigma2[:,np.newaxis], axis=-1)
+        lp += np.sum(-0.5*((y[...,n] - self.mu0[n])/self.sd0[n])**2, axis=-1)
+        with np.errstate(divide="ignore"):
+            s = 0.5*(1.0 + np.tanh(0.5*y[...,u]))
+            lp += np.sum(np.log(s*(1.0 - s)), axis=-1) # Uniform prior of the bounded parameters
+        return lp
+
+    def draw_hyper(self, y, mu, rng):
+        """
+        Conjugate draws of the population means and variances (C, n_pooled)
+        """
+        yp = y[...,self.pooled] # (C, K, n_pooled)
+        a = self.hyper_shape + 0.5*self.K
+        b = self.hyper_scale + 0.5*np.sum((yp - mu[:,np.newaxis])**2, axis=1)
+        sigma2 = b/rng.gamma(a, size=b.shape)
+        mu = yp.mean(axis=1) + np.sqrt(sigma2/self.K)*rng.standard_normal(sigma2.shape)
+        return mu, sigma2
+
+    def initial(self, C, rng, n_draws=50, library=None, k=20):
+        """
+        Starting parameters (C, K, ndim) of each sample: the C most
+        probable of C*n_draws prior draws (and of the k nearest responses
+        of a library), modes sorted by relaxation time
+        """
+        n = C*n_draws
+        theta = np.empty((n, self.K, self.ndim))
+        b = ~self.normal
+        theta[...,b] = rng.uniform(self.lower[b], self.upper[b], size=(n, self.K, b.sum()))
+        theta[...,self.normal] = rng.normal(self.mu0[self.normal], self.sd0[self.normal], size=(n, self.K, self.normal.sum()))
+        if library is not None:
+            lib = open_library(library)
+            k = min(k, len(lib))
+            near = np.empty((k, self.K, self.ndim))
+            for g in self.groups:
+                for j, kk in enumerate(g["idx"]):
+                    near[:,kk] = lib.query(g["zn"][j], k, freq=g["freq"])[0][:k]
+            theta = np.concatenate((near, theta))
+        ll = self.log_like(theta) # (n, K)
+        best = np.argsort(-ll, axis=0)[:C] # Per sample
+        theta = np.take_along_axis(theta, best[:,:,np.newaxis], axis=0).reshape(-1, self.ndim)
+        p = _sort_modes(self.model, self.unpack(theta)) # Same mode labels in all samples
+        for (k, sl) in zip(self.names, self.slices):
+            theta[:,sl] = p[k].reshape(len(theta), -1)
+        return theta.reshape(C, self.K, self.ndim)
+
+#==============================================================================
+def hierarchical(post, mc_p, rng):
+    """
+    Metropolis-within-Gibbs sampler of a JointPosterior
+    Returns the kept parameters (C, n_kept, K, ndim), population means
+    and variances (C, n_kept, n_pooled) and a dictionary of info
+    """
+    C, K, D = mc_p["nb_chain"], post.K, post.ndim
+    n_iter, n_burn, thin = mc_p["nb_iter"], mc_p["nb_burn"], mc_p["thin"]
+    theta = post.initial(C, rng, mc_p.get("init_draws", 50), mc_p.get("library"), mc_p.get("library_k", 20))
+    y = post.to_free(theta)
+    mu = y[...,post.pooled].mean(axis=1)
+    sigma2 = np.maximum(y[...,post.pooled].var(axis=1), post.hyper_scale/post.hyper_shape)
+    ll = post.log_like(theta)
+    L = np.tile(np.diag(0.1*mc_p["prop_scale"]*np.where(post.normal, post.sd0, 1.0)), (K, 1, 1))
+    scale = np.ones(K)
+    keep = n_kept(mc_p)
+    draws = np.empty((C, keep, K, D))
+    hyper = np.empty((2, C, keep, post.pooled.sum()))
+    every = max(n_burn//500, 1) # Thinned burn-in history for the covariances
+    history = np.empty((max(n_burn//every, 1), C, K, D))
+    accepted, tried, n_acc, j = np.zeros(K), 0, np.zeros(K), 0
+    for i in range(n_iter):
+        # Parameters of all samples and chains in one batched call
+        prop = y + scale[:,np.newaxis]*np.einsum("kde,cke->ckd", L, rng.standard_normal((C, K, D)))
+        ll_prop = post.log_like(post.from_free(prop)[0])
+        lp = ll + post.log_prior(y, mu, sigma2)
+        lp_prop = ll_prop + post.log_prior(prop, mu, sigma2)
+        accept = np.log(rng.rand(C, K)) < lp_prop - lp
+        y[accept], ll[accept] = prop[accept], ll_prop[accept]
+        accepted += accept.sum(axis=0)
+        tried += C
+        # Population means and variances
+        mu, sigma2 = post.draw_hyper(y, mu, rng)
+        if i < n_burn:
+            if i % every == 0 and i//every < len(history):
+                history[i//every] = y
+            h = (i + 1)//every
+            if mc_p["adaptive"] and (i+1 >= mc_p["cov_delay"]) and ((i+1) % mc_p["cov_inter"] == 0) and h >= 4:
+                past = history[h//2:h] # Forget the start
+                past = (past - past.mean(axis=0)).transpose(2, 0, 1, 3).reshape(K, -1, D) # Within-chain
+                cov = np.einsum("knd,kne->kde", past, past)/(past.shape[1] - 1)
+                cov += np.eye(D)*(1e-8*np.diagonal(cov, axis1=1, axis2=2)[:,:,np.newaxis] + 1e-20)
+                L = np.linalg.cholesky(cov*2.38**2/D)
+            if (i+1) % mc_p["tune_inter"] == 0:
+                scale = tune_scales(scale, accepted/tried)
+                accepted, tried = np.zeros(K), 0
+        else:
+            n_acc += accept.sum(axis=0)
+            if (i - n_burn) % thin == 0:
+                draws[:,j] = post.from_free(y)[0]
+                hyper[0,:,j], hyper[1,:,j] = mu, sigma2
+                j += 1
+    acc = n_acc/max(C*(n_iter - n_burn), 1)
+    return draws, hyper[0], hyper[1], {"acceptance": acc.mean(), "sample_acceptance": acc}
+
+#==============================================================================
+class HierarchicalResult(object):
+    """
+    Draws of a hierarchical joint inversion
+    theta: parameters (n_chain, n_draws, K, ndim) of each sample
+    mu, sigma2: population means and variances (n_chain, n_draws, n_pooled)
+    of the pooled parameters, in the unbounded parameters
+    """
+
+    def __init__(self, post, files, datas, theta, mu, sigma2, info, options):
+        self.post, self.files, self.datas = post, files, datas
+        self.theta, self.mu, self.sigma2 = theta, mu, sigma2
+        self.info, self.options = info, options
+        self.names, self.slices = post.names, post.slices
+        self.pooled = [k for (k, sl) in zip(post.names, post.slices) if post.pooled[sl].all()]
+
+    def sample(self, k):
+        """
+        Dictionary of the draws (n, size) of each parameter of sample k
+        """
+        th = self.theta[:,:,k].reshape(-1, self.post.ndim)
+        return dict((n, th[:,sl]) for (n, sl) in zip(self.names, self.slices))
+
+    def summary(self):
+        """
+        Posterior mean and sd of each parameter, for each sample
+        """
+        return [dict((n, (v.mean(axis=0), v.std(axis=0))) for (n, v) in self.sample(k).items())
+                for k in range(self.post.K)]
+
+    def population(self):
+        """
+        Population mean (back in the parameter units) and sd (in the
+        unbounded parameters) of each pooled parameter
+        """
+        mu = np.zeros(self.post.ndim)
+        mu[self.post.pooled] = self.mu.reshape(-1, self.mu.shape[-1]).mean(axis=0)
+        center = self.post.from_free(mu)[0]
+        sd = np.zeros(self.post.ndim)
+        sd[self.post.pooled] = np.sqrt(self.sigma2.reshape(-1, self.sigma2.shape[-1])).mean(axis=0)
+        return dict((n, (center[sl], sd[sl])) for (n, sl) in zip(self.names, self.slices) if n in self.pooled)
+
+    def to_mcmcinv(self, k, **kwargs):
+        """
+        mcmcinv object of sample k with the hierarchical draws replayed
+        in its pymc model (sampler "replay"), for the results, plots
+        and saved files of bisip
+        """
+        from bisip.models import mcmcinv
+        options = dict(self.options)
+        options.update(kwargs)
+        mcmc = dict(options.pop("mcmc"), sampler="replay",
+                    replay={"names": self.names, "draws": self.theta[:,:,k],
+                            "acceptance": self.info["sample_acceptance"][k]})
+        mcmc.pop("library", None) # Already started
+        return mcmcinv(self.post.model, self.files[k], mcmc=mcmc, data=self.datas[k], **options)
+
+def invert_hierarchical(source, model, pooled=None, mcmc=None, headers=1, ph_units="mrad",
+                        cc_modes=2, decomp_poly=4, c_exp=1.0, hyper_shape=1.0, seed=None):
+    """
+    Joint inversion of the data files of source (folder, manifest or list,
+    see utils.list_data_files) with population distributions of the
+    pooled parameters (default: all but R0)
+    Models: ColeCole, Dias, Shin and PDecomp
+    mcmc: same parameters as mcmcinv (sampler and n_jobs are not used);
+    "library" starts the samples from a bisip.library.ResponseLibrary
+    Returns a HierarchicalResult
+    """
+    from bisip.models import mcmcinv
+    mc_p = dict(mcmcinv.default_mcmc)
+    mc_p.update(mcmc or {})
+    packed = load_data(source, headers, ph_units)
+    files = list(packed["files"])
+    datas = [unpack_data(packed, i) for i in range(len(files))]
+    post = JointPosterior(datas, model, pooled, cc_modes, decomp_poly, c_exp, hyper_shape)
+    print("\nHierarchical inversion of %d spectra (%s), pooled parameters: %s"
+          %(post.K, model, [k for (k, sl) in zip(post.names, post.slices) if post.pooled[sl].all()]))
+    rng = np.random.RandomState(seed)
+    start = time.time()
+    theta, mu, sigma2, info = hierarchical(post, mc_p, rng)
+    info.update(time=time.time() - start, names=post.names)
+    print("\nHierarchical sampler: %d chains x %d draws x %d spectra in %.1f s"
+          %(theta.shape[0], theta.shape[1], post.K, info["time"]))
+    options = {"mcmc": mc_p, "headers": headers, "ph_units": ph_units, "cc_modes": cc_modes,
+               "decomp_poly": decomp_poly, "c_exp": c_exp}
+    return HierarchicalResult(post, files, datas, theta, mu, sigma2, info, options)
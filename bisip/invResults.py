@@ -42,6 +42,9 @@ from builtins import range
 from past.utils import old_div
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib import mlab
 from matplotlib.pyplot import rcParams
 from matplotlib.ticker import MaxNLocator
 from matplotlib.ticker import LogLocator
@@ -50,10 +53,20 @@ import numpy as np
 from os import path, makedirs
 from os import getcwd
 from math import ceil
+from datetime import datetime
+import sqlite3
+import zipfile
+from past.builtins import basestring
 from pymc import raftery_lewis, gelman_rubin, geweke
 from scipy.stats import norm, gaussian_kde
 from bisip.utils import get_data, get_model_type, save_figure
-from bisip.utils import var_depth, flatten, find_nearest
+from bisip.utils import var_depth, flatten, find_nearest, decimate_trace
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None # Parquet and Feather traces not available
 
 import matplotlib as mpl
 mpl.rc_file_defaults()
@@ -142,6 +155,25 @@ subplots_to_ignore = [
                       'peak_m', 'log_peak_tau', 'log_peak_m', 
                       ]
 
+#==============================================================================
+def new_figure(figsize=None):
+    """
+    Replaces plt.figure in all plot functions
+    Figures are drawn on their own Agg canvas with the object-oriented API
+    and never touch pyplot's global state, so the plot functions can be
+    called from a worker thread (see bisip.exporter)
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+def subplots(nrows=1, ncols=1, figsize=None, **kwargs):
+    """
+    Replaces plt.subplots in all plot functions
+    """
+    fig = new_figure(figsize=figsize)
+    return fig, fig.subplots(nrows, ncols, **kwargs)
+
 #==============================================================================
 def print_resul(sol):
     """
@@ -167,16 +199,23 @@ def print_resul(sol):
             print(l, np.atleast_1d(pm[v]), '+/-', np.atleast_1d(pm[e]), np.char.mod('(%.2f%%)',abs(100*pm[e]/pm[v])))
         else:
             print(l, np.atleast_1d(pm[v]), '+/-', np.atleast_1d(pm[e]))
+    info = getattr(sol, "sampler_info", None)
+    if info is not None and "log_evidence" in info:
+        print('Log-evidence:', format(info["log_evidence"], '.3f'))
+    if info is not None and "ess" in info:
+        print('Effective sample size:', format(info["ess"], '.0f'), 'of', info["n_draws"], 'reweighted draws')
             
             
 def plot_data(filename, headers, ph_units, save=False, 
-              save_as_png=False, dpi=None, fig_nb=None):
+              save_as_png=False, dpi=None, fig_nb=None, data=None):
     """
     Plots data before doing inversion
     Pass full file path, number of headers and phase units
+    or an already loaded data dictionary
     """
     ext = ['png' if save_as_png else 'pdf'][0]
-    data = get_data(filename,headers,ph_units)
+    if data is None:
+        data = get_data(filename,headers,ph_units)
 
     # Graphiques du data
     Z = data["Z"]
@@ -189,38 +228,34 @@ def plot_data(filename, headers, ph_units, save=False,
     Amp_dat = data["amp"]
     Amp_err = data["amp_err"]
 
-    fig, ax = plt.subplots(2, 2, figsize=(8,5), sharex=True)
+    fig, ax = subplots(2, 2, figsize=(8,5), sharex=True)
     # Real-Imag
-    plt.axes(ax[0,0])
-    plt.errorbar(f, zn_dat.real, zn_err.real, None, fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
+    ax[0,0].errorbar(f, zn_dat.real, zn_err.real, None, fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
     ax[0,0].set_xscale("log")
-    plt.ylabel(sym_labels['realrho'])
+    ax[0,0].set_ylabel(sym_labels['realrho'])
     
-    plt.axes(ax[0,1])
-    plt.errorbar(f, -zn_dat.imag, zn_err.imag, None, fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
+    ax[0,1].errorbar(f, -zn_dat.imag, zn_err.imag, None, fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
     ax[0,1].set_xscale("log")
-    plt.ylabel(sym_labels['imagrho'])
+    ax[0,1].set_ylabel(sym_labels['imagrho'])
 
     # Freq-Phas
-    plt.axes(ax[1,1])
-    plt.errorbar(f, -Pha_dat, Pha_err, None, fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
+    ax[1,1].errorbar(f, -Pha_dat, Pha_err, None, fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
     ax[1,1].set_yscale("log", nonposy='clip')
     ax[1,1].set_xscale("log")
-    plt.xlabel(sym_labels['freq'])
-    plt.ylabel(sym_labels['phas'])
+    ax[1,1].set_xlabel(sym_labels['freq'])
+    ax[1,1].set_ylabel(sym_labels['phas'])
 
     # Adjust for low or high phase response
     if  (-Pha_dat < 1).any() and (-Pha_dat >= 0.1).any():
-        plt.ylim([0.1,10**np.ceil(max(np.log10(-Pha_dat)))])  
+        ax[1,1].set_ylim([0.1,10**np.ceil(max(np.log10(-Pha_dat)))])  
     if  (-Pha_dat < 0.1).any() and (-Pha_dat >= 0.01).any():
-        plt.ylim([0.01,10**np.ceil(max(np.log10(-Pha_dat)))]) 
+        ax[1,1].set_ylim([0.01,10**np.ceil(max(np.log10(-Pha_dat)))]) 
     
     # Freq-Ampl
-    plt.axes(ax[1,0])
-    plt.errorbar(f, Amp_dat, Amp_err, None, fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
+    ax[1,0].errorbar(f, Amp_dat, Amp_err, None, fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
     ax[1,0].set_xscale("log")
-    plt.xlabel(sym_labels['freq'])
-    plt.ylabel(sym_labels['resi'])
+    ax[1,0].set_xlabel(sym_labels['freq'])
+    ax[1,0].set_ylabel(sym_labels['resi'])
 
     for a in ax.flat:
         a.grid('on')
@@ -231,7 +266,6 @@ def plot_data(filename, headers, ph_units, save=False,
         fn = 'DAT-%s.%s'%(filename,ext)
         save_figure(fig, subfolder='Data', fname=fn, dpi=dpi)
 
-    plt.close(fig)        
     return fig
 
 
@@ -264,65 +298,94 @@ def plot_fit(sol, save=False, draw=True,
     Amp_min = abs(sol.fit["lo95"])/Zr0
     Amp_max = abs(sol.fit["up95"])/Zr0
     
-    fig, ax = plt.subplots(2, 2, figsize=(8,5), sharex=True)
+    fig, ax = subplots(2, 2, figsize=(8,5), sharex=True)
     
     # Freq-Imag
-    plt.sca(ax[0,0])
-    plt.errorbar(f, -zn_dat.imag, zn_err.imag, None, color='k', fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
-    p=plt.plot(f, -zn_fit.imag, ls='-', label="Model",zorder=2)
-    plt.fill_between(f, -zn_max.imag, -zn_min.imag, alpha=0.4, color=p[0].get_color(), zorder=1, label='95% HPD')
-    plt.ylabel(sym_labels['imag'])
-    plt.legend(loc='best', labelspacing=0.2, handlelength=1, framealpha=1)
+    a = ax[0,0]
+    a.errorbar(f, -zn_dat.imag, zn_err.imag, None, color='k', fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
+    p=a.plot(f, -zn_fit.imag, ls='-', label="Model",zorder=2)
+    a.fill_between(f, -zn_max.imag, -zn_min.imag, alpha=0.4, color=p[0].get_color(), zorder=1, label='95% HPD')
+    a.set_ylabel(sym_labels['imag'])
+    a.legend(loc='best', labelspacing=0.2, handlelength=1, framealpha=1)
     
     # Freq-Real
-    plt.sca(ax[0,1])
-    plt.errorbar(f, zn_dat.real, zn_err.real, None, color='k', fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
-    p=plt.plot(f, zn_fit.real, ls='-', label="Model",zorder=2)
-    plt.fill_between(f, zn_max.real, zn_min.real, alpha=0.4, color=p[0].get_color(), zorder=1, label='95% HPD')
-    plt.ylabel(sym_labels['imag'])
-    plt.legend(loc='best', labelspacing=0.2, handlelength=1, framealpha=1)
+    a = ax[0,1]
+    a.errorbar(f, zn_dat.real, zn_err.real, None, color='k', fmt='o', mfc='white', markersize=5, label='Data', zorder=0)
+    p=a.plot(f, zn_fit.real, ls='-', label="Model",zorder=2)
+    a.fill_between(f, zn_max.real, zn_min.real, alpha=0.4, color=p[0].get_color(), zorder=1, label='95% HPD')
+    a.set_ylabel(sym_labels['imag'])
+    a.legend(loc='best', labelspacing=0.2, handlelength=1, framealpha=1)
     
     # Freq-Phas
-    plt.sca(ax[1,0])
-    plt.errorbar(f, -Pha_dat, Pha_err, None, fmt='o', color='k', mfc='white', markersize=5, label='Data', zorder=0)
-    p=plt.plot(f, -Pha_fit, ls='-', label='Model', zorder=2)
-    ax[1,0].set_yscale("log", nonposy='clip')
-    plt.xscale('log')
-    plt.fill_between(f, -Pha_max, -Pha_min, color=p[0].get_color(), alpha=0.4, zorder=1, label='95% HPD')
-    plt.xlabel(sym_labels['freq'])
-    plt.ylabel(sym_labels['phas'])
-    plt.legend(loc='best', labelspacing=0.2, handlelength=1, framealpha=1)
+    a = ax[1,0]
+    a.errorbar(f, -Pha_dat, Pha_err, None, fmt='o', color='k', mfc='white', markersize=5, label='Data', zorder=0)
+    p=a.plot(f, -Pha_fit, ls='-', label='Model', zorder=2)
+    a.set_yscale("log", nonposy='clip')
+    a.set_xscale('log')
+    a.fill_between(f, -Pha_max, -Pha_min, color=p[0].get_color(), alpha=0.4, zorder=1, label='95% HPD')
+    a.set_xlabel(sym_labels['freq'])
+    a.set_ylabel(sym_labels['phas'])
+    a.legend(loc='best', labelspacing=0.2, handlelength=1, framealpha=1)
 
     # Freq-Ampl
-    plt.sca(ax[1,1])
-    plt.errorbar(f, Amp_dat, Amp_err, None, fmt='o', color='k', mfc='white', markersize=5, label='Data', zorder=0)
-    p=plt.semilogx(f, Amp_fit, ls='-', label='Model', zorder=2)
-    plt.fill_between(f, Amp_max, Amp_min, color=p[0].get_color(), alpha=0.4, zorder=1, label='95% HPD')
-    plt.xscale('log')
-    plt.xlabel(sym_labels['freq'])
-    plt.ylabel(sym_labels['ampl'])
-    plt.legend(loc='best', labelspacing=0.2, handlelength=1, framealpha=1)
+    a = ax[1,1]
+    a.errorbar(f, Amp_dat, Amp_err, None, fmt='o', color='k', mfc='white', markersize=5, label='Data', zorder=0)
+    p=a.semilogx(f, Amp_fit, ls='-', label='Model', zorder=2)
+    a.fill_between(f, Amp_max, Amp_min, color=p[0].get_color(), alpha=0.4, zorder=1, label='95% HPD')
+    a.set_xscale('log')
+    a.set_xlabel(sym_labels['freq'])
+    a.set_ylabel(sym_labels['ampl'])
+    a.legend(loc='best', labelspacing=0.2, handlelength=1, framealpha=1)
 
     for a in ax.flat:
         a.grid(True)
 
-    plt.tight_layout(pad=0, h_pad=0.5, w_pad=1)
+    fig.tight_layout(pad=0, h_pad=0.5, w_pad=1)
         
     if save:
         fn = '%sFIT-%s-%s.%s'%(fig_nb,sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='Fit figures', fname=fn, dpi=dpi)
 
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
             
+def _histo_axis(sol, a, k):
+    """
+    Histogram of parameter k (name and index, e.g. m2) on axes a
+    """
+    MDL = sol.MDL
+    if k == "R0":
+        stoc = "R0"
+    else:
+        stoc =  ''.join([i for i in k if not i.isdigit()])
+        stoc_num = [int(i) for i in k if i.isdigit()]
+    try:
+        data = sorted(MDL.trace(stoc)[:][:,stoc_num[0]-1])
+    except:
+        data = sorted(MDL.trace(stoc)[:])
+    a.set_xlabel(parlbl_dic[k])
+    try:
+        hist = a.hist(data, bins=20, histtype='stepfilled', density=False, linewidth=1.0, color='0.95', alpha=1)
+        a.hist(data, bins=20, histtype='step', density=False, linewidth=1.0, alpha=1)
+        fit = norm.pdf(data, np.mean(data), np.std(data))                
+        xh = [0.5 * (hist[1][r] + hist[1][r+1]) for r in range(len(hist[1])-1)]
+        binwidth = old_div((max(xh) - min(xh)), len(hist[1]))
+        fit *= len(data) * binwidth
+        a.plot(data, fit, "-", color='k', linewidth=1)
+    except:
+        print("File %s: failed to plot %s histogram. Parameter not mobile enough (see traces)." %(sol.filename,k))
+    a.grid(False)
+    a.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
+
 def plot_histo(sol, save=False, draw=True, save_as_png=False, dpi=None, 
-               ignore=subplots_to_ignore,
+               ignore=subplots_to_ignore, no_subplots=False,
                ):    
     """
     Plots the traces of stochastic and
     deterministic parameters in mcmcinv object (sol)
     Ignores the ones in list argument ignore
+    With no_subplots=True each parameter gets its own figure
+    (saved as HST-...-parameter, a list of figures is returned)
     """
     ext = ['png' if save_as_png else 'pdf'][0]
     MDL = sol.MDL
@@ -335,38 +398,30 @@ def plot_histo(sol, save=False, draw=True, save_as_png=False, dpi=None,
             keys[i] = [k+"%d"%n for n in range(1,vect+1)]
     keys = list(flatten(keys))
 
+    if no_subplots:
+        figs = []
+        for k in keys:
+            fig, a = subplots(figsize=(4,3))
+            _histo_axis(sol, a, k)
+            a.set_ylabel("Frequency")
+            fig.tight_layout()
+            if save:
+                fn = 'HST-%s-%s-%s.%s'%(sol.model_type_str,sol.filename,k,ext)
+                save_figure(fig, subfolder='Histograms', fname=fn, dpi=dpi)
+            figs.append(fig)
+        if draw:    return figs
+        else:       return None
+
     ncols = 2
     nrows = int(ceil(len(keys)*1.0 / ncols))
-    fig, ax = plt.subplots(nrows, ncols, figsize=(8,nrows*1.8))
+    fig, ax = subplots(nrows, ncols, figsize=(8,nrows*1.8))
     for c, (a, k) in enumerate(zip(ax.flat, keys)):
-        if k == "R0":
-            stoc = "R0"
-        else:
-            stoc =  ''.join([i for i in k if not i.isdigit()])
-            stoc_num = [int(i) for i in k if i.isdigit()]
-        try:
-            data = sorted(MDL.trace(stoc)[:][:,stoc_num[0]-1])
-        except:
-            data = sorted(MDL.trace(stoc)[:])
-        plt.sca(a)
-        plt.xlabel(parlbl_dic[k])
-        try:
-            hist = plt.hist(data, bins=20, histtype='stepfilled', density=False, linewidth=1.0, color='0.95', alpha=1)
-            plt.hist(data, bins=20, histtype='step', density=False, linewidth=1.0, alpha=1)
-            fit = norm.pdf(data, np.mean(data), np.std(data))                
-            xh = [0.5 * (hist[1][r] + hist[1][r+1]) for r in range(len(hist[1])-1)]
-            binwidth = old_div((max(xh) - min(xh)), len(hist[1]))
-            fit *= len(data) * binwidth
-            plt.plot(data, fit, "-", color='k', linewidth=1)
-        except:
-            print("File %s: failed to plot %s histogram. Parameter not mobile enough (see traces)." %(sol.filename,k))
-        plt.grid(False)
-        plt.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
+        _histo_axis(sol, a, k)
     
     for c in range(nrows):
         ax[c][0].set_ylabel("Frequency")
 
-    plt.tight_layout(pad=1, w_pad=1, h_pad=0)
+    fig.tight_layout(pad=1, w_pad=1, h_pad=0)
     for a in ax.flat[ax.size - 1:len(keys) - 1:-1]:
         a.set_visible(False)
         
@@ -374,22 +429,52 @@ def plot_histo(sol, save=False, draw=True, save_as_png=False, dpi=None,
         fn = 'HST-%s-%s.%s'%(sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='Histograms', fname=fn, dpi=dpi)
     
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
 
+def _trace_axis(sol, a, k, max_points):
+    """
+    Trace of parameter k (name and index, e.g. m2) on axes a
+    """
+    MDL = sol.MDL
+    sampler = MDL.get_state()["sampler"]
+    if k == "R0":
+        stoc = "R0"
+    else:
+        stoc =  ''.join([i for i in k if not i.isdigit()])
+        stoc_num = [int(i) for i in k if i.isdigit()]
+    try:
+        data = MDL.trace(stoc)[:][:,stoc_num[0]-1]
+    except:
+        data = MDL.trace(stoc)[:]
+    x = np.arange(sampler["_burn"]+1, sampler["_iter"]+1, sampler["_thin"])
+    a.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
+    a.set_ylabel(parlbl_dic[k])    
+    a.plot(*decimate_trace(x, data, max_points), ls='-', alpha=0.8)
+    a.axhline(np.mean(data), color='k',linestyle='--', linewidth=2)
+#    plt.plot(x, np.median(data)*np.ones(len(x)), color='k',linestyle=':', linewidth=2)
+
+    if sampler["_burn"] == 0:
+        a.set_xscale('log')
+    else:
+        a.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+        
+    a.grid(False)
+
 def plot_traces(sol, save=False, draw=True, save_as_png=False, dpi=None, 
-                ignore=subplots_to_ignore,
+                ignore=subplots_to_ignore, max_points=2000, no_subplots=False,
                 ):
     """
     Plots the traces of stochastic and
     deterministic parameters in mcmcinv object (sol)
     Ignores the ones in list argument ignore
+    Traces are decimated to max_points (None to plot every iteration)
+    With no_subplots=True each parameter gets its own figure
+    (saved as TRA-...-parameter, a list of figures is returned)
     """
     ext = ['png' if save_as_png else 'pdf'][0]
         
     MDL = sol.MDL
-    sampler = MDL.get_state()["sampler"]
 
     keys = [k for k in sol.var_dict.keys() if k not in ignore]
 
@@ -399,37 +484,30 @@ def plot_traces(sol, save=False, draw=True, save_as_png=False, dpi=None,
             keys[i] = [k+"%d"%n for n in range(1,vect+1)]
             
     keys = list(flatten(keys))
+
+    if no_subplots:
+        figs = []
+        for k in keys:
+            fig, a = subplots(figsize=(4,3))
+            _trace_axis(sol, a, k, max_points)
+            a.set_xlabel("Iteration number")
+            fig.tight_layout()
+            if save:
+                fn = 'TRA-%s-%s-%s.%s'%(sol.model_type_str,sol.filename,k,ext)
+                save_figure(fig, subfolder='Traces', fname=fn, dpi=dpi)
+            figs.append(fig)
+        if draw:    return figs
+        else:       return None
+
     ncols = 2
     nrows = int(ceil(len(keys)*1.0 / ncols))
     
-    fig, ax = plt.subplots(nrows, ncols, figsize=(8,nrows*1.5), sharex=True)
+    fig, ax = subplots(nrows, ncols, figsize=(8,nrows*1.5), sharex=True)
     
     for c, (a, k) in enumerate(zip(ax.flat, keys)):
-        if k == "R0":
-            stoc = "R0"
-        else:
-            stoc =  ''.join([i for i in k if not i.isdigit()])
-            stoc_num = [int(i) for i in k if i.isdigit()]
-        try:
-            data = MDL.trace(stoc)[:][:,stoc_num[0]-1]
-        except:
-            data = MDL.trace(stoc)[:]
-        x = np.arange(sampler["_burn"]+1, sampler["_iter"]+1, sampler["_thin"])
-        plt.sca(a)
-        plt.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
-        plt.ylabel(parlbl_dic[k])    
-        plt.plot(x, data,'-', alpha=0.8)
-        plt.plot(x, np.mean(data)*np.ones(len(x)), color='k',linestyle='--', linewidth=2)
-#        plt.plot(x, np.median(data)*np.ones(len(x)), color='k',linestyle=':', linewidth=2)
-
-        if sampler["_burn"] == 0:
-            plt.xscale('log')
-        else:
-            plt.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
-            
-        plt.grid(False)
+        _trace_axis(sol, a, k, max_points)
         
-    plt.tight_layout(pad=0, w_pad=0.5, h_pad=0)
+    fig.tight_layout(pad=0, w_pad=0.5, h_pad=0)
     
     for a in ax[-1]:
         a.set_xlabel("Iteration number")
@@ -438,7 +516,6 @@ def plot_traces(sol, save=False, draw=True, save_as_png=False, dpi=None,
         fn = 'TRA-%s-%s.%s'%(sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='Traces', fname=fn, dpi=dpi)
 
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
 
@@ -449,7 +526,7 @@ def plot_KDE(sol, var1, var2, fig=None, ax=None, draw=True, save=False, save_as_
     """
     ext = ['png' if save_as_png else 'pdf'][0]
     if fig == None or ax == None:
-        fig, ax = plt.subplots(figsize=(3,3))
+        fig, ax = subplots(figsize=(3,3))
     MDL = sol.MDL
     if var1 == "R0":
         stoc1 = "R0"
@@ -482,24 +559,22 @@ def plot_KDE(sol, var1, var2, fig=None, ax=None, draw=True, save=False, save_as_
 
     ax.set_xlim(xmin, xmax)
     ax.set_ylim(ymin, ymax)
-    plt.sca(ax)
     # Contourf plot
-    plt.grid(None)
-    plt.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
-    plt.xticks(rotation=90)
-    plt.locator_params(axis = 'y', nbins = 7)
-    plt.locator_params(axis = 'x', nbins = 7)
+    ax.grid(None)
+    ax.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.locator_params(axis = 'y', nbins = 7)
+    ax.locator_params(axis = 'x', nbins = 7)
     ax.contourf(xx, yy, f, cmap=plt.cm.viridis, alpha=0.8)
     ax.scatter(x, y, color='k', s=1, zorder=2)
 
-    plt.ylabel("%s" %var2)
-    plt.xlabel("%s" %var1)
+    ax.set_ylabel("%s" %var2)
+    ax.set_xlabel("%s" %var1)
 
     if save: 
         fn = 'KDE-%s-%s.%s'%(sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='2D-KDE', fname=fn, dpi=dpi)
     
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
 
@@ -530,25 +605,24 @@ def plot_hexbin(sol, var1, var2, draw=True, save=False, save_as_png=False, dpi=N
         y = MDL.trace(stoc2)[:]
     xmin, xmax = min(x), max(x)
     ymin, ymax = min(y), max(y)
-    fig, ax = plt.subplots(figsize=(4,3))
-    plt.grid(None)
+    fig, ax = subplots(figsize=(4,3))
+    ax.grid(None)
     ax.set_xlim(xmin, xmax)
     ax.set_ylim(ymin, ymax)
-    plt.hexbin(x, y, gridsize=15, cmap=plt.cm.magma_r)
-    plt.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
-    plt.xticks(rotation=90)
-    plt.locator_params(axis = 'y', nbins = 5)
-    plt.locator_params(axis = 'x', nbins = 5)    
-    cb = plt.colorbar()
+    hb = ax.hexbin(x, y, gridsize=15, cmap=plt.cm.magma_r)
+    ax.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.locator_params(axis = 'y', nbins = 5)
+    ax.locator_params(axis = 'x', nbins = 5)    
+    cb = fig.colorbar(hb, ax=ax)
     cb.set_label('Number of observations')
-    plt.ylabel("%s" %var2)
-    plt.xlabel("%s" %var1)
+    ax.set_ylabel("%s" %var2)
+    ax.set_xlabel("%s" %var1)
 
     if save: 
         fn = 'HEX-%s-%s.%s'%(sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='Hexbins', fname=fn, dpi=dpi)
 
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
 
@@ -578,10 +652,10 @@ def plot_summary(sol, save=False, draw=True, save_as_png=False, dpi=None,
         print("\nTwo or more chains of equal length required for Gelman-Rubin convergence")
         R = len(lbls)*[None]
         
-    fig, axes = plt.subplots(figsize=(6,4))
+    fig = new_figure(figsize=(6,4))
     gs2 = gridspec.GridSpec(3, 3)
-    ax1 = plt.subplot(gs2[:, :-1])
-    ax2 = plt.subplot(gs2[:, -1], sharey = ax1)
+    ax1 = fig.add_subplot(gs2[:, :-1])
+    ax2 = fig.add_subplot(gs2[:, -1], sharey = ax1)
     for i in range(len(lbls)):
         for c in range(ch_nb):
             val_m = np.array(flatten(trac[c]))
@@ -598,7 +672,7 @@ def plot_summary(sol, save=False, draw=True, save_as_png=False, dpi=None,
     ax1.set_xlim(ax1.get_xlim())
     ax1.set_xlabel(r'Parameter value')
 
-    plt.setp(ax2.get_yticklabels(), visible=False)
+    ax2.tick_params(axis='y', labelleft=False)
     ax2.set_xlim([0.5, 5.5])
     ax2.set_xticklabels(["","1","2","3","4","5+"])
     ax2.set_xticks([0.5, 1, 2, 3, 4, 5, ])
@@ -608,8 +682,7 @@ def plot_summary(sol, save=False, draw=True, save_as_png=False, dpi=None,
     ax2.set_xlabel(r'$\hat{R}$')
     ax2.axvline(1, ls='--', color='C0', zorder=0)
 
-    plt.tight_layout()
-    plt.close(fig)        
+    fig.tight_layout()
 
     if save: 
         fn = '%sSUM-%s-%s.%s'%(fig_nb,sol.model_type_str,sol.filename,ext)
@@ -636,26 +709,24 @@ def plot_autocorr(sol, save=False, draw=True, save_as_png=False, dpi=None,
     keys = list(flatten(keys))
     ncols = 2
     nrows = int(ceil(len(keys)*1.0 / ncols))
-    fig, ax = plt.subplots(nrows, ncols, figsize=(10,nrows*2))
-    plt.ticklabel_format(style='sci', axis='both', scilimits=(0,0))
+    fig, ax = subplots(nrows, ncols, figsize=(10,nrows*2))
+    ax.flat[-1].ticklabel_format(style='sci', axis='both', scilimits=(0,0))
     for (a, k) in zip(ax.flat, keys):
         if k[-1] not in ["%d"%d for d in range(1,8)] or k =="R0":
             data = sorted(MDL.trace(k)[:].ravel())
         else:
             data = sorted(MDL.trace(k[:-1])[:][:,int(k[-1])-1].ravel())
-        plt.sca(a)
-        plt.gca().get_yaxis().get_major_formatter().set_useOffset(False)
-        plt.gca().get_xaxis().get_major_formatter().set_useOffset(False)
-        plt.yticks(fontsize=12)
-        plt.xticks(fontsize=12)
-        plt.ylabel(k, fontsize=12)
+        a.get_yaxis().get_major_formatter().set_useOffset(False)
+        a.get_xaxis().get_major_formatter().set_useOffset(False)
+        a.tick_params(labelsize=12)
+        a.set_ylabel(k, fontsize=12)
         to_thin = old_div(len(data),50)
-        if to_thin != 0: plt.xlabel("Lags / %d"%to_thin, fontsize=12)
-        else: plt.xlabel("Lags", fontsize=12)
+        if to_thin != 0: a.set_xlabel("Lags / %d"%to_thin, fontsize=12)
+        else: a.set_xlabel("Lags", fontsize=12)
         max_lags = None
         if len(data) > 50: data= data[::to_thin]
-        plt.acorr(data, usevlines=True, maxlags=max_lags, detrend=plt.mlab.detrend_mean)
-        plt.grid(None)
+        a.acorr(data, usevlines=True, maxlags=max_lags, detrend=mlab.detrend_mean)
+        a.grid(None)
     fig.tight_layout()
     for a in ax.flat[ax.size - 1:len(keys) - 1:-1]:
         a.set_visible(False)
@@ -664,7 +735,6 @@ def plot_autocorr(sol, save=False, draw=True, save_as_png=False, dpi=None,
         fn = 'AC-%s-%s.%s'%(sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='Autocorrelations', fname=fn, dpi=dpi)
 
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
 
@@ -674,7 +744,7 @@ def plot_rtd(sol, save=False, draw=True, save_as_png=False, dpi=None):
     for a polynomial decomposition or ccdt results
     """
     ext = ['png' if save_as_png else 'pdf'][0]
-    fig, ax = plt.subplots(figsize=(4,3))
+    fig, ax = subplots(figsize=(4,3))
     try:
         bot95 = 10**sol.MDL.stats()["log_m_i"]['95% HPD interval'][0]
         top95 = 10**sol.MDL.stats()["log_m_i"]['95% HPD interval'][1]
@@ -685,60 +755,61 @@ def plot_rtd(sol, save=False, draw=True, save_as_png=False, dpi=None):
         top95 = sol.MDL.stats()["m_i"]['95% HPD interval'][1]
         log_tau = 10**sol.MDL.log_tau
         log_m = sol.MDL.stats()["m_i"]['mean']            
-    plt.errorbar(log_tau, log_m, None, None, color="C7", linestyle='-', label="RTD")
+    ax.errorbar(log_tau, log_m, None, None, color="C7", linestyle='-', label="RTD")
     try:
         peaks = 10**np.atleast_1d(sol.MDL.stats()["log_peak_tau"]["mean"])
         uncer_peaks = 10**sol.MDL.stats()["log_peak_tau"]['95% HPD interval'].T.reshape(len(np.atleast_1d(sol.MDL.stats()["log_peak_tau"]['mean'])),2)
         m_peaks = log_m[[list(log_tau).index(find_nearest(log_tau, peaks[x])) for x in range(len(peaks))]]
         if len(peaks) >= 1:
-            plt.errorbar(peaks, m_peaks*1.2, None, None, color="C3", marker="v", markersize=5, linestyle="", label=r"$\tau_{peak}$")
+            ax.errorbar(peaks, m_peaks*1.2, None, None, color="C3", marker="v", markersize=5, linestyle="", label=r"$\tau_{peak}$")
             for i, u in enumerate(uncer_peaks):
-                plt.axvspan(u[0], u[1], alpha=0.2, color="C3")
+                ax.axvspan(u[0], u[1], alpha=0.2, color="C3")
     except:
         pass
-    plt.axvline(10**sol.MDL.stats()["log_half_tau"]['mean'],color="C0",linestyle=':', label=r"$\tau_{50}$")
-    plt.axvline(10**sol.MDL.stats()["log_mean_tau"]['mean'],color='C2',linestyle='--', label=r"$\bar{\tau}$")
+    ax.axvline(10**sol.MDL.stats()["log_half_tau"]['mean'],color="C0",linestyle=':', label=r"$\tau_{50}$")
+    ax.axvline(10**sol.MDL.stats()["log_mean_tau"]['mean'],color='C2',linestyle='--', label=r"$\bar{\tau}$")
     inter = 10**sol.MDL.stats()["log_half_tau"]['95% HPD interval']
-    plt.axvspan(inter[0], inter[1], alpha=0.2, color="C0")
+    ax.axvspan(inter[0], inter[1], alpha=0.2, color="C0")
     inter = 10**sol.MDL.stats()["log_mean_tau"]['95% HPD interval']
-    plt.axvspan(inter[0], inter[1], alpha=0.2, color='C2')
-    plt.axvspan(min(log_tau), min(log_tau)*10, alpha=0.1, color='C7')
-    plt.axvspan(max(log_tau)/10, max(log_tau), alpha=0.1, color='C7')
-    plt.fill_between(log_tau, bot95, top95, color="C7", alpha=0.2)
-    plt.xlim([10**np.ceil(np.log10(min(log_tau))), 10**np.floor(np.log10(max(log_tau)))])
+    ax.axvspan(inter[0], inter[1], alpha=0.2, color='C2')
+    ax.axvspan(min(log_tau), min(log_tau)*10, alpha=0.1, color='C7')
+    ax.axvspan(max(log_tau)/10, max(log_tau), alpha=0.1, color='C7')
+    ax.fill_between(log_tau, bot95, top95, color="C7", alpha=0.2)
+    ax.set_xlim([10**np.ceil(np.log10(min(log_tau))), 10**np.floor(np.log10(max(log_tau)))])
     ax.set_xlabel(r'$\tau$ (s)')
     ax.set_ylabel(r'$m$')
-    plt.grid(False)
-    plt.legend(fontsize=9, loc=1,labelspacing=0.2, handlelength=1.5)
-    plt.xscale('log')
-    plt.yscale('log', nonposy='clip')
+    ax.grid(False)
+    ax.legend(fontsize=9, loc=1,labelspacing=0.2, handlelength=1.5)
+    ax.set_xscale('log')
+    ax.set_yscale('log', nonposy='clip')
     fig.tight_layout()
     if save: 
         fn = 'RTD-%s-%s.%s'%(sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='RTD', fname=fn, dpi=dpi)
 
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
 
-def plot_deviance(sol, save=False, draw=True, save_as_png=False, dpi=None):
+def plot_deviance(sol, save=False, draw=True, save_as_png=False, dpi=None,
+                  max_points=2000):
     """
     Plots the model deviance trace
+    Trace is decimated to max_points (None to plot every iteration)
     """
     ext = ['png' if save_as_png else 'pdf'][0]
-    fig, ax = plt.subplots(figsize=(4,3))
+    fig, ax = subplots(figsize=(4,3))
     deviance = sol.MDL.trace('deviance')[:]
     sampler_state = sol.MDL.get_state()["sampler"]
     x = np.arange(sampler_state["_burn"]+1, sampler_state["_iter"]+1, sampler_state["_thin"])
-    plt.plot(x, deviance, "-", color="C3", label="DIC = %d\nBPIC = %d" %(sol.MDL.DIC,sol.MDL.BPIC))
-    plt.xlabel("Iteration")
-    plt.ylabel("Model deviance")
-    plt.legend(numpoints=1, loc="best", fontsize=9)
-    plt.grid('on')
+    ax.plot(*decimate_trace(x, deviance, max_points), ls="-", color="C3", label="DIC = %d\nBPIC = %d" %(sol.MDL.DIC,sol.MDL.BPIC))
+    ax.set_xlabel("Iteration")
+    ax.set_ylabel("Model deviance")
+    ax.legend(numpoints=1, loc="best", fontsize=9)
+    ax.grid('on')
     if sampler_state["_burn"] == 0:
-        plt.xscale('log')
+        ax.set_xscale('log')
     else:
-        plt.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+        ax.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
     ax.yaxis.set_major_locator(MaxNLocator(integer=True))
     fig.tight_layout()
     
@@ -746,7 +817,6 @@ def plot_deviance(sol, save=False, draw=True, save_as_png=False, dpi=None):
         fn = 'MDEV-%s-%s.%s'%(sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='ModelDeviance', fname=fn, dpi=dpi)
 
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
 
@@ -758,6 +828,7 @@ def logp_trace(model):
     db = model.db
     n_samples = db.trace('deviance').length()
     logp = np.empty(n_samples, np.double)
+    current = dict((s, s.value) for s in model.stochastics)
     #loop over all samples
     for i_sample in range(n_samples):
         #set the value of all stochastic to their 'i_sample' value
@@ -771,25 +842,30 @@ def logp_trace(model):
 
         #get logp
         logp[i_sample] = model.logp
+    #restore the values the model had before
+    for stochastic, value in current.items():
+        stochastic.value = value
     return logp
 
-def plot_logp(sol, save=False, draw=True, save_as_png=False, dpi=None):
+def plot_logp(sol, save=False, draw=True, save_as_png=False, dpi=None,
+              max_points=2000):
     """
     Plots the model log-likelihood
+    Trace is decimated to max_points (None to plot every iteration)
     """
     ext = ['png' if save_as_png else 'pdf'][0]
-    fig, ax = plt.subplots(figsize=(4,3))
+    fig, ax = subplots(figsize=(4,3))
     logp = logp_trace(sol.MDL)
     sampler_state = sol.MDL.get_state()["sampler"]
     x = np.arange(sampler_state["_burn"]+1, sampler_state["_iter"]+1, sampler_state["_thin"])
-    plt.plot(x, logp, "-")
-    plt.xlabel("Iteration")
-    plt.ylabel("Log-likelihood")
-    plt.grid('on')
+    ax.plot(*decimate_trace(x, logp, max_points), ls="-")
+    ax.set_xlabel("Iteration")
+    ax.set_ylabel("Log-likelihood")
+    ax.grid('on')
     if sampler_state["_burn"] == 0:
-        plt.xscale('log')
+        ax.set_xscale('log')
     else:
-        plt.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+        ax.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
     ax.yaxis.set_major_locator(MaxNLocator(integer=True))
     fig.tight_layout()
     
@@ -797,10 +873,33 @@ def plot_logp(sol, save=False, draw=True, save_as_png=False, dpi=None):
         fn = 'LOGP-%s-%s.%s'%(sol.model_type_str,sol.filename,ext)
         save_figure(fig, subfolder='LogLikelihood', fname=fn, dpi=dpi)
 
-    plt.close(fig)        
     if draw:    return fig
     else:       return None
 
+def trace_columns(sol):
+    """
+    Generator over the traces of mcmcinv object (sol), one column at a time
+    Yields (name, 1D array) pairs using the trace file naming scheme:
+    rho_max, then all variables sorted by name with one column per
+    component (a1, a2, ...) and zmod split in zmod1.real ... zmod1.imag ...
+    Columns are views on the trace store, nothing is concatenated
+    """
+    pm_names = sorted(sol.var_dict.keys())
+    for p, name in enumerate(pm_names):
+        trace = sol.var_dict[name].trace()
+        trace = trace.reshape(len(trace), -1)
+        if p == 0: # Normalization resistivity in first column
+            yield 'rho_max', np.full(len(trace), sol.data['Z_max'])
+        depth = trace.shape[1]
+        if depth == 1:
+            headers = [name]
+        elif 'zmod' in name: # Real and imaginary parts
+            headers = ['%s%d.real'%(name,x+1) for x in range(depth//2)] + ['%s%d.imag'%(name,x+1) for x in range(depth//2)]
+        else:
+            headers = ['%s%d'%(name,x+1) for x in range(depth)]
+        for h, head in enumerate(headers):
+            yield head, trace[:,h]
+
 def save_csv_traces(sol):
     """
     Saves the traces contained in mcmcinv 
@@ -813,33 +912,10 @@ def save_csv_traces(sol):
     working_path = getcwd().replace("\\", "/")+"/"
     save_path = working_path + save_where + "%s/"%sol.filename # Add subfolder for the sample
     
-    # Get stochastics and deterministics
-#    sto = MDL.stochastics
-#    det = MDL.deterministics
-    # Get names of parameters for save file
-    pm_names = sorted(sol.var_dict.keys())
-    
-    # Get all stochastic and deterministic variables
-    trl = [sol.var_dict[x] for x in pm_names]
-
     # Concatenate all traces in 1 matrix
-    trace_mat = np.hstack([t.trace().reshape(-1, var_depth(t)) for t in trl])
-    # Insert normalization resistivity in first column
-    trace_mat = np.insert(trace_mat, 0, sol.data['Z_max'], axis=1) 
-
-    # Get numbers for each subheader
-    num_names = [var_depth(v) for v in trl]    
-    # Make list of headers
-    headers = [['%s%d'%(pm_names[p],x+1) for x in range(num_names[p])] if num_names[p] > 1 else [pm_names[p]] for p in range(len(pm_names))]
-    
-    # Change zmod numbers for real and imaginary parts
-    for h, head in enumerate(headers):
-        if 'zmod' in head[0]:   
-            headers[h] = [head[i]+'.real' for i in range(int(len(head)/2))] + [head[i]+'.imag' for i in range(int(len(head)/2))]    
-    
-    flat_headers = [item for sublist in headers for item in sublist] # Flaten list 
-    flat_headers.insert(0, 'rho_max') # Insert normalization resistivity in first column
-    header = ','.join(flat_headers) # Join list into csv string 
+    columns = list(trace_columns(sol))
+    trace_mat = np.column_stack([c[1] for c in columns])
+    header = ','.join([c[0] for c in columns]) # Join list into csv string 
     
     # Do the saving
     print("\nSaving CSV traces in:\n", save_path)
@@ -847,18 +923,66 @@ def save_csv_traces(sol):
         makedirs(save_path)
     np.savetxt(save_path+'TRACES_%s-%s_%s.csv' %(sol.model,sol.model_type_str,sol.filename), trace_mat, delimiter=',', header=header, comments="")
 
-def save_resul(sol):
-    # Fonction pour enregistrer les résultats
-    MDL, pm = sol.MDL, sol.pm
-    model = sol.model_type_str
-    sample_name = sol.filename
-    save_where = '/Results/'
+def save_binary_traces(sol, fmt="npz", chunk_size=10000):
+    """
+    Saves the traces contained in mcmcinv object sol
+    to a compressed columnar binary file with the same column
+    names as save_csv_traces
+    fmt = "npz"     : one compressed array per column, written one
+                      column at a time (always available)
+          "parquet" : row groups of chunk_size iterations (needs pyarrow)
+          "feather" : record batches of chunk_size iterations (needs pyarrow)
+    call with sol.save_binary_traces()
+    Load with np.load(f)["zmod1.real"] or pandas.read_parquet(f)
+    """
+    if (fmt in ["parquet", "feather"]) and (pa is None):
+        print("\npyarrow not available, saving %s traces as npz instead" %fmt)
+        fmt = "npz"
+
+    # Decide where to save the traces
+    save_where = '/TraceResults/'
     working_path = getcwd().replace("\\", "/")+"/"
-    save_path = working_path+save_where+"%s/"%sample_name
-    print("\nSaving csv file in:\n", save_path)
+    save_path = working_path + save_where + "%s/"%sol.filename # Add subfolder for the sample
+    fname = save_path+'TRACES_%s-%s_%s.%s' %(sol.model,sol.model_type_str,sol.filename,fmt)
+
+    print("\nSaving %s traces in:\n" %fmt, save_path)
     if not path.exists(save_path):
         makedirs(save_path)
-    if sol.model == 'PDecomp': 
+
+    if fmt == "npz":
+        # Same layout as np.savez_compressed but streamed column by column
+        with zipfile.ZipFile(fname, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for name, column in trace_columns(sol):
+                with zf.open(name+'.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.ascontiguousarray(column), allow_pickle=False)
+        return
+
+    columns = list(trace_columns(sol))
+    n_rows = len(columns[0][1])
+    chunks = (pa.Table.from_arrays([pa.array(c[i:i+chunk_size]) for (_, c) in columns],
+                                   names=[n for (n, _) in columns])
+              for i in range(0, n_rows, chunk_size))
+    first = next(chunks)
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(fname, first.schema, compression='zstd')
+    elif fmt == "feather":
+        writer = pa.ipc.new_file(fname, first.schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    else:
+        raise ValueError("Unknown trace format: %s" %fmt)
+    with writer:
+        writer.write_table(first)
+        for table in chunks:
+            writer.write_table(table)
+
+def result_columns(sol, prefix=""):
+    """
+    Flattens the results of mcmcinv object (sol) to one row
+    Returns the list of column names and the array of values
+    Vector parameters get one column per component (key_1, key_1_std, ...)
+    Pass prefix to prepend a string to the parameter columns
+    """
+    pm = sol.pm
+    if sol.model in ['PDecomp', 'RTD']: 
         tag = 0
     else: 
         tag = 1
@@ -867,8 +991,9 @@ def save_resul(sol):
     headers = []
     keys = sorted(pm.keys())
     if sol.model in ["CCD", "PDecomp"]:
-        keys += [keys.pop(keys.index("peak_tau"))] # Move to end
-        keys += [keys.pop(keys.index("peak_m"))] # Move to end
+        for k in ["peak_tau", "peak_m"]:
+            if k in keys:
+                keys += [keys.pop(keys.index(k))] # Move to end
 
     keys = [k for k in keys if "_std" not in k]
         
@@ -881,15 +1006,15 @@ def save_resul(sol):
 
         if length > 1:
             for i in range(len(A[c])):
-                headers.append(model+"_"+key+"_%d" %(i+tag))
-                headers.append(model+"_"+key+("_%d"%(i+tag))+"_std")
+                headers.append(prefix+key+"_%d" %(i+tag))
+                headers.append(prefix+key+("_%d"%(i+tag))+"_std")
         else:           
             if (key == "peak_tau")|(key == "peak_m"):
-                headers.append(model+"_"+key+"_1")
-                headers.append(model+"_"+key+"_1"+"_std")                
+                headers.append(prefix+key+"_1")
+                headers.append(prefix+key+"_1"+"_std")                
             else: 
-                headers.append(model+"_"+key)
-                headers.append(model+"_"+key+"_std")
+                headers.append(prefix+key)
+                headers.append(prefix+key+"_std")
 
     A=flatten(A)
     B=flatten(B)
@@ -897,24 +1022,137 @@ def save_resul(sol):
     results = [None]*(len(A)+len(B))
     results[::2] = A
     results[1::2] = B
-
-    headers = ','.join(headers)
     results = np.array(results)
 
-    if sol.model == 'PDecomp': 
+    if sol.model in ['PDecomp', 'RTD']: 
         tau_ = sol.data["tau"]
-        add = ["%s_tau"%model+"%d"%(i) for i in range(len(tau_))]
-        add = ','.join(add) + ',' 
-        headers = add+headers
+        headers = ["%stau"%prefix+"%d"%(i) for i in range(len(tau_))] + headers
         results = np.concatenate((tau_,results))
-    headers = "Z_max,Input_c_exponent," + headers
+    headers = ["Z_max", "Input_c_exponent"] + headers
     results = np.concatenate((np.array([sol.data["Z_max"]]),np.array([sol.c_exp]),results))
+    return headers, results
+
+def save_resul(sol):
+    # Fonction pour enregistrer les résultats
+    MDL = sol.MDL
+    model = sol.model_type_str
+    sample_name = sol.filename
+    save_where = '/Results/'
+    working_path = getcwd().replace("\\", "/")+"/"
+    save_path = working_path+save_where+"%s/"%sample_name
+    print("\nSaving csv file in:\n", save_path)
+    if not path.exists(save_path):
+        makedirs(save_path)
+    headers, results = result_columns(sol, prefix=model+"_")
     np.savetxt(save_path+'INV_%s-%s_%s.csv' %(sol.model,model,sample_name), results[None],
-               header=headers, comments='', delimiter=',')
+               header=','.join(headers), comments='', delimiter=',')
     vars_ = ["%s"%x for x in MDL.stochastics]+["%s"%x for x in MDL.deterministics]
     if "zmod" in vars_: vars_.remove("zmod")
     MDL.write_csv(save_path+'STATS_%s-%s_%s.csv' %(sol.model,model,sample_name), variables=(vars_))
 
+#==============================================================================
+# Indexed result store
+# One SQLite file with one row per (sample, model, model type, run)
+# and one column per result (see result_columns)
+default_db = "BISIP_results.db"
+db_keys = ["Sample_ID", "model", "model_type", "run", "date", "filepath"]
+
+def connect_db(db_name=None):
+    """
+    Opens (and creates if needed) the result store
+    Default location is Results/BISIP_results.db in the working directory
+    """
+    if db_name is None:
+        save_path = getcwd().replace("\\", "/")+"/Results/"
+        if not path.exists(save_path):
+            try:
+                makedirs(save_path)
+            except OSError: # Created by another worker in the meantime
+                if not path.isdir(save_path): raise
+        db_name = save_path+default_db
+    con = sqlite3.connect(db_name, timeout=60)
+    with con:
+        con.execute("""CREATE TABLE IF NOT EXISTS results (
+                       Sample_ID TEXT NOT NULL, model TEXT NOT NULL,
+                       model_type TEXT NOT NULL, run INTEGER NOT NULL,
+                       date TEXT NOT NULL, filepath TEXT,
+                       PRIMARY KEY (Sample_ID, model, model_type, run))""")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_model ON results (model, model_type)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_date ON results (date)")
+    return con
+
+def save_resul_db(sol, db_name=None):
+    """
+    Appends the results of mcmcinv object (sol) to the result store
+    Each call adds a new run for the sample and model in one transaction
+    Returns the run number
+    call with sol.save_results_db()
+    """
+    headers, results = result_columns(sol)
+    con = connect_db(db_name)
+    print("\nAppending results of %s to result store" %sol.filename)
+    try:
+        con.execute("BEGIN IMMEDIATE") # Lock the store until commit
+        existing = set(r[1].lower() for r in con.execute("PRAGMA table_info(results)")) # Column names are case-insensitive
+        for h in headers:
+            if h.lower() not in existing:
+                con.execute('ALTER TABLE results ADD COLUMN "%s" REAL' %h)
+                existing.add(h.lower())
+        run = con.execute("""SELECT COALESCE(MAX(run), 0) + 1 FROM results
+                             WHERE Sample_ID=? AND model=? AND model_type=?""",
+                          (sol.filename, sol.model, sol.model_type_str)).fetchone()[0]
+        row = [sol.filename, sol.model, sol.model_type_str, run,
+               datetime.now().strftime('%Y-%m-%d %H:%M:%S'), sol.filepath]
+        row += [float(x) for x in results]
+        columns = ','.join(['"%s"'%h for h in db_keys+headers])
+        con.execute("INSERT INTO results (%s) VALUES (%s)" %(columns, ','.join('?'*len(row))), row)
+        con.commit()
+    except:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+    return run
+
+def query_results(db_name=None, sample=None, model=None, model_type=None,
+                  since=None, until=None, last_run=False):
+    """
+    Returns a pandas DataFrame of the result store indexed by Sample_ID
+    Filter by sample name(s), model, model type (e.g. "DD", "CC2")
+    and date ("YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS")
+    Pass last_run=True to keep only the latest run of each sample
+    Columns that are empty for the selection are dropped
+    """
+    import pandas as pd
+    where, args = [], []
+    if sample is not None:
+        sample = [sample] if isinstance(sample, basestring) else list(sample)
+        where.append("Sample_ID IN (%s)" %','.join('?'*len(sample)))
+        args += sample
+    for key, val in [("model", model), ("model_type", model_type)]:
+        if val is not None:
+            where.append("%s = ?" %key)
+            args.append(val)
+    if since is not None:
+        where.append("date >= ?")
+        args.append(since)
+    if until is not None:
+        where.append("date <= ?")
+        args.append(until)
+    if last_run:
+        where.append("""run = (SELECT MAX(r.run) FROM results r
+                         WHERE r.Sample_ID = results.Sample_ID AND r.model = results.model
+                         AND r.model_type = results.model_type)""")
+    query = "SELECT * FROM results"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    con = connect_db(db_name)
+    try:
+        df = pd.read_sql_query(query + " ORDER BY Sample_ID, run", con, params=args)
+    finally:
+        con.close()
+    return df.dropna(axis=1, how='all').set_index('Sample_ID')
+
 def merge_results(sol,files):
     """
     Merge a batch of csv files to a single one
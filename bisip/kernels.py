@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 14:26:51 2026
+
+Cache of the relaxation time grids and kernel matrices of the
+polynomial decomposition (PDecomp)
+The response of the decomposition is linear in the polynomial coefficients:
+    Z(w) = R0*(1 - sum_k K(w, tau_k)*m_k),   m = a.log_taus
+so the complex kernel K and its product with log_taus only depend on the
+frequencies, decomp_poly and c_exp. They are computed once per process
+(and optionally once per cache folder) and reused by every inversion
+that measured the same frequencies
+Also holds batched versions of the forward models, which compute the
+responses of many parameter sets in one call, and their derivatives
+(see bisip.samplers)
+"""
+
+from __future__ import print_function
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from bisip.utils import decomp_grid
+
+# In-process LRU cache
+max_kernels = 32
+_kernels = OrderedDict()
+_lock = threading.Lock()
+
+# Optional folder of .npz kernel files shared by all processes
+cache_dir = os.environ.get("BISIP_KERNEL_CACHE", None)
+
+def set_cache_dir(folder):
+    """
+    Sets the folder of the disk cache (None to disable it)
+    """
+    global cache_dir
+    cache_dir = folder
+
+def clear_cache():
+    """
+    Empties the in-process cache
+    """
+    with _lock:
+        _kernels.clear()
+
+#==============================================================================
+class DecompKernel(object):
+    """
+    Grid and kernel matrices of one frequency list, decomp_poly and c_exp
+    log_tau, cond, log_taus, tau_10: see utils.decomp_grid
+    K: complex Debye/Warburg/Cole-Cole responses (n_freq, n_tau)
+    G: real and imaginary parts of K.log_taus.T (2, n_freq, decomp_poly+1)
+    Arrays are read-only as they are shared by all inversions
+    """
+    arrays = ["w", "log_tau", "cond", "log_taus", "tau_10", "K", "G"]
+
+    def __init__(self, **arrays):
+        for k in self.arrays:
+            a = np.asarray(arrays[k])
+            a.flags.writeable = False
+            setattr(self, k, a)
+        self._unit = np.array([[1.0], [0.0]])
+
+    @classmethod
+    def build(cls, w, decomp_poly, c_exp):
+        log_tau, cond, log_taus, tau_10 = decomp_grid(w, decomp_poly)
+        K = 1.0 - 1.0/(1.0 + (1j*w[:,np.newaxis]*tau_10)**c_exp)
+        KL = K.dot(log_taus.T)
+        return cls(w=w, log_tau=log_tau, cond=cond, log_taus=log_taus, tau_10=tau_10,
+                   K=K, G=np.array([KL.real, KL.imag]))
+
+    def zmod(self, R0, a):
+        """
+        Normalized response (2, n_freq) for resistivity R0 and coefficients a
+        Same as cython_funcs.Decomp_cyth
+        """
+        return R0*(self._unit - self.G.dot(a))
+
+    def subset(self, idx):
+        """
+        Kernel of the frequencies idx only, on the same relaxation times
+        """
+        return DecompKernel(w=self.w[idx], log_tau=self.log_tau, cond=self.cond, log_taus=self.log_taus,
+                            tau_10=self.tau_10, K=self.K[idx], G=self.G[:,idx])
+
+    def save(self, filename):
+        tmp = "%s.%d.tmp" %(filename, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f, **{k: getattr(self, k) for k in self.arrays})
+        os.rename(tmp, filename) # Readers never see a partial file
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            return cls(**{k: f[k] for k in cls.arrays})
+
+def kernel_key(w, decomp_poly, c_exp):
+    w = np.ascontiguousarray(w, dtype=float)
+    return (hashlib.sha1(w.tobytes()).hexdigest(), int(decomp_poly), float(c_exp))
+
+def decomp_kernel(w, decomp_poly, c_exp):
+    """
+    Returns the DecompKernel of angular frequencies w
+    Looked up in the process cache, then the disk cache, then computed
+    """
+    key = kernel_key(w, decomp_poly, c_exp)
+    with _lock:
+        if key in _kernels:
+            _kernels[key] = _kernels.pop(key) # Most recently used
+            return _kernels[key]
+    kernel = None
+    fname = None
+    if cache_dir is not None:
+        fname = os.path.join(cache_dir, "decomp_%s_%d_%r.npz" %key)
+        if os.path.exists(fname):
+            try:
+                kernel = DecompKernel.load(fname)
+            except Exception: # Corrupt file, compute it again
+                kernel = None
+    if kernel is None:
+        kernel = DecompKernel.build(np.asarray(w, dtype=float), decomp_poly, c_exp)
+        if fname is not None:
+            if not os.path.isdir(cache_dir):
+                try:
+                    os.makedirs(cache_dir)
+                except OSError: # Created by another process in the meantime
+                    pass
+            kernel.save(fname)
+    with _lock:
+        _kernels[key] = kernel
+        while len(_kernels) > max_kernels:
+            _kernels.popitem(last=False)
+    return kernel
+
+#==============================================================================
+# Batched forward models
+# Same responses as the Cython kernels for C parameter sets at once:
+# scalar parameters have shape (C,), vector parameters (C, n_modes)
+# Return the normalized responses with shape (C, 2, n_freq)
+def _split(Z):
+    return np.stack((Z.real, Z.imag), axis=1)
+
+def ColeCole_batch(w, R0, m, log_tau, c):
+    iwt = 1j*w[np.newaxis,np.newaxis,:]*(10.0**log_tau)[:,:,np.newaxis]
+    z = np.sum(m[:,:,np.newaxis]*(1.0 - 1.0/(1.0 + iwt**c[:,:,np.newaxis])), axis=1)
+    return _split(R0[:,np.newaxis]*(1.0 - z))
+
+def Dias_batch(w, R0, m, log_tau, eta, delta):
+    w = w[np.newaxis,:]
+    R0, m, eta, delta = [x[:,np.newaxis] for x in (R0, m, eta, delta)]
+    tau = 10.0**log_tau[:,np.newaxis]
+    mu = 1j*w*tau + eta*tau*(1j*w**0.5)
+    Z = R0*(1 - (m*(1 - 1.0/(1 + (1j*w*((tau/delta)*(1 - delta)/(1 - m)))*(1 + 1.0/mu)))))
+    return _split(Z)
+
+def Shin_batch(w, R, log_Q, n):
+    w = w[np.newaxis,np.newaxis,:]
+    R, Q, n = R[:,:,np.newaxis], (10.0**log_Q)[:,:,np.newaxis], n[:,:,np.newaxis]
+    return _split(np.sum(R/((1j*w**n)*Q*R + 1), axis=1))
+
+def Decomp_batch(kernel, R0, a):
+    return R0[:,np.newaxis,np.newaxis]*(kernel._unit[np.newaxis] - np.einsum('knd,cd->ckn', kernel.G, a))
+
+def RTD_batch(kernel, R0, m):
+    KRI = np.stack((kernel.K.real, kernel.K.imag)) # (2, n_freq, n_tau)
+    return R0[:,np.newaxis,np.newaxis]*(kernel._unit[np.newaxis] - np.einsum('knt,ct->ckn', KRI, m))
+
+def CCD_batch(w, R0, m, tau, c_exp):
+    iwt = 1j*w[np.newaxis,np.newaxis,:]*tau[:,:,np.newaxis]
+    z = np.sum(m[:,:,np.newaxis]*(1 - 1.0/(1 + iwt**c_exp)), axis=1)
+    return _split(R0[:,np.newaxis]*(1 - z))
+
+#==============================================================================
+# Derivatives of the batched forward models
+# Return a dictionary of the derivatives of the responses with respect to
+# each parameter: (C, 2, n_freq) for scalar parameters and
+# (C, n_modes, 2, n_freq) for vector parameters
+def _split_jac(dZ):
+    return np.stack((dZ.real, dZ.imag), axis=-2)
+
+def ColeCole_jac(w, R0, m, log_tau, c):
+    log_iwt = np.log(1j*w[np.newaxis,np.newaxis,:]*(10.0**log_tau)[:,:,np.newaxis])
+    u = np.exp(c[:,:,np.newaxis]*log_iwt) # (iwt)**c
+    term = u/(1.0 + u)
+    R0, m = R0[:,np.newaxis,np.newaxis], m[:,:,np.newaxis]
+    d_u = -R0*m/(1.0 + u)**2 # dZ/du
+    return {"R0": _split_jac(1.0 - np.sum(m*term, axis=1)),
+            "m": _split_jac(-R0*term),
+            "log_tau": _split_jac(d_u*u*c[:,:,np.newaxis]*np.log(10.0)),
+            "c": _split_jac(d_u*u*log_iwt),
+            }
+
+def Shin_jac(w, R, log_Q, n):
+    w = w[np.newaxis,np.newaxis,:]
+    R, Q, n = R[:,:,np.newaxis], (10.0**log_Q)[:,:,np.newaxis], n[:,:,np.newaxis]
+    v = (1j*w**n)*Q*R
+    d_v = -R/(1.0 + v)**2 # dZ/dv
+    return {"R": _split_jac(1.0/(1.0 + v)**2),
+            "log_Q": _split_jac(d_v*v*np.log(10.0)),
+            "n": _split_jac(d_v*v*np.log(w)),
+            }
+
+def Decomp_jac(kernel, R0, a):
+    G = kernel.G.transpose(2, 0, 1)[np.newaxis] # (1, n_coef, 2, n_freq)
+    return {"R0": kernel._unit[np.newaxis] - np.einsum('knd,cd->ckn', kernel.G, a),
+            "a": -R0[:,np.newaxis,np.newaxis,np.newaxis]*G,
+            }
+
+def CCD_jac(w, R0, m, tau, c_exp):
+    u = (1j*w[np.newaxis,np.newaxis,:]*tau[:,:,np.newaxis])**c_exp
+    m = m[:,:,np.newaxis]
+    R0 = R0[:,np.newaxis]
+    # Derivatives with respect to R0 and to log10 shifts of all m and all tau
+    return {"R0": _split_jac(1.0 - np.sum(m*u/(1.0 + u), axis=1)),
+            "log_m": _split_jac(-R0*np.log(10.0)*np.sum(m*u/(1.0 + u), axis=1)),
+            "log_tau": _split_jac(-R0*np.log(10.0)*c_exp*np.sum(m*u/(1.0 + u)**2, axis=1)),
+            }
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 26 10:12:33 2026
+
+Library of precomputed responses for instant initial estimates
+The responses of a space-filling (Latin hypercube) sample of the priors
+of mcmcinv are computed once with the batched forward models and indexed
+with a KD-tree on their normalized impedances, projected on their main
+principal components. The nearest responses of a new spectrum give an
+estimate of its parameters, and starting points and a proposal
+covariance for the samplers (mcmc["library"])
+Libraries are saved to .npz files that any process can open:
+    lib = ResponseLibrary.build("ColeCole", freq, cc_modes=2)
+    lib.save("cc2.npz")
+    sol = mcmcinv("ColeCole", filepath, mcmc=dict(mcmc, library="cc2.npz"))
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.special import ndtri
+
+from bisip.posterior import batch_forward
+from bisip.kernels import decomp_kernel
+from bisip.priors import model_priors
+
+# Libraries opened by this process, by file name
+_libraries = {}
+_lock = threading.Lock()
+
+def latin_hypercube(n, d, rng):
+    """
+    n points of the unit hypercube in d dimensions, one in each of the
+    n strata of every dimension
+    """
+    strata = np.argsort(rng.rand(n, d), axis=0)
+    return (strata + rng.rand(n, d))/n
+
+def _sort_modes(model, p):
+    # Modes in order of relaxation time, so neighbours have the same labels
+    key = {"ColeCole": "log_tau", "Shin": "log_Q"}.get(model)
+    if key is None:
+        return p
+    order = np.argsort(p[key], axis=1)
+    return dict((k, np.take_along_axis(v, order, axis=1) if v.shape == order.shape else v) for (k, v) in p.items())
+
+#==============================================================================
+class ResponseLibrary(object):
+    """
+    Parameters and responses of n prior draws of one model and frequency list
+    theta: parameter vectors (n, ndim), same layout as BatchPosterior
+    coords: coordinates (n, n_components) of the standardized responses
+    on their principal components, indexed by a KD-tree
+    center, scale, basis: standardization and projection of the responses
+    Without coords, only the forward model is available (used by build)
+    """
+    arrays = ["freq", "theta", "coords", "center", "scale", "basis"]
+
+    def __init__(self, model, names, sizes, cc_modes=2, decomp_poly=4, c_exp=1.0, **arrays):
+        self.model = str(model)
+        self.names = [str(k) for k in names]
+        self.sizes = [int(n) for n in sizes]
+        self.cc_modes, self.decomp_poly, self.c_exp = int(cc_modes), int(decomp_poly), float(c_exp)
+        for k in self.arrays:
+            setattr(self, k, np.asarray(arrays.get(k, np.nan), dtype=float))
+        i = np.cumsum([0] + self.sizes)
+        self.slices = [slice(a, b) for (a, b) in zip(i[:-1], i[1:])]
+        self.w = 2*np.pi*self.freq
+        self.kernel = None
+        if self.model == "PDecomp":
+            self.kernel = decomp_kernel(self.w, self.decomp_poly, self.c_exp)
+        self.tree = cKDTree(self.coords) if self.coords.ndim == 2 else None
+
+    def __len__(self):
+        return len(self.theta)
+
+    @classmethod
+    def build(cls, model, freq, n=100000, cc_modes=2, decomp_poly=4, c_exp=1.0,
+              seed=0, chunk=10000, max_components=16, var_kept=1-1e-6):
+        """
+        Computes the responses of n Latin hypercube draws of the priors
+        of model at frequencies freq (Hz)
+        Responses are standardized and projected on the principal
+        components that explain var_kept of their variance (at most
+        max_components)
+        """
+        priors = model_priors(model, cc_modes, decomp_poly)
+        names, sizes = [p[0] for p in priors], [p[1] for p in priors]
+        rng = np.random.RandomState(seed)
+        u = latin_hypercube(n, sum(sizes), rng)
+        theta = np.empty_like(u)
+        i = 0
+        for (_, size, kind, a, b) in priors:
+            sl = slice(i, i+size)
+            if kind == "Uniform":
+                theta[:,sl] = a + (b - a)*u[:,sl]
+            else:
+                theta[:,sl] = a + b*ndtri(u[:,sl])
+            i += size
+        lib = cls(model, names, sizes, cc_modes, decomp_poly, c_exp, freq=freq)
+        theta = lib.pack(_sort_modes(model, lib.unpack(theta)))
+        with np.errstate(all="ignore"):
+            resp = np.concatenate([lib.forward(theta[j:j+chunk]).reshape(-1, 2*len(lib.w))
+                                   for j in range(0, n, chunk)])
+        ok = np.all(np.isfinite(resp), axis=1)
+        theta, resp = theta[ok], resp[ok]
+        center, scale = resp.mean(axis=0), resp.std(axis=0) + 1e-12
+        x = (resp - center)/scale
+        sub = x[rng.choice(len(x), min(len(x), 20000), replace=False)]
+        _, s, vt = np.linalg.svd(sub, full_matrices=False)
+        var = np.cumsum(s**2)/np.sum(s**2)
+        k = min(int(np.searchsorted(var, var_kept)) + 1, max_components, len(s))
+        basis = vt[:k].T
+        return cls(model, names, sizes, cc_modes, decomp_poly, c_exp, freq=freq, theta=theta,
+                   coords=x.dot(basis), center=center, scale=scale, basis=basis)
+
+    def save(self, filename):
+        tmp = "%s.%d.tmp" %(filename, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f, model=self.model, names=self.names, sizes=self.sizes,
+                     cc_modes=self.cc_modes, decomp_poly=self.decomp_poly, c_exp=self.c_exp,
+                     **{k: getattr(self, k) for k in self.arrays})
+        os.rename(tmp, filename) # Readers never see a partial file
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            return cls(f["model"][()], f["names"], f["sizes"], f["cc_modes"][()],
+                       f["decomp_poly"][()], f["c_exp"][()], **{k: f[k] for k in cls.arrays})
+
+    #==========================================================================
+    def unpack(self, theta):
+        theta = np.atleast_2d(theta)
+        return dict((k, theta[:,sl]) for (k, sl) in zip(self.names, self.slices))
+
+    def pack(self, p):
+        return np.hstack([p[k] for k in self.names])
+
+    def forward(self, theta):
+        """
+        Normalized responses (C, 2, n_freq) of C parameter vectors
+        """
+        p = self.unpack(theta)
+        for k, n in zip(self.names, self.sizes):
+            if n == 1: # Scalar stochastics
+                p[k] = p[k][:,0]
+        return batch_forward(self.model, self.w, p, self.kernel, c_exp=self.c_exp)
+
+    def on_grid(self, zn, freq=None):
+        """
+        Responses zn (C, 2, n_freq) at the frequencies of the library
+        Responses measured at other frequencies (freq, Hz) are interpolated
+        in log frequency
+        """
+        n = len(self.w) if freq is None else len(freq)
+        zn = np.asarray(zn, dtype=float).reshape(-1, 2, n)
+        if freq is None or np.array_equal(np.asarray(freq, dtype=float), self.freq):
+            return zn
+        freq = np.asarray(freq, dtype=float)
+        order = np.argsort(freq)
+        lf, lf_lib = np.log10(freq[order]), np.log10(self.freq)
+        return np.array([[np.interp(lf_lib, lf, z[j][order]) for j in range(2)] for z in zn])
+
+    def features(self, zn, freq=None):
+        """
+        Coordinates of normalized responses zn (C, 2, n_freq) in the index
+        """
+        zn = self.on_grid(zn, freq)
+        return ((zn.reshape(len(zn), -1) - self.center)/self.scale).dot(self.basis)
+
+    def query(self, zn, k=20, freq=None):
+        """
+        Parameters (k, ndim) of the k nearest responses of one
+        spectrum zn (2, n_freq) and their distances
+        """
+        dist, i = self.tree.query(self.features(zn, freq)[0], k=min(k, len(self)))
+        return self.theta[np.atleast_1d(i)], np.atleast_1d(dist)
+
+    def estimate(self, zn, zn_err=None, k=20, freq=None):
+        """
+        Parameter estimate of one spectrum zn (2, n_freq) from its k
+        nearest responses
+        With zn_err, the neighbours are ranked by their misfit to zn
+        Returns a dictionary of the neighbours (theta), the best of them,
+        their mean and covariance
+        """
+        theta, dist = self.query(zn, k, freq)
+        if zn_err is not None:
+            zn, err = self.on_grid(zn, freq)[0], self.on_grid(zn_err, freq)[0]
+            with np.errstate(all="ignore"):
+                misfit = np.sum(((self.forward(theta) - zn)/err)**2, axis=(1, 2))
+            order = np.argsort(misfit)
+            theta, dist = theta[order], dist[order]
+        cov = np.atleast_2d(np.cov(theta, rowvar=False)) if len(theta) > 1 else np.zeros((theta.shape[1],)*2)
+        cov += np.diag(1e-8*np.diag(cov) + 1e-12) # Keep it positive definite
+        return {"theta": theta, "distance": dist, "best": theta[0],
+                "mean": theta.mean(axis=0), "cov": cov}
+
+def open_library(library):
+    """
+    Returns a ResponseLibrary given as an object or a file name
+    Files are read once per process
+    """
+    if isinstance(library, ResponseLibrary):
+        return library
+    key = os.path.abspath(library)
+    with _lock:
+        if key not in _libraries:
+            _libraries[key] = ResponseLibrary.load(key)
+        return _libraries[key]
+
+def library_start(library, post, rng, k=20):
+    """
+    Starting points (k, ndim) and proposal covariance (ndim, ndim) of
+    BatchPosterior post from the k nearest responses of library
+    Parameters of post that are not in the library (noise levels of
+    guess_noise) are drawn from their priors
+    """
+    lib = open_library(library)
+    if lib.model != post.model:
+        raise ValueError("Library of model %s used for model %s" %(lib.model, post.model))
+    zn_err = None if post.obs_tau is None else 1.0/np.sqrt(post.obs_tau)
+    est = lib.estimate(post.zn, zn_err, k=k, freq=post.w/(2*np.pi))
+    start = post.sample_prior(len(est["theta"]), rng)
+    cov = np.diag((0.1*post.prior_scale())**2)
+    cols = []
+    for name, sl in zip(lib.names, lib.slices):
+        if name not in post.names:
+            raise ValueError("Library parameter %s is not in the model" %name)
+        psl = post.slices[post.names.index(name)]
+        if psl.stop - psl.start != sl.stop - sl.start:
+            raise ValueError("Library parameter %s has size %d instead of %d (cc_modes or decomp_poly)"
+                             %(name, sl.stop - sl.start, psl.stop - psl.start))
+        cols.extend(range(psl.start, psl.stop))
+    start[:,cols] = est["theta"]
+    cov[np.ix_(cols, cols)] = est["cov"]
+    return start, cov
@@ -43,7 +43,7 @@ from builtins import range
 from past.utils import old_div
 import pymc
 import numpy as np
-from bisip.cython_funcs import ColeCole_cyth1, Dias_cyth, Decomp_cyth, Shin_cyth
+from bisip.cython_funcs import ColeCole_cyth1, Dias_cyth, Shin_cyth
 # Imports to save things
 from os import path, makedirs
 from os import getcwd
@@ -53,6 +53,12 @@ from scipy.signal import argrelextrema
 from bisip import invResults as iR
 from bisip.utils import format_results, get_data
 from bisip.utils import split_filepath, get_model_type
+from bisip.kernels import decomp_kernel
+from bisip.samplers import run_sampler, warm_start, add_to_pool, trace_draws
+from bisip.posterior import BatchPosterior
+from bisip.proposals import pooled_mcmc, good_chains
+from bisip.reweight import reweight_draws
+from bisip.priors import prior_table
 
 try:
     import lib_dd.decomposition.ccd_single as ccd_single
@@ -64,11 +70,20 @@ except:
 import matplotlib as mpl
 mpl.rc_file_defaults()    
 
+#==============================================================================
+# pymc stochastic with its prior in a table of bisip.priors
+def prior_stochastic(name, priors, value=None):
+    shape, kind, a, b = priors[name]
+    size = {"size": shape[0]} if shape else {}
+    if kind == "Uniform":
+        return pymc.Uniform(name, lower=a, upper=b, value=value, **size)
+    return pymc.Normal(name, mu=a, tau=1./(b**2), value=value, **size)
+
 #==============================================================================
 # Function to run MCMC simulation on selected model
 # Arguments: model <function>, mcmc parameters <dict>,traces path <string>
-def run_MCMC(function, mc_p, save_traces=False, save_where=None):
-    print("\nMCMC parameters:\n", mc_p)
+# Pass the mcmcinv object (sol) to use a sampler of bisip.samplers
+def run_MCMC(function, mc_p, save_traces=False, save_where=None, sol=None):
     if save_traces:
         # If path doesn't exist, create it
         if not path.exists(save_where): makedirs(save_where)
@@ -78,6 +93,16 @@ def run_MCMC(function, mc_p, save_traces=False, save_where=None):
         MDL = pymc.MCMC(function, db='ram',
                         dbname=save_where)
 
+    if mc_p.get("pool") is not None:
+        mc_p = pooled_mcmc(BatchPosterior(sol, MDL), mc_p) # Shorter burn-in once the pool is warm
+    print("\nMCMC parameters:\n", dict((k, v) for (k, v) in mc_p.items() if k not in ["warm", "importance", "replay"])) # Without arrays of draws
+
+    if mc_p.get("sampler", "pymc") != "pymc":
+        MDL = run_sampler(MDL, sol, mc_p)
+        if mc_p.get("pool") is not None:
+            add_to_pool(MDL, sol, mc_p)
+        return MDL
+
     if mc_p["adaptive"]:
         if mc_p['verbose']:
             mc_p['verbose'] = 1
@@ -89,9 +114,14 @@ def run_MCMC(function, mc_p, save_traces=False, save_where=None):
                                 proposal_distribution='Normal',
                                 scale=mc_p['prop_scale'], verbose=mc_p['verbose'])
 
+    if any(mc_p.get(k) is not None for k in ["library", "pool", "warm"]):
+        warm_start(MDL, sol, mc_p) # Start values and proposals of previous runs or of the library
+
     for i in range(1, mc_p['nb_chain']+1):
         print('\nChain #%d/%d'%(i, mc_p['nb_chain']))
         MDL.sample(mc_p['nb_iter'], mc_p['nb_burn'], mc_p['thin'], tune_interval=mc_p['tune_inter'], tune_throughout=False)
+    if mc_p.get("pool") is not None:
+        add_to_pool(MDL, sol, mc_p)
     return MDL
 
 class mcmcinv(object):
@@ -102,6 +132,7 @@ class mcmcinv(object):
                 "PDecomp"
                 "Shin"
                 "CCDtools"
+                "RTD"
                 )
     """
     
@@ -116,6 +147,7 @@ class mcmcinv(object):
                    "verbose"    : False,
                    "cov_inter"  : 1000,
                    "cov_delay"  : 1000,
+                   "sampler"    : "pymc",
                     }
     
     # Define some attributes of mcmcinv
@@ -124,7 +156,9 @@ class mcmcinv(object):
     plot_histograms = iR.plot_histo
     plot_traces = iR.plot_traces
     save_results = iR.save_resul
+    save_results_db = iR.save_resul_db
     save_csv_traces = iR.save_csv_traces
+    save_binary_traces = iR.save_binary_traces
     merge_results = iR.merge_results
     plot_log_likelihood = iR.plot_logp
     plot_model_deviance = iR.plot_deviance
@@ -138,7 +172,8 @@ class mcmcinv(object):
     def __init__(self, model, filepath, mcmc=default_mcmc, headers=1,
                    ph_units="mrad", cc_modes=2, decomp_poly=4, c_exp=1.0, 
                    log_min_tau=-3, guess_noise=False, keep_traces=False, 
-                   ccdt_priors='auto', ccdt_cfg=None):
+                   ccdt_priors='auto', ccdt_cfg=None, data=None,
+                   rtd_lambda="auto", rtd_nonneg=False):
         """
         Call with minimal arguments:
         sol = mcmcinv('ColeCole', '/Documents/DataFiles/DATA.dat')
@@ -147,6 +182,15 @@ class mcmcinv(object):
         sol = mcmcinv( model='ColeCole', filepath='/Documents/DataFiles/DATA.dat',
                  mcmc=mcmc_params, headers=1, ph_units='mrad', cc_modes=2,
                  debye_poly=4, c_exp = 1.0, keep_traces=False)
+
+        Pass data to use an already loaded data dictionary instead of
+        reading filepath, e.g. from a bulk load of many files:
+        packed = load_data('/Documents/DataFiles/')
+        sol = mcmcinv('ColeCole', packed["files"][i], data=unpack_data(packed, i))
+
+        The RTD model is solved exactly on the tau grid (see bisip.rtd),
+        with smoothing weight rtd_lambda ("auto": highest evidence)
+        or non-negative least squares if rtd_nonneg
         """
         
         self.model = model
@@ -163,19 +207,65 @@ class mcmcinv(object):
         self.ccd_priors = ccdt_priors
         self.ccdtools_config = ccdt_cfg
         self.ccdt_last_it = None
+        self.rtd_lambda = rtd_lambda
+        self.rtd_nonneg = rtd_nonneg
         self.filename = split_filepath(self.filepath)
+        if data is None:
+            data = get_data(self.filepath, self.headers, self.ph_units)
+        self.data = dict(data) # Arrays are shared with the caller, only keys are added
         
         if model == "CCD":
+            ccd_priors, self.ccdt_last_it = self.get_ccd_priors(config=self.ccdtools_config)
             if self.ccd_priors == 'auto':
-                self.ccd_priors = self.get_ccd_priors(config=self.ccdtools_config)[0]
-            self.ccdt_last_it = self.get_ccd_priors(config=self.ccdtools_config)[1]
+                self.ccd_priors = ccd_priors
             print("\nUpdated CCD priors with new data")
 
         self.start()
-        
+
+
+    def reweight(self, data, min_ess=None, rerun=True, seed=None):
+        """
+        Inversion of the same sample with a modified data dictionary
+        (other errors or a subset of the frequencies, see utils.edit_data)
+        The draws of this inversion are reweighted by their likelihood
+        ratio and resampled (sampler "importance"): this takes seconds
+        Chains stuck far below the best one are left out (proposals.good_chains)
+        If the effective sample size is below min_ess (default: 10% of
+        the draws) and rerun, MCMC is run again on the new data, starting
+        from the reweighted draws
+        Returns a new mcmcinv object, its sampler_info holds the ESS
+        The RTD model is simply inverted again: its exact posterior is
+        cheaper than reweighting, and its pymc prior is not the one sampled
+        """
+        from bisip.sequential import warm_state # sequential imports this module
+        data = dict(data)
+        options = dict(headers=self.headers, ph_units=self.ph_units, cc_modes=self.cc_modes,
+                       decomp_poly=self.decomp_poly, c_exp=self.c_exp, log_min_tau=self.log_min_tau,
+                       guess_noise=self.guess_noise, keep_traces=self.keep_traces,
+                       ccdt_priors=self.ccd_priors, ccdt_cfg=self.ccdtools_config,
+                       rtd_lambda=self.rtd_lambda, rtd_nonneg=self.rtd_nonneg)
+        if self.model == "RTD":
+            return mcmcinv(self.model, self.filepath, mcmc=dict(self.mcmc, seed=seed), data=data, **options)
+        if data["Z_max"] != self.data["Z_max"]: # Same normalization as the draws
+            f = data["Z_max"]/self.data["Z_max"]
+            data.update(zn=f*data["zn"], zn_err=f*data["zn_err"], Z_max=self.data["Z_max"])
+        post = BatchPosterior(self, self.MDL)
+        draws = good_chains(post, trace_draws(self.MDL, post, self.mcmc["nb_chain"])) # Without stuck chains
+        theta = draws.reshape(-1, post.ndim)
+        w, ess, _ = reweight_draws(post, theta, data)
+        if min_ess is None:
+            min_ess = 0.1*len(theta)
+        mcmc = dict((k, v) for (k, v) in self.mcmc.items() if k not in ["pool", "warm"])
+        if (ess >= min_ess) or (not rerun):
+            mcmc.update(sampler="importance", seed=seed,
+                        importance={"names": post.names, "theta": theta, "log_like": post.log_like(theta)})
+        else:
+            print("\nEffective sample size %.0f below %.0f, running MCMC again" %(ess, min_ess))
+            mcmc["warm"] = warm_state(post, draws, data, np.random.RandomState(seed))[0]
+        return mcmcinv(self.model, self.filepath, mcmc=mcmc, data=data, **options)
 
     def get_ccd_priors(self, config=None):
-        data = get_data(self.filepath, self.headers, self.ph_units)
+        data = self.data
         data_ccdtools = np.hstack((data['amp'][::-1], 1000*data['pha'][::-1]))
         freq_ccdtools = data['freq'][::-1]
         if config == None:
@@ -217,10 +307,11 @@ class mcmcinv(object):
                   'c'        : None,
                   }
             # Stochastic variables
-            R0 = pymc.Uniform('R0', lower=0.7, upper=1.3 , value=p0["R0"])
-            m = pymc.Uniform('m', lower=0.0, upper=1.0, value=p0["m"], size=cc_modes)
-            log_tau = pymc.Uniform('log_tau', lower=-7.0, upper=4.0, value=p0['log_tau'], size=cc_modes)
-            c = pymc.Uniform('c', lower=0.0, upper=1.0, value=p0['c'], size=cc_modes)
+            pri = prior_table("ColeCole", cc_modes=cc_modes)
+            R0 = prior_stochastic('R0', pri, value=p0["R0"])
+            m = prior_stochastic('m', pri, value=p0["m"])
+            log_tau = prior_stochastic('log_tau', pri, value=p0['log_tau'])
+            c = prior_stochastic('c', pri, value=p0['c'])
             
             # Deterministic variables
             @pymc.deterministic(plot=False)
@@ -248,9 +339,10 @@ class mcmcinv(object):
                   'm'      : None,
                   }
             # Stochastics
-            R = pymc.Uniform('R', lower=0.0, upper=1.0, value=p0["R"], size=2)
-            log_Q = pymc.Uniform('log_Q', lower=-7, upper=2, value=p0["log_Q"], size=2)
-            n = pymc.Uniform('n', lower=0.0, upper=1.0, value=p0["n"], size=2)
+            pri = prior_table("Shin")
+            R = prior_stochastic('R', pri, value=p0["R"])
+            log_Q = prior_stochastic('log_Q', pri, value=p0["log_Q"])
+            n = prior_stochastic('n', pri, value=p0["n"])
             # Deterministics
             @pymc.deterministic(plot=False)
             def zmod(R=R, log_Q=log_Q, n=n):
@@ -286,11 +378,12 @@ class mcmcinv(object):
                   'delta'  :  None,
                   }
             # Stochastics
-            R0 = pymc.Uniform('R0', lower=0.9, upper=1.1 , value=1)
-            m = pymc.Uniform('m', lower=0.0, upper=1.0, value=p0['m'])
-            log_tau = pymc.Uniform('log_tau', lower=-7.0, upper=0.0, value=p0['log_tau'])
-            eta = pymc.Uniform('eta', lower=0.0, upper=50.0, value=p0['eta'])
-            delta = pymc.Uniform('delta', lower=0.0, upper=1.0, value=p0['delta'])
+            pri = prior_table("Dias")
+            R0 = prior_stochastic('R0', pri, value=p0['R0'])
+            m = prior_stochastic('m', pri, value=p0['m'])
+            log_tau = prior_stochastic('log_tau', pri, value=p0['log_tau'])
+            eta = prior_stochastic('eta', pri, value=p0['eta'])
+            delta = prior_stochastic('delta', pri, value=p0['delta'])
             # Deterministics
             @pymc.deterministic(plot=False)
             def zmod(R0=R0, m=m, lt=log_tau, eta=eta, delta=delta):
@@ -415,7 +508,8 @@ class mcmcinv(object):
                   'U'          : None,
                   }
             # Stochastics
-            R0 = pymc.Uniform('R0', lower=0.7, upper=1.3, value=p0['R0'])
+            pri = prior_table("PDecomp", decomp_poly=decomp_poly)
+            R0 = prior_stochastic('R0', pri, value=p0['R0'])
 #            R0 = pymc.Normal('R0', mu=0.989222579813, tau=1./(0.0630422467962**2))
 #            R0 = pymc.Normal('R0', mu=ccd_priors['R0'], tau=1./(1e-10**2))
 
@@ -425,7 +519,7 @@ class mcmcinv(object):
 #            a = pymc.MvNormal('a', mu=p0['a_mu']*np.ones(decomp_poly+1), tau=(1./(2*p0['a_sd'])**2)*np.eye(decomp_poly+1))        
 #            a = pymc.MvNormal('a', mu=ccd_priors['a'], tau=(1./(1e-10)**2)*np.eye(decomp_poly+1))        
 
-            a = pymc.Normal('a', mu=0, tau=1./(0.01**2), value=p0["a"], size=decomp_poly+1)
+            a = prior_stochastic('a', pri, value=p0["a"])
 #            noise = pymc.Uniform('noise', lower=0., upper=1.)
             if self.guess_noise:
                 noise_r = pymc.Uniform('noise_real', lower=0., upper=1.)
@@ -446,7 +540,7 @@ class mcmcinv(object):
 #                return (log_tau >= log_tau_min)&(log_tau <= log_tau_max)
             @pymc.deterministic(plot=False)
             def zmod(R0=R0, a=a):
-                return Decomp_cyth(w, tau_10, log_taus, c_exp, R0, a)
+                return kernel.zmod(R0, a)
             @pymc.deterministic(plot=False)
             def m_i(a=a):
                 return np.sum((a*log_taus.T).T, axis=0)
@@ -490,13 +584,47 @@ class mcmcinv(object):
 
             return locals()
     
+    #==============================================================================
+        """Linear RTD on the tau grid"""
+    #==============================================================================
+        def RTDModel():
+            # Same grid and kernel as PDecomp, one chargeability per relaxation time
+            # Only sampled by the linear sampler (enforced in start), which
+            # replaces the Normal prior of m_i by the smoothness prior of bisip.rtd
+            R0 = pymc.Uniform('R0', lower=0.7, upper=1.3, value=1.0)
+            m_i = pymc.Normal('m_i', mu=0, tau=1./(0.1**2), value=np.zeros(len(log_tau)), size=len(log_tau))
+            @pymc.deterministic(plot=False)
+            def zmod(R0=R0, m=m_i):
+                return R0*(kernel._unit - np.array([kernel.K.real.dot(m), kernel.K.imag.dot(m)]))
+            @pymc.deterministic(plot=False)
+            def total_m(m=m_i[cond]):
+                return np.nansum(m)
+            @pymc.deterministic(plot=False)
+            def log_half_tau(m=m_i[cond], log_tau=log_tau[cond]):
+                return log_tau[np.where(np.cumsum(m)/np.nansum(m) > 0.5)[0][0]]
+            @pymc.deterministic(plot=False)
+            def log_mean_tau(m=m_i[cond], log_tau=log_tau[cond]):
+                return np.log10(np.exp(old_div(np.sum(m*np.log(10**log_tau)),np.sum(m))))
+            @pymc.deterministic(plot=False)
+            def log_U_tau(m=m_i[cond], log_tau=log_tau[cond]):
+                tau_60 = log_tau[np.where(np.cumsum(m)/np.nansum(m) > 0.6)[0][0]]
+                tau_10 = log_tau[np.where(np.cumsum(m)/np.nansum(m) > 0.1)[0][0]]
+                return np.log10(10**tau_60 / 10**tau_10)
+            @pymc.deterministic(plot=False)
+            def NRMSE_r(zmod=zmod, data=self.data["zn"]):
+                return np.sqrt(np.mean((zmod[0] - data[0])**2))/abs(max(data[0])-min(data[0]))
+            @pymc.deterministic(plot=False)
+            def NRMSE_i(zmod=zmod, data=self.data["zn"]):
+                return np.sqrt(np.mean((zmod[1] - data[1])**2))/abs(max(data[1])-min(data[1]))
+            obs = pymc.Normal('obs', mu=zmod, tau=1./(self.data["zn_err"]**2), value=self.data["zn"], size = (2, len(w)), observed=True)
+            return locals()
+
     #==============================================================================
         """
         Main section
         """
     #==============================================================================
-        # Importing data
-        self.data = get_data(self.filepath, self.headers, self.ph_units)
+        # Data is imported once in __init__
         
         
         data_ccd = np.hstack((self.data['amp'][::-1], 1000*self.data['pha'][::-1]))
@@ -515,11 +643,9 @@ class mcmcinv(object):
     #    n_decades = np.ceil(max(np.log10(old_div(1.0,w)))) - np.floor(min(np.log10(old_div(1.0,w))))
         # Relaxation times associated with the measured frequencies (Debye decomposition only)
 #        log_tau = self.ccd_priors['log_tau']
-        if self.model == "PDecomp":
-            log_tau = np.linspace(np.floor(min(np.log10(old_div(1.0,w)))-1), np.floor(max(np.log10(old_div(1.0,w)))+1), 50)
-            cond = (log_tau >= min(log_tau)+1)&(log_tau <= max(log_tau)-1)
-            log_taus = np.array([log_tau**i for i in list(reversed(range(0,self.decomp_poly+1)))]) # Polynomial approximation for the RTD
-            tau_10 = 10**log_tau # Accelerates sampling
+        if self.model in ["PDecomp", "RTD"]:
+            kernel = decomp_kernel(w, self.decomp_poly, self.c_exp) # Cached for this frequency list
+            log_tau, cond, log_taus, tau_10 = kernel.log_tau, kernel.cond, kernel.log_taus, kernel.tau_10
             self.data["tau"] = tau_10 # Put relaxation times in data dictionary
     
         # Time and date (for saving traces)
@@ -545,10 +671,19 @@ class mcmcinv(object):
                     "Shin":     {"func": ShinModel,         "args": []                  },
     #                "Custom":   {"func": YourModel,     "args": [opt_args]   },
                     "CCD":      {"func": stoCCD,            "args": [self.c_exp, self.ccd_priors]},
+                    "RTD":      {"func": RTDModel,          "args": []},
                     "lam":      {"func": regularize,        "args": [self.obj]},
                     }
         simulation = sim_dict[self.model] # Pick entries for the selected model
-        self.MDL = run_MCMC(simulation["func"](*simulation["args"]), self.mcmc, save_traces=self.keep_traces, save_where=out_path) # Run MCMC simulation with selected model and arguments
+        mcmc = self.mcmc
+        if self.model == "RTD":
+            # Exact posterior, no MCMC needed. The pymc prior of m_i is not the
+            # smoothness prior of the linear sampler: no other sampler, and no
+            # starts or pools that evaluate the pymc posterior
+            if mcmc.get("sampler", "pymc") not in ["pymc", "linear"]:
+                raise ValueError("The RTD model is only sampled by the linear sampler, not %s" %mcmc["sampler"])
+            mcmc = dict(((k, v) for (k, v) in mcmc.items() if k not in ["pool", "warm", "library"]), sampler="linear")
+        self.MDL = run_MCMC(simulation["func"](*simulation["args"]), mcmc, save_traces=self.keep_traces, save_where=out_path, sol=self) # Run MCMC simulation with selected model and arguments
     #    if not keep_tracfes: rmtree(out_path)   # Deletes the traces if not wanted
     
         """
@@ -556,6 +691,7 @@ class mcmcinv(object):
         Results
         #==========================================================================
         """
+        self.sampler_info = getattr(self.MDL, "sampler_info", None) # Only for samplers of bisip.samplers
         self.pm = format_results(self.MDL, self.data["Z_max"]) # Format output
         zmodstats = self.MDL.stats(chain=-1)["zmod"] # Take last chain
         zn_avg = zmodstats["mean"]
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 09:18:40 2026
+
+Vectorized log-posterior of the mcmcinv models
+The free parameters are the stochastics of the pymc model sorted by name,
+flattened in one vector. BatchPosterior evaluates the log-prior and
+log-likelihood of C parameter vectors at once with the batched
+forward models of bisip.kernels. The priors and likelihood are read from
+the pymc model, so the densities are the ones pymc samples
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import numpy as np
+
+from bisip.kernels import ColeCole_batch, Dias_batch, Shin_batch
+from bisip.kernels import Decomp_batch, CCD_batch, RTD_batch, decomp_kernel
+from bisip.kernels import ColeCole_jac, Shin_jac, Decomp_jac, CCD_jac
+
+def _value(x):
+    # Value of a pymc parent (node or constant)
+    return np.asarray(getattr(x, "value", x), dtype=float)
+
+def batch_forward(model, w, p, kernel=None, ccd_priors=None, c_exp=None):
+    """
+    Normalized responses (C, 2, n_freq) of model for a dictionary of
+    parameter arrays with shape (C,)+shape (see BatchPosterior.unpack)
+    kernel: DecompKernel of PDecomp and RTD
+    ccd_priors, c_exp: priors and exponent of CCD
+    """
+    vec = lambda x: x.reshape(len(x), -1)
+    if model == "ColeCole":
+        return ColeCole_batch(w, p["R0"], vec(p["m"]), vec(p["log_tau"]), vec(p["c"]))
+    if model == "Dias":
+        return Dias_batch(w, p["R0"], p["m"], p["log_tau"], p["eta"], p["delta"])
+    if model == "Shin":
+        return Shin_batch(w, vec(p["R"]), vec(p["log_Q"]), vec(p["n"]))
+    if model == "PDecomp":
+        return Decomp_batch(kernel, p["R0"], vec(p["a"]))
+    if model == "RTD":
+        return RTD_batch(kernel, p["R0"], vec(p["m_i"]))
+    if model == "CCD":
+        pri = ccd_priors
+        R0 = pri["R0"] + p["log_noise_rho"]
+        m = 10**(pri["log_m"][np.newaxis] + p["log_noise_m"][:,np.newaxis])
+        tau = 10**(pri["log_tau"][np.newaxis] + p["log_noise_tau"][:,np.newaxis])
+        return CCD_batch(w, R0, m, tau, c_exp)
+
+#==============================================================================
+class BatchPosterior(object):
+    """
+    Log-posterior of mcmcinv object (sol) and its pymc model (MDL)
+    theta: parameter vectors with shape (C, ndim)
+    names, slices, shapes: layout of the stochastics in theta
+    lower, upper: bounds of each parameter (-inf, inf for Normal priors)
+    start: candidate starting points (n, ndim) tried before prior draws
+    start_cov: covariance (ndim, ndim) for the initial proposals
+    """
+    supported = ["ColeCole", "Dias", "PDecomp", "Shin", "CCD", "RTD"]
+
+    def __init__(self, sol, MDL):
+        if sol.model not in self.supported:
+            raise ValueError("No batched posterior for model %s" %sol.model)
+        self.sol = sol
+        self.model = sol.model
+        self.w = 2*np.pi*np.asarray(sol.data["freq"], dtype=float)
+        self.zn = np.asarray(sol.data["zn"], dtype=float)
+        self.zn_err = np.asarray(sol.data["zn_err"], dtype=float)
+        self.stochastics = sorted(MDL.stochastics, key=lambda s: s.__name__)
+        self.names = [s.__name__ for s in self.stochastics]
+        self.shapes, self.slices = [], []
+        i = 0
+        for s in self.stochastics:
+            shape = np.shape(s.value)
+            size = int(np.prod(shape))
+            self.shapes.append(shape)
+            self.slices.append(slice(i, i+size))
+            i += size
+        self.ndim = i
+        self._read_priors()
+        self._read_likelihood(MDL)
+        if self.model in ["PDecomp", "RTD"]:
+            self.kernel = decomp_kernel(self.w, sol.decomp_poly, sol.c_exp)
+            self.c_exp = sol.c_exp
+        if self.model == "RTD":
+            self.rtd_lambda, self.rtd_nonneg = sol.rtd_lambda, sol.rtd_nonneg
+        if self.model == "CCD":
+            self.ccd_priors, self.c_exp = sol.ccd_priors, sol.c_exp
+        self.start, self.start_cov = None, None
+
+    def __getstate__(self):
+        # Sent to worker processes without the mcmcinv object and pymc nodes
+        state = self.__dict__.copy()
+        state.pop("sol", None)
+        state.pop("stochastics", None)
+        return state
+
+    def _read_priors(self):
+        n = self.ndim
+        self.lower, self.upper = -np.inf*np.ones(n), np.inf*np.ones(n)
+        self.mu, self.tau = np.zeros(n), np.zeros(n)
+        self.normal = np.zeros(n, dtype=bool)
+        for s, sl in zip(self.stochastics, self.slices):
+            kind = s.__class__.__name__
+            size = sl.stop - sl.start
+            if kind == "Uniform":
+                self.lower[sl] = _value(s.parents["lower"])*np.ones(size)
+                self.upper[sl] = _value(s.parents["upper"])*np.ones(size)
+            elif kind == "Normal":
+                self.normal[sl] = True
+                self.mu[sl] = _value(s.parents["mu"])*np.ones(size)
+                self.tau[sl] = _value(s.parents["tau"])*np.ones(size)
+            else:
+                raise ValueError("Prior %s of %s is not supported" %(kind, s.__name__))
+        bounded = ~self.normal
+        self._log_uniform = -np.sum(np.log(self.upper[bounded] - self.lower[bounded]))
+
+    def _read_likelihood(self, MDL):
+        observed = dict((o.__name__, o) for o in MDL.observed_stochastics)
+        if "obs" in observed:
+            self.obs_tau = _value(observed["obs"].parents["tau"])*np.ones_like(self.zn)
+            self.noise = None
+        else: # Noise levels are parameters (PDecomp with guess_noise)
+            self.obs_tau = None
+            self.noise = [self.slices[self.names.index(k)] for k in ["noise_real", "noise_imag"]]
+
+    #==========================================================================
+    def unpack(self, theta):
+        """
+        Returns a dictionary of parameter arrays with shape (C,)+shape
+        """
+        theta = np.atleast_2d(theta)
+        return dict((k, theta[:,sl].reshape((len(theta),)+sh))
+                    for (k, sl, sh) in zip(self.names, self.slices, self.shapes))
+
+    def forward(self, theta):
+        """
+        Normalized responses (C, 2, n_freq) of C parameter vectors
+        """
+        return batch_forward(self.model, self.w, self.unpack(theta), getattr(self, "kernel", None),
+                             getattr(self, "ccd_priors", None), getattr(self, "c_exp", None))
+
+    def with_data(self, data):
+        """
+        Copy of the posterior for another data dictionary of the same
+        configuration: other data or errors, at the same frequencies or
+        at a subset of them (same relaxation time grid for PDecomp and RTD)
+        The precision of the likelihood is scaled by (zn_err/new zn_err)**2
+        Raises ValueError if a frequency of data was not in the original ones
+        """
+        freq = np.asarray(data["freq"], dtype=float)
+        old = self.w/(2*np.pi)
+        idx = np.array([np.argmin(np.abs(old - f)) for f in freq], dtype=int)
+        if not np.allclose(old[idx], freq, rtol=1e-9, atol=0):
+            raise ValueError("The frequencies of the data must be a subset of the original ones")
+        new = copy.copy(self)
+        new.w = self.w[idx]
+        new.zn = np.asarray(data["zn"], dtype=float)
+        new.zn_err = np.asarray(data["zn_err"], dtype=float)
+        if self.obs_tau is not None:
+            new.obs_tau = self.obs_tau[:,idx]*(self.zn_err[:,idx]/new.zn_err)**2
+        if getattr(self, "kernel", None) is not None:
+            new.kernel = self.kernel.subset(idx)
+        new.start, new.start_cov = None, None
+        return new
+
+    def in_bounds(self, theta):
+        return np.all((theta >= self.lower) & (theta <= self.upper), axis=1)
+
+    def log_prior(self, theta):
+        theta = np.atleast_2d(theta)
+        d = theta[:,self.normal] - self.mu[self.normal]
+        t = self.tau[self.normal]
+        lp = self._log_uniform + np.sum(0.5*np.log(t/(2*np.pi)) - 0.5*t*d**2, axis=1)
+        return np.where(self.in_bounds(theta), lp, -np.inf)
+
+    def log_like(self, theta, zmod=None):
+        """
+        Log-likelihood of C parameter vectors
+        Pass zmod if the responses are already computed
+        """
+        theta = np.atleast_2d(theta)
+        if zmod is None:
+            zmod = self.forward(theta)
+        r2 = (zmod - self.zn[np.newaxis])**2
+        if self.noise is None:
+            tau = self.obs_tau[np.newaxis]
+        else:
+            sd = np.stack([theta[:,sl] for sl in self.noise], axis=1) # (C, 2, 1)
+            tau = 1.0/sd**2*np.ones_like(self.zn)[np.newaxis]
+        ll = np.sum(0.5*np.log(tau/(2*np.pi)) - 0.5*tau*r2, axis=(1,2))
+        return np.where(np.isfinite(ll), ll, -np.inf)
+
+    def log_parts(self, theta):
+        """
+        Log-prior and log-likelihood of C parameter vectors,
+        both -inf outside the prior support
+        """
+        theta = np.atleast_2d(theta)
+        lpri, ll = np.full(len(theta), -np.inf), np.full(len(theta), -np.inf)
+        ok = self.in_bounds(theta)
+        if ok.any():
+            with np.errstate(all="ignore"):
+                lpri[ok] = self.log_prior(theta[ok])
+                ll[ok] = self.log_like(theta[ok])
+        ll[np.isnan(ll) | np.isinf(lpri)] = -np.inf
+        return lpri, ll
+
+    def logp(self, theta):
+        """
+        Log-posterior of C parameter vectors, -inf outside the prior support
+        """
+        lpri, ll = self.log_parts(theta)
+        return lpri + ll
+
+    #==========================================================================
+    def jacobian(self, theta):
+        """
+        Derivatives (C, ndim, 2, n_freq) of the responses of C parameter vectors
+        Analytic, except for Dias (central finite differences)
+        """
+        theta = np.atleast_2d(theta)
+        C = len(theta)
+        p = self.unpack(theta)
+        vec = lambda x: x.reshape(len(x), -1)
+        if self.model == "ColeCole":
+            parts = ColeCole_jac(self.w, p["R0"], vec(p["m"]), vec(p["log_tau"]), vec(p["c"]))
+        elif self.model == "Shin":
+            parts = Shin_jac(self.w, vec(p["R"]), vec(p["log_Q"]), vec(p["n"]))
+        elif self.model == "PDecomp":
+            parts = Decomp_jac(self.kernel, p["R0"], vec(p["a"]))
+        elif self.model == "CCD":
+            pri = self.ccd_priors
+            R0 = pri["R0"] + p["log_noise_rho"]
+            m = 10**(pri["log_m"][np.newaxis] + p["log_noise_m"][:,np.newaxis])
+            tau = 10**(pri["log_tau"][np.newaxis] + p["log_noise_tau"][:,np.newaxis])
+            d = CCD_jac(self.w, R0, m, tau, self.c_exp)
+            parts = {"log_noise_rho": d["R0"], "log_noise_m": d["log_m"], "log_noise_tau": d["log_tau"]}
+        else:
+            return self._jacobian_fd(theta)
+        J = np.zeros((C, self.ndim) + self.zn.shape)
+        for k, sl in zip(self.names, self.slices):
+            if k in parts: # Noise levels don't change the responses
+                J[:,sl] = parts[k].reshape((C, -1) + self.zn.shape)
+        return J
+
+    def _jacobian_fd(self, theta, rel_step=1e-6):
+        C, D = theta.shape
+        h = rel_step*np.maximum(np.abs(theta), 1.0)
+        steps = h[:,:,np.newaxis]*np.eye(D)[np.newaxis] # (C, D, D)
+        up = self.forward((theta[:,np.newaxis] + steps).reshape(-1, D))
+        down = self.forward((theta[:,np.newaxis] - steps).reshape(-1, D))
+        return (up - down).reshape((C, D) + self.zn.shape)/(2*h[:,:,np.newaxis,np.newaxis])
+
+    def grad_logp(self, theta):
+        """
+        Log-posterior (C,) and its gradient (C, ndim) of C parameter vectors
+        """
+        theta = np.atleast_2d(theta)
+        with np.errstate(all="ignore"):
+            zmod = self.forward(theta)
+            lp = self.log_prior(theta) + self.log_like(theta, zmod)
+            r = zmod - self.zn[np.newaxis]
+            grad = np.zeros_like(theta)
+            grad[:,self.normal] = -self.tau[self.normal]*(theta[:,self.normal] - self.mu[self.normal])
+            if self.noise is None:
+                tau = self.obs_tau[np.newaxis]
+            else:
+                sd = np.stack([theta[:,sl] for sl in self.noise], axis=1) # (C, 2, 1)
+                tau = 1.0/sd**2*np.ones_like(self.zn)[np.newaxis]
+                d_sd = np.sum(-1.0/sd + r**2/sd**3, axis=2) # (C, 2)
+                for j, sl in enumerate(self.noise):
+                    grad[:,sl] += d_sd[:,j,np.newaxis]
+            grad -= np.einsum("cdkn,ckn->cd", self.jacobian(theta), tau*r)
+        lp = np.where(np.isfinite(lp), lp, -np.inf)
+        grad[~np.isfinite(lp)] = 0.0
+        return lp, np.nan_to_num(grad)
+
+    def fisher(self, theta):
+        """
+        Gauss-Newton approximation (C, ndim, ndim) of minus the Hessian
+        of the log-posterior (Fisher information of the likelihood plus
+        the precision of the Normal priors)
+        """
+        theta = np.atleast_2d(theta)
+        J = self.jacobian(theta)
+        if self.noise is None:
+            tau = self.obs_tau[np.newaxis]
+        else:
+            sd = np.stack([theta[:,sl] for sl in self.noise], axis=1)
+            tau = 1.0/sd**2*np.ones_like(self.zn)[np.newaxis]
+        F = np.einsum("cdkn,ckn,cekn->cde", J, tau*np.ones((len(theta), 1, 1)), J)
+        i = np.arange(self.ndim)
+        F[:,i[self.normal],i[self.normal]] += self.tau[self.normal]
+        if self.noise is not None:
+            for j, sl in enumerate(self.noise):
+                F[:,sl,sl] += (2.0*self.zn.shape[1]/sd[:,j]**2)[:,:,np.newaxis]
+        return F
+
+    #==========================================================================
+    # Unbounded parameters for gradient samplers:
+    # y = logit((x - lower)/(upper - lower)) for Uniform priors, y = x for Normal
+    def to_free(self, theta):
+        theta = np.atleast_2d(theta)
+        y = theta.copy()
+        b = ~self.normal
+        with np.errstate(all="ignore"):
+            s = (theta[:,b] - self.lower[b])/(self.upper[b] - self.lower[b])
+            y[:,b] = np.log(s) - np.log1p(-s)
+        return y
+
+    def from_free(self, y):
+        """
+        Returns theta, the log-determinant of the transform and dtheta/dy
+        """
+        y = np.atleast_2d(y)
+        theta = y.copy()
+        dtheta = np.ones_like(y)
+        b = ~self.normal
+        width = self.upper[b] - self.lower[b]
+        s = 0.5*(1.0 + np.tanh(0.5*y[:,b])) # Sigmoid without overflow
+        theta[:,b] = self.lower[b] + width*s
+        dtheta[:,b] = width*s*(1.0 - s)
+        with np.errstate(divide="ignore"):
+            log_det = np.sum(np.log(dtheta[:,b]), axis=1)
+        return theta, log_det, dtheta
+
+    def grad_logp_free(self, y):
+        """
+        Log-density (C,) and gradient (C, ndim) in the unbounded parameters
+        """
+        theta, log_det, dtheta = self.from_free(y)
+        lp, grad = self.grad_logp(theta)
+        b = ~self.normal
+        d_log_det = np.zeros_like(grad)
+        d_log_det[:,b] = -np.tanh(0.5*np.atleast_2d(y)[:,b]) # Derivative of log(s*(1-s)), 1-2s
+        lp = lp + log_det
+        lp[np.isnan(lp)] = -np.inf
+        return lp, grad*dtheta + d_log_det
+
+    def fisher_free(self, y):
+        """
+        Gauss-Newton approximation of minus the Hessian in the unbounded parameters
+        """
+        theta, _, dtheta = self.from_free(y)
+        F = self.fisher(theta)*dtheta[:,:,np.newaxis]*dtheta[:,np.newaxis,:]
+        b = np.arange(self.ndim)[~self.normal]
+        with np.errstate(invalid="ignore"):
+            F[:,b,b] += 2*dtheta[:,b]/(self.upper[b] - self.lower[b]) # From log(s*(1-s))
+        return F
+
+    def maximize(self, theta, max_iter=100, tol=1e-9):
+        """
+        Levenberg-Marquardt ascent of the log-density of C starting points
+        in the unbounded parameters, with the Gauss-Newton Hessian
+        Returns the C final points and their log-density (grad_logp_free)
+        """
+        y = self.to_free(theta)
+        lp, grad = self.grad_logp_free(y)
+        lam = np.ones(len(y))
+        I = np.eye(self.ndim)
+        for _ in range(max_iter):
+            F = self.fisher_free(y)
+            F[~np.isfinite(F)] = 0.0
+            d = np.diagonal(F, axis1=1, axis2=2)
+            A = F + lam[:,np.newaxis,np.newaxis]*(d[:,:,np.newaxis]*I + 1e-12*I)
+            try:
+                step = np.linalg.solve(A, grad[:,:,np.newaxis])[:,:,0]
+            except np.linalg.LinAlgError:
+                break
+            lp1, grad1 = self.grad_logp_free(y + step)
+            better = lp1 > lp
+            done = ~better & (np.abs(lp1 - lp) <= tol*np.abs(lp))
+            y[better], grad[better] = y[better] + step[better], grad1[better]
+            gain = np.where(better, lp1 - lp, 0.0)
+            lp[better] = lp1[better]
+            lam = np.where(better, lam/10.0, lam*10.0)
+            if np.all(done | (better & (gain <= tol*np.abs(lp)))) or np.all(lam > 1e12):
+                break
+        return self.from_free(y)[0], lp
+
+    #==========================================================================
+    def sample_prior(self, C, rng):
+        """
+        Draws C parameter vectors from the priors
+        """
+        theta = np.empty((C, self.ndim))
+        u, n = ~self.normal, self.normal
+        theta[:,u] = rng.uniform(self.lower[u], self.upper[u], size=(C, u.sum()))
+        theta[:,n] = rng.normal(self.mu[n], 1.0/np.sqrt(self.tau[n]), size=(C, n.sum()))
+        return theta
+
+    def initial(self, C, rng, oversample=1, max_tries=100):
+        """
+        C prior draws with a finite log-posterior
+        With oversample > 1, the C most probable of C*oversample draws
+        The points of start, if any, compete with the prior draws
+        """
+        n = C*max(int(oversample), 1)
+        theta = self.sample_prior(n, rng)
+        if self.start is not None:
+            theta = np.vstack((self.start, theta))
+        lp = self.logp(theta)
+        for _ in range(max_tries):
+            bad = ~np.isfinite(lp)
+            if not bad.any():
+                break
+            theta[bad] = self.sample_prior(bad.sum(), rng)
+            lp[bad] = self.logp(theta[bad])
+        best = np.argsort(-lp)[:C]
+        return theta[best], lp[best]
+
+    def prior_scale(self):
+        """
+        Width of each prior (sd of Normal priors, range/sqrt(12) of Uniform)
+        """
+        with np.errstate(all="ignore"):
+            return np.where(self.normal, 1.0/np.sqrt(self.tau), (self.upper - self.lower)/np.sqrt(12))
+
+    def values(self):
+        """
+        Current values of the stochastics as one vector
+        """
+        return np.concatenate([np.ravel(s.value) for s in self.stochastics]).astype(float)
+
+    def set_values(self, x):
+        """
+        Sets the values of the stochastics from one vector
+        """
+        for s, sl, sh in zip(self.stochastics, self.slices, self.shapes):
+            v = x[sl].reshape(sh)
+            s.value = v if sh else float(v)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:21:08 2026
+
+Preprocessing of raw SIP measurements
+Repeated or normal/reciprocal measurements of the same frequency are
+averaged for all samples at once and their spread gives amp_err and pha_err
+The result is the packed dictionary of utils.load_data, so spectra go
+straight to mcmcinv without writing averaged .dat files
+
+Use:
+packed = load_raw('/Documents/RawFiles/', ph_units='mrad')
+sol = mcmcinv('ColeCole', packed["files"][0], data=unpack_data(packed, 0))
+"""
+
+from __future__ import print_function
+
+import numpy as np
+from bisip.utils import list_data_files, read_dat, split_filepath, compute_data
+
+#==============================================================================
+def average_records(sample, freq, amp, pha, ph_units="mrad", names=None,
+                    files=None, error="std", rtol=1e-6, amp_floor=None, pha_floor=None):
+    """
+    Averages raw records by sample and frequency
+    Pass one value per record: integer sample index, frequency,
+    amplitude and phase (any order, any number of repeats)
+    Frequencies closer than rtol are the same frequency, each spectrum
+    is sorted by descending frequency (same order as get_data)
+    error="std": errors are the standard deviation of the repeats
+    error="sem": errors are the standard error of the mean
+    amp_floor (relative to the amplitude) and pha_floor (in ph_units) are
+    the smallest errors, needed for frequencies measured once (or with
+    identical repeats): a null error raises ValueError
+    Returns the packed dictionary of utils.load_data
+    """
+    sample, freq = np.asarray(sample), np.asarray(freq, dtype=float)
+    amp, pha = np.asarray(amp, dtype=float), np.asarray(pha, dtype=float)
+    order = np.lexsort((-freq, sample)) # Descending frequencies, as in .dat files
+    s, f = sample[order], freq[order]
+    new_group = np.ones(len(f), dtype=bool)
+    new_group[1:] = (s[1:] != s[:-1]) | (abs(f[1:] - f[:-1]) > rtol*abs(f[1:]))
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, len(f)))
+
+    def mean_and_error(x):
+        x = x[order]
+        mean = np.add.reduceat(x, starts)/counts
+        var = np.add.reduceat((x - np.repeat(mean, counts))**2, starts)/np.maximum(counts-1, 1)
+        err = np.sqrt(var)
+        if error == "sem":
+            err = err/np.sqrt(counts)
+        return mean, err
+
+    packed = {}
+    packed["freq"] = np.add.reduceat(f, starts)/counts
+    packed["amp"], packed["amp_err"] = mean_and_error(amp)
+    packed["pha"], packed["pha_err"] = mean_and_error(pha)
+    if amp_floor is not None:
+        packed["amp_err"] = np.maximum(packed["amp_err"], amp_floor*abs(packed["amp"]))
+    if pha_floor is not None:
+        packed["pha_err"] = np.maximum(packed["pha_err"], pha_floor)
+    null = (packed["amp_err"] <= 0) | (packed["pha_err"] <= 0)
+    if null.any():
+        raise ValueError("%d frequencies measured once or with identical repeats have a null error, pass amp_floor and pha_floor"
+                         %np.count_nonzero(null))
+    packed["n_repeats"] = counts
+
+    group_sample = s[starts]
+    samples = np.unique(group_sample)
+    packed["offsets"] = np.append(np.searchsorted(group_sample, samples), len(starts))
+    if names is None:
+        names = samples.astype(str)
+    else:
+        names = np.asarray(names)[samples]
+    packed["names"] = np.asarray(names)
+    packed["files"] = np.asarray(files)[samples] if files is not None else packed["names"]
+    return compute_data(packed, ph_units)
+
+def load_raw(source, headers=1, ph_units="mrad", error="std", amp_floor=None, pha_floor=None):
+    """
+    Reads and averages raw measurement files
+    Pass a directory, a manifest or a list of paths (see utils.list_data_files)
+    Each file holds the repeated measurements of one sample
+    with the frequency, amplitude and phase in the first 3 columns
+    amp_floor and pha_floor: smallest errors, see average_records
+    Returns the packed dictionary of utils.load_data
+    """
+    files = list_data_files(source)
+    blocks = [read_dat(f, headers) for f in files]
+    sample = np.repeat(np.arange(len(files)), [len(b) for b in blocks])
+    raw = np.vstack([b[:,:3] for b in blocks])
+    names = [split_filepath(f) for f in files]
+    return average_records(sample, raw[:,0], raw[:,1], raw[:,2], ph_units=ph_units,
+                           names=names, files=files, error=error,
+                           amp_floor=amp_floor, pha_floor=pha_floor)
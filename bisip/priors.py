@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Nov  2 09:31:18 2026
+
+Priors of the stochastics of the mcmcinv models
+One table used by the pymc models (models.py) and by the tools that
+sample the priors without pymc (response library, hierarchical inversion)
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+def prior_table(model, cc_modes=2, decomp_poly=4):
+    """
+    Priors of the stochastics of a model: dictionary of
+    name: (shape, "Uniform", lower, upper) or (shape, "Normal", mu, sd)
+    shape is () for scalar stochastics
+    """
+    if model == "ColeCole":
+        n = (cc_modes,)
+        return {"R0"      : ((), "Uniform", 0.7, 1.3),
+                "m"       : (n, "Uniform", 0.0, 1.0),
+                "log_tau" : (n, "Uniform", -7.0, 4.0),
+                "c"       : (n, "Uniform", 0.0, 1.0)}
+    if model == "Dias":
+        return {"R0"      : ((), "Uniform", 0.9, 1.1),
+                "m"       : ((), "Uniform", 0.0, 1.0),
+                "log_tau" : ((), "Uniform", -7.0, 0.0),
+                "eta"     : ((), "Uniform", 0.0, 50.0),
+                "delta"   : ((), "Uniform", 0.0, 1.0)}
+    if model == "Shin":
+        return {"R"       : ((2,), "Uniform", 0.0, 1.0),
+                "log_Q"   : ((2,), "Uniform", -7.0, 2.0),
+                "n"       : ((2,), "Uniform", 0.0, 1.0)}
+    if model == "PDecomp":
+        return {"R0"      : ((), "Uniform", 0.7, 1.3),
+                "a"       : ((decomp_poly+1,), "Normal", 0.0, 0.01)}
+    raise ValueError("No prior table for model %s" %model)
+
+def model_priors(model, cc_modes=2, decomp_poly=4):
+    """
+    Priors of prior_table in the order of BatchPosterior (sorted names):
+    list of (name, size, "Uniform", lower, upper) or (name, size, "Normal", mu, sd)
+    """
+    table = prior_table(model, cc_modes, decomp_poly)
+    return [(k, int(table[k][0][0]) if table[k][0] else 1) + tuple(table[k][1:]) for k in sorted(table)]
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 27 15:40:08 2026
+
+Pool of proposal covariances and starting points learned on previous
+inversions
+Samples of a campaign inverted with the same model configuration have
+nearly the same posterior shape. Each finished inversion adds its
+posterior mean and covariance (of its best chain) to the pool, and the next
+ones start from the pooled means that fit their data best with the
+covariance of these entries as proposal (mcmc["pool"])
+Once the pool holds pool_min entries, the burn-in and the covariance
+delay are multiplied by pool_burn (see pooled_mcmc)
+With a folder, the entries are .npz files shared by all processes of a
+batch run (one file per inversion, written atomically):
+    mcmc = dict(mcmcinv.default_mcmc, pool="/campaign/proposals")
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import socket
+import hashlib
+import threading
+import numpy as np
+
+# Pools opened by this process, by folder
+_pools = {}
+_lock = threading.Lock()
+
+def config_key(post):
+    """
+    Key of the model configuration of a BatchPosterior: model,
+    parameter layout (cc_modes, decomp_poly, guess_noise) and c_exp
+    """
+    parts = [post.model] + ["%s%s" %(k, sh) for (k, sh) in zip(post.names, post.shapes)]
+    if post.model in ["PDecomp", "RTD", "CCD"]:
+        parts.append("c_exp=%r" %float(post.c_exp))
+    return "%s-%s" %(post.model, hashlib.sha1(" ".join(parts).encode()).hexdigest()[:16])
+
+def _chain_logp(post, draws):
+    C, n, D = draws.shape
+    lp = post.logp(draws.reshape(-1, D)).reshape(C, n)
+    return np.where(np.isfinite(lp), lp, -1e300)
+
+def best_chain(post, draws):
+    """
+    Chain (n_draws, ndim) of draws (n_chain, n_draws, ndim) with the
+    highest mean log-posterior
+    Chains stuck in other modes, or with other mode labels, are left out
+    """
+    return draws[np.argmax(_chain_logp(post, draws).mean(axis=1))]
+
+def good_chains(post, draws, tol=3.0):
+    """
+    Chains of draws (n_chain, n_draws, ndim) whose mean log-posterior is
+    within tol standard deviations (of the log-posterior of the best
+    chain) of the best one
+    """
+    lp = _chain_logp(post, draws)
+    best = np.argmax(lp.mean(axis=1))
+    return draws[lp.mean(axis=1) >= lp[best].mean() - tol*lp[best].std()]
+
+def chain_moments(post, draws):
+    """
+    Mean (ndim,) and covariance (ndim, ndim) of the best chain of
+    draws (n_chain, n_draws, ndim)
+    """
+    best = best_chain(post, draws)
+    return best.mean(axis=0), np.atleast_2d(np.cov(best, rowvar=False))
+
+def short_burn(mc_p, f):
+    """
+    MCMC parameters with the burn-in, covariance delay and interval
+    multiplied by f. The number of kept draws is unchanged
+    """
+    short = lambda n: max(int(round(f*n)), 1)
+    burn = short(mc_p["nb_burn"])
+    return dict(mc_p, nb_iter=mc_p["nb_iter"] - mc_p["nb_burn"] + burn, nb_burn=burn,
+                cov_delay=short(mc_p["cov_delay"]), cov_inter=short(mc_p["cov_inter"]),
+                tune_inter=min(mc_p["tune_inter"], max(burn//4, 1)))
+
+#==============================================================================
+class ProposalPool(object):
+    """
+    Posterior means and covariances of previous inversions, by model
+    configuration (config_key)
+    folder: where the entries are shared, None to keep them in memory
+    max_entries: number of most recent entries used per configuration
+    """
+
+    def __init__(self, folder=None, max_entries=50):
+        self.folder = folder
+        self.max_entries = max_entries
+        self._memory = {}
+        self._n = 0
+
+    def add(self, post, draws):
+        """
+        Adds the posterior of draws (n_chain, n_draws, ndim) of BatchPosterior post
+        Runs with a stuck parameter (zero variance) are left out
+        """
+        mean, cov = chain_moments(post, np.asarray(draws, dtype=float))
+        if not (np.all(np.isfinite(mean)) and np.all(np.isfinite(cov)) and np.all(np.diag(cov) > 0)):
+            return
+        key = config_key(post)
+        if self.folder is None:
+            self._memory.setdefault(key, []).append((mean, cov))
+            return
+        folder = os.path.join(self.folder, key)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError: # Created by another process in the meantime
+                pass
+        self._n += 1
+        name = "%017.6f-%s-%d-%d.npz" %(time.time(), socket.gethostname(), os.getpid(), self._n)
+        tmp = os.path.join(folder, "."+name+".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, mean=mean, cov=cov)
+        os.rename(tmp, os.path.join(folder, name)) # Readers never see a partial file
+
+    def entries(self, post):
+        """
+        Means (n, ndim) and covariances (n, ndim, ndim) of the most
+        recent entries of the configuration of post
+        """
+        key = config_key(post)
+        if self.folder is None:
+            found = self._memory.get(key, [])[-self.max_entries:]
+        else:
+            folder = os.path.join(self.folder, key)
+            names = sorted(f for f in os.listdir(folder) if f.endswith(".npz")) if os.path.isdir(folder) else []
+            found = []
+            for f in names[-self.max_entries:]:
+                try:
+                    with np.load(os.path.join(folder, f)) as e:
+                        found.append((e["mean"], e["cov"]))
+                except Exception: # Corrupt file, skip it
+                    pass
+        D = post.ndim
+        if not found:
+            return np.empty((0, D)), np.empty((0, D, D))
+        return np.array([m for (m, _) in found]), np.array([c for (_, c) in found])
+
+    def count(self, post):
+        return len(self.entries(post)[0])
+
+    def start(self, post, rng, k=5, n_draws=50):
+        """
+        Starting points and proposal covariance of BatchPosterior post:
+        the pooled means ranked by their log-posterior, then n_draws
+        points around the best of them, and the average covariance of
+        the k best entries
+        Returns None, None if the pool has no entry for post
+        """
+        means, covs = self.entries(post)
+        if not len(means):
+            return None, None
+        lp = post.logp(means)
+        order = np.argsort(-lp)
+        cov = covs[order[:k]].mean(axis=0)
+        cov += np.diag(1e-8*np.diag(cov) + 1e-20) # Keep it positive definite
+        near = means[order[0]] + rng.standard_normal((n_draws, post.ndim)).dot(np.linalg.cholesky(cov).T)
+        return np.vstack((means[order], near)), cov
+
+def open_pool(pool):
+    """
+    Returns a ProposalPool given as an object or a folder name
+    """
+    if isinstance(pool, ProposalPool):
+        return pool
+    key = os.path.abspath(pool)
+    with _lock:
+        if key not in _pools:
+            _pools[key] = ProposalPool(key)
+        return _pools[key]
+
+def pooled_mcmc(post, mc_p):
+    """
+    MCMC parameters shortened by pool_burn (default 0.1, see short_burn)
+    once the pool has pool_min entries (default 3) for the configuration
+    of post
+    """
+    if open_pool(mc_p["pool"]).count(post) < mc_p.get("pool_min", 3):
+        return mc_p
+    return short_burn(mc_p, mc_p.get("pool_burn", 0.1))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 28 10:21:47 2026
+
+Importance reweighting of posterior draws
+Draws of p(theta | data) are reweighted to p(theta | new data) with the
+likelihood ratio of the new and old data (the priors are the same),
+computed with the batched forward models (BatchPosterior.with_data)
+The effective sample size (ESS) of the weights tells if the draws still
+cover the new posterior
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+def importance_weights(log_ratio):
+    """
+    Normalized weights and effective sample size of log importance ratios
+    """
+    log_ratio = np.where(np.isfinite(log_ratio), log_ratio, -np.inf)
+    if not np.isfinite(log_ratio).any():
+        return np.zeros_like(log_ratio), 0.0
+    w = np.exp(log_ratio - np.max(log_ratio))
+    w /= w.sum()
+    return w, 1.0/np.sum(w**2)
+
+def weighted_moments(theta, w):
+    """
+    Weighted mean (ndim,) and covariance (ndim, ndim) of draws theta (n, ndim)
+    """
+    mean = w.dot(theta)
+    d = theta - mean
+    return mean, np.atleast_2d((w[:,np.newaxis]*d).T.dot(d)/(1.0 - np.sum(w**2) + 1e-300))
+
+def reweight_draws(post, theta, data):
+    """
+    Importance weights of draws theta (n, ndim) of BatchPosterior post
+    for another data dictionary of the same sample
+    Returns the weights, the ESS and the posterior of the new data
+    """
+    new = post.with_data(data)
+    with np.errstate(all="ignore"):
+        log_ratio = new.log_like(theta) - post.log_like(theta)
+    w, ess = importance_weights(log_ratio)
+    return w, ess, new
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 23 10:12:37 2026
+
+Linear-Gaussian inversion of the relaxation time distribution (RTD)
+With fixed relaxation times tau_k and exponent c_exp, the normalized
+response of a Debye/Warburg/Cole-Cole decomposition
+    Z(w) = R0*(1 - sum_k K(w, tau_k)*m_k)
+is linear in (R0, b = R0*m). With a Gaussian smoothness prior on b
+(second differences, weight lambda) the posterior of (R0, b) is
+Gaussian and computed exactly, and lambda can be chosen by maximizing
+the evidence. Draws of the RTD are then as cheap as Normal draws
+Used by the "RTD" model of mcmcinv (sampler "linear")
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from scipy.optimize import nnls
+
+# Default grid of the smoothing weights tried with lam="auto"
+default_lambdas = np.logspace(-3, 5, 33)
+
+def rtd_matrix(kernel):
+    """
+    Design matrix (2*n_freq, 1+n_tau) of the normalized response,
+    real parts then imaginary parts, for the parameters (R0, b)
+    """
+    K = kernel.K
+    u = np.r_[np.ones(len(K)), np.zeros(len(K))]
+    return np.c_[u, -np.r_[K.real, K.imag]]
+
+def smoothing_matrix(n_tau, order=2):
+    """
+    Finite differences of order order of the RTD
+    """
+    return np.diff(np.eye(n_tau), n=order, axis=0)
+
+#==============================================================================
+class LinearRTD(object):
+    """
+    Gaussian posterior of (R0, b = R0*m) of one spectrum
+    kernel: DecompKernel of the frequencies (tau grid and c_exp)
+    zn, zn_err: normalized data and standard deviations (2, n_freq)
+    lam: weight of the smoothness prior, or "auto" for the
+    value of lambdas with the highest evidence
+    nonneg: non-negative least squares instead of Tikhonov, the
+    covariance is then the one of the non-zero components
+    ridge: small weight of the norm of b, so the prior is proper
+    """
+
+    def __init__(self, kernel, zn, zn_err, lam="auto", nonneg=False,
+                 ridge=1e-4, lambdas=default_lambdas):
+        self.kernel = kernel
+        self.X = rtd_matrix(kernel)
+        self.y = np.asarray(zn, dtype=float).ravel()
+        self.W = 1.0/np.asarray(zn_err, dtype=float).ravel()**2
+        n_tau = self.X.shape[1] - 1
+        D = smoothing_matrix(n_tau)
+        self.S = D.T.dot(D) + ridge*np.eye(n_tau)
+        self.XtWX = self.X.T.dot(self.W[:,np.newaxis]*self.X)
+        self.XtWy = self.X.T.dot(self.W*self.y)
+        self.lam = lam
+        self.nonneg = nonneg
+        self.lambdas = np.asarray(lambdas, dtype=float)
+
+    def prior_precision(self, lam):
+        P = np.zeros_like(self.XtWX)
+        P[0,0] = 1e-6 # Nearly flat prior on R0
+        P[1:,1:] = lam**2*self.S
+        return P
+
+    def solve(self, lam):
+        """
+        Returns the posterior mean and precision matrix for weight lam
+        """
+        P = self.prior_precision(lam)
+        A = self.XtWX + P
+        if not self.nonneg:
+            return np.linalg.solve(A, self.XtWy), A
+        # min |W^0.5 (y - X.beta)|^2 + beta.P.beta with beta >= 0
+        L = np.linalg.cholesky(P)
+        M = np.r_[np.sqrt(self.W)[:,np.newaxis]*self.X, L.T]
+        beta = nnls(M, np.r_[np.sqrt(self.W)*self.y, np.zeros(len(P))])[0]
+        return beta, A
+
+    def log_evidence(self, lam):
+        """
+        Log of p(data | lam) for the Gaussian model (Tikhonov)
+        """
+        P = self.prior_precision(lam)
+        A = self.XtWX + P
+        beta = np.linalg.solve(A, self.XtWy)
+        r = self.y - self.X.dot(beta)
+        fit = np.sum(self.W*r**2) + beta.dot(P).dot(beta)
+        return 0.5*(np.linalg.slogdet(P)[1] - np.linalg.slogdet(A)[1]
+                    + np.sum(np.log(self.W)) - len(self.y)*np.log(2*np.pi) - fit)
+
+    def fit(self):
+        """
+        Chooses lambda (if "auto") and computes the posterior
+        Sets lam, evidence (of each of lambdas), beta and cov
+        """
+        self.evidence = np.array([self.log_evidence(l) for l in self.lambdas])
+        if self.lam == "auto":
+            self.lam = self.lambdas[np.argmax(self.evidence)]
+        self.beta, A = self.solve(self.lam)
+        if self.nonneg:
+            active = np.flatnonzero(self.beta > 0)
+            self.cov = np.zeros_like(A)
+            self.cov[np.ix_(active, active)] = np.linalg.inv(A[np.ix_(active, active)])
+        else:
+            self.cov = np.linalg.inv(A)
+        return self
+
+    def sample(self, n, rng):
+        """
+        n draws of (R0, m_1, ..., m_n_tau), with m = b/R0
+        With nonneg, the draws of b are truncated at 0
+        """
+        val, vec = np.linalg.eigh(self.cov)
+        z = rng.standard_normal((n, len(val)))
+        beta = self.beta + (z*np.sqrt(np.maximum(val, 0))).dot(vec.T)
+        if self.nonneg:
+            beta[:,1:] = np.maximum(beta[:,1:], 0)
+        return np.c_[beta[:,0], beta[:,1:]/beta[:,:1]]
@@ -0,0 +1,1000 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 11:02:15 2026
+
+Samplers that work on a BatchPosterior instead of pymc step methods
+Select one with the "sampler" entry of the mcmc dictionary of mcmcinv:
+    "pymc"  : pymc Metropolis or AdaptiveMetropolis (default)
+    "batch" : all chains advanced together, one batched model call per step
+    "ensemble" : affine-invariant ensemble of walkers (stretch or walk moves)
+    "hmc"   : Hamiltonian Monte Carlo with the gradients of the models
+    "tempering" : parallel tempering, chains at several temperatures
+    "smc"   : sequential Monte Carlo, also estimates the log-evidence
+    "laplace" : Gaussian approximation at the maximum, for fast screening
+    "gibbs" : collapsed Gibbs sampler of PDecomp (linear in a)
+    "linear" : exact Gaussian posterior of the RTD model (always used for it)
+    "importance" : draws of a previous run reweighted to new data
+                   (see mcmcinv.reweight)
+    "replay" : draws computed elsewhere, e.g. by bisip.hierarchical
+
+The kept draws are replayed in the pymc model afterwards (ReplayStep),
+one pymc chain per sampler chain, so the traces, statistics, plots
+and saved results work as with the pymc samplers
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import multiprocessing as mp
+import numpy as np
+import pymc
+
+from bisip.posterior import BatchPosterior
+from bisip.rtd import LinearRTD
+from bisip.library import library_start
+from bisip.proposals import open_pool
+from bisip.reweight import importance_weights
+
+#==============================================================================
+class ReplayStep(pymc.StepMethod):
+    """
+    Step method that copies precomputed draws into the stochastics
+    draws: (n_chain, n_draws, ndim), the chain replayed is set by chain
+    Never assigned automatically (competence 0)
+    """
+    _state = []
+
+    def __init__(self, stochastics, post, draws, verbose=-1, tally=False):
+        pymc.StepMethod.__init__(self, stochastics, verbose=verbose, tally=tally)
+        self.post = post
+        self.draws = draws
+        self.chain = 0
+        self._i = 0
+
+    @staticmethod
+    def competence(s):
+        return 0
+
+    def step(self):
+        self.post.set_values(self.draws[self.chain, self._i])
+        self._i += 1
+
+    def tune(self, *args, **kwargs):
+        return False
+
+def replay(MDL, post, draws, mc_p):
+    """
+    Fills the pymc traces of MDL with draws (n_chain, n_draws, ndim)
+    The iteration counters are set as if pymc had sampled
+    nb_iter iterations with nb_burn burn-in and thinning thin
+    """
+    MDL.use_step_method(ReplayStep, post.stochastics, post, draws)
+    step = MDL.step_method_dict[post.stochastics[0]][0]
+    n_draws = draws.shape[1]
+    for c in range(draws.shape[0]):
+        step.chain, step._i = c, 0
+        MDL.sample(n_draws, 0, 1, tune_interval=n_draws+1, progress_bar=False)
+    MDL._iter, MDL._burn, MDL._thin = mc_p["nb_iter"], mc_p["nb_burn"], mc_p["thin"]
+    post.set_values(draws[-1, -1])
+
+def n_kept(mc_p):
+    """
+    Number of draws pymc keeps per chain
+    """
+    return len(range(mc_p["nb_burn"], mc_p["nb_iter"], mc_p["thin"]))
+
+def tune_scale(scale, acc_rate):
+    """
+    Scale factor tuning of pymc's Metropolis
+    """
+    if acc_rate < 0.001:
+        return scale*0.1
+    elif acc_rate < 0.05:
+        return scale*0.5
+    elif acc_rate < 0.2:
+        return scale*0.9
+    elif acc_rate > 0.95:
+        return scale*10.0
+    elif acc_rate > 0.75:
+        return scale*2.0
+    elif acc_rate > 0.5:
+        return scale*1.1
+    return scale
+
+def initial_proposal(post, mc_p):
+    """
+    Cholesky factor of the first random walk proposal covariance:
+    from post.start_cov if there is one, else a tenth of the prior widths
+    """
+    if post.start_cov is not None:
+        return mc_p["prop_scale"]*np.linalg.cholesky(post.start_cov*2.38**2/post.ndim)
+    return np.diag(0.1*mc_p["prop_scale"]*post.prior_scale())
+
+def start_state(post, mc_p, rng):
+    """
+    Starting points and proposal covariance of the mcmc dictionary:
+    "library": nearest responses of a bisip.library.ResponseLibrary
+    (object or file name), "library_k" of them (default 20)
+    "pool": pooled posteriors of previous inversions, a
+    bisip.proposals.ProposalPool (object or folder), with the
+    covariance of the "pool_k" best entries (default 5)
+    "warm": dictionary of parameter names, starting points (theta) and
+    covariance (cov) of a previous run (see bisip.sequential)
+    The covariance of a warm start is preferred to the pool one,
+    which is preferred to the library one
+    Returns None, None if there are none
+    """
+    starts, cov = [], None
+    if mc_p.get("library") is not None:
+        x, cov = library_start(mc_p["library"], post, rng, mc_p.get("library_k", 20))
+        starts.append(x)
+    if mc_p.get("pool") is not None:
+        x, pool_cov = open_pool(mc_p["pool"]).start(post, rng, mc_p.get("pool_k", 5))
+        if x is not None:
+            starts.append(x)
+            cov = pool_cov
+    if mc_p.get("warm") is not None:
+        warm = mc_p["warm"]
+        if list(warm["names"]) != post.names:
+            raise ValueError("Warm start of parameters %s for a model of %s" %(list(warm["names"]), post.names))
+        starts.append(np.atleast_2d(warm["theta"]))
+        if warm["cov"] is not None:
+            cov = warm["cov"]
+    if not starts:
+        return None, None
+    return np.vstack(starts), cov
+
+def trace_draws(MDL, post, n_chain):
+    """
+    Kept draws (n_chain, n_draws, ndim) of the pymc traces of MDL
+    """
+    return np.array([np.hstack([np.asarray(MDL.trace(k, chain=c)[:], dtype=float).reshape(-1, sl.stop - sl.start)
+                                for (k, sl) in zip(post.names, post.slices)])
+                     for c in range(n_chain)])
+
+def add_to_pool(MDL, sol, mc_p):
+    """
+    Adds the posterior of a finished run to mc_p["pool"]
+    """
+    post = BatchPosterior(sol, MDL)
+    open_pool(mc_p["pool"]).add(post, trace_draws(MDL, post, mc_p["nb_chain"]))
+
+def warm_start(MDL, sol, mc_p):
+    """
+    Sets the initial values and proposals of the pymc step methods of MDL
+    from start_state, for the "pymc" sampler
+    """
+    post = BatchPosterior(sol, MDL)
+    rng = np.random.RandomState(mc_p.get("seed", None))
+    post.start, post.start_cov = start_state(post, mc_p, rng)
+    if post.start is None:
+        return
+    x, _ = post.initial(1, rng, oversample=mc_p.get("init_draws", 50))
+    post.set_values(x[0])
+    if post.start_cov is None:
+        return
+    for step in set(sum(list(MDL.step_method_dict.values()), [])):
+        if isinstance(step, pymc.AdaptiveMetropolis):
+            # Same covariance in the order of the step method
+            idx = np.zeros(post.ndim, dtype=int)
+            for s, sl in zip(post.stochastics, post.slices):
+                idx[step._slices[s]] = np.arange(sl.start, sl.stop)
+            step.C = post.start_cov[np.ix_(idx, idx)]*2.38**2/post.ndim
+            step.updateproposal_sd()
+        elif isinstance(step, pymc.Metropolis):
+            i = post.stochastics.index(step.stochastic)
+            sd = np.sqrt(np.diag(post.start_cov)[post.slices[i]])
+            step.proposal_sd = sd.reshape(post.shapes[i]) if post.shapes[i] else float(sd[0])
+
+#==============================================================================
+def batch_metropolis(post, mc_p, rng):
+    """
+    Random walk Metropolis on nb_chain chains at once
+    Each step proposes a (nb_chain, ndim) matrix, evaluates it with one
+    batched model call and accepts or rejects all chains with vectorized
+    comparisons
+    During burn-in the proposal scale is tuned every tune_inter iterations
+    and, if adaptive, the proposal covariance is learned from the past
+    states of all chains after cov_delay iterations, every cov_inter
+    The proposal is fixed after burn-in
+    Returns the kept draws (nb_chain, n_kept, ndim) and a dictionary of info
+    """
+    C, D = mc_p["nb_chain"], post.ndim
+    n_iter, n_burn, thin = mc_p["nb_iter"], mc_p["nb_burn"], mc_p["thin"]
+    x, lp = post.initial(C, rng, oversample=mc_p.get("init_draws", 50))
+    L = initial_proposal(post, mc_p)
+    scale = 1.0
+    draws = np.empty((C, n_kept(mc_p), D))
+    history = np.empty((min(n_burn, n_iter), C, D))
+    accepted, tried, n_acc = 0, 0, 0
+    k = 0
+    for i in range(n_iter):
+        prop = x + scale*rng.standard_normal((C, D)).dot(L.T)
+        lp_prop = post.logp(prop)
+        accept = np.log(rng.rand(C)) < lp_prop - lp
+        x[accept], lp[accept] = prop[accept], lp_prop[accept]
+        accepted += accept.sum()
+        tried += C
+        if i < n_burn:
+            history[i] = x
+            if mc_p["adaptive"] and (i+1 >= mc_p["cov_delay"]) and ((i+1) % mc_p["cov_inter"] == 0):
+                past = history[(i+1)//2:i+1] # Forget the start
+                past = (past - past.mean(axis=0)).reshape(-1, D) # Within-chain covariance
+                cov = np.atleast_2d(np.cov(past, rowvar=False))
+                cov += np.diag(1e-8*np.diag(cov) + 1e-20) # Keep it positive definite
+                L = np.linalg.cholesky(cov*2.38**2/D)
+            if (i+1) % mc_p["tune_inter"] == 0:
+                scale = tune_scale(scale, accepted/tried)
+                accepted, tried = 0, 0
+        else:
+            n_acc += accept.sum()
+            if (i - n_burn) % thin == 0:
+                draws[:,k] = x
+                k += 1
+    acc_rate = n_acc/max(C*(n_iter - n_burn), 1)
+    return draws, {"acceptance": acc_rate, "proposal_cov": L.dot(L.T)*scale**2}
+
+#==============================================================================
+# Worker processes of the samplers (mcmc option n_jobs)
+_pool_post = None
+
+def _init_pool(post):
+    global _pool_post
+    _pool_post = post
+
+def _pool_call(args):
+    method, theta = args
+    return getattr(_pool_post, method)(theta)
+
+class WorkerPool(object):
+    """
+    Pool of n_jobs worker processes holding a BatchPosterior
+    """
+
+    def __init__(self, post, n_jobs):
+        self.n_jobs = n_jobs
+        self._pool = mp.Pool(n_jobs, initializer=_init_pool, initargs=(post,))
+
+    def map(self, f, args):
+        return self._pool.map(f, args)
+
+    def close(self):
+        self._pool.close()
+
+    def join(self):
+        self._pool.join()
+
+def pool_call(post, method, theta, pool=None):
+    """
+    Calls method of post (logp, log_parts, ...) on theta, split
+    in one block per worker if a pool is given
+    """
+    if pool is None:
+        return getattr(post, method)(theta)
+    blocks = [(method, b) for b in np.array_split(theta, pool.n_jobs) if len(b)]
+    out = pool.map(_pool_call, blocks)
+    if isinstance(out[0], tuple):
+        return tuple(np.concatenate(o) for o in zip(*out))
+    return np.concatenate(out)
+
+def make_pool(post, mc_p):
+    """
+    WorkerPool of mc_p["n_jobs"] processes holding post, or None
+    Inside a worker of a pool (batch runs, queue workers), which cannot
+    have children, the sampler runs in the worker itself
+    """
+    n_jobs = mc_p.get("n_jobs", 1)
+    if n_jobs <= 1:
+        return None
+    if mp.current_process().daemon:
+        print("\nn_jobs=%d ignored in a pool worker, sampling with 1 process" %n_jobs)
+        return None
+    return WorkerPool(post, n_jobs)
+
+def n_walkers(mc_p, ndim):
+    """
+    Number of walkers: mcmc["nb_walkers"] or at least 2*(ndim+1),
+    rounded up to an even multiple of nb_chain
+    """
+    C = mc_p["nb_chain"]
+    W = max(mc_p.get("nb_walkers", 0), 2*(ndim + 1))
+    return 2*C*int(np.ceil(W/(2.0*C)))
+
+def ensemble(post, mc_p, rng):
+    """
+    Affine-invariant ensemble sampler (Goodman & Weare, 2010)
+    The walkers are split in two halves, each half is moved at once
+    using the positions of the other half:
+        "stretch" move (default): x' = xj + z*(x - xj), with stretch factor z
+                                  drawn from g(z) ~ 1/sqrt(z) on [1/a, a]
+        "walk" move: x' = x + sum_j zj*(xj - mean(xj)), zj ~ N(0, 1),
+                     over walk_size (default 3) random walkers xj
+    so the proposals follow the shape of the posterior without tuning
+    The stretch move is the most robust, the walk move needs the walkers
+    to be in one mode
+    mcmc options: nb_walkers, move ("stretch" or "walk"), stretch (a,
+    default 2), walk_size and n_jobs (worker processes, default 1, only
+    worth it when one model evaluation is slow)
+    The number of model evaluations is the same as nb_chain pymc chains:
+    W walkers do nb_iter*nb_chain/W ensemble steps. The kept states of
+    the W/nb_chain walkers of each group are interleaved in one chain
+    with the usual length
+    """
+    C, D = mc_p["nb_chain"], post.ndim
+    W = n_walkers(mc_p, D)
+    g, half = W//C, W//2
+    keep = n_kept(mc_p)
+    n_burn = int(np.ceil(mc_p["nb_burn"]/float(g)))
+    n_steps = n_burn + mc_p["thin"]*int(np.ceil(keep/float(g)))
+    move = mc_p.get("move", "stretch")
+    if move not in ["stretch", "walk"]:
+        raise ValueError("Unknown ensemble move %s, use stretch or walk" %move)
+    a = mc_p.get("stretch", 2.0)
+    s = min(max(mc_p.get("walk_size", 3), 2), half)
+    pool = make_pool(post, mc_p)
+    try:
+        x, lp = post.initial(W, rng, oversample=mc_p.get("init_draws", 50))
+        states = np.empty((n_steps - n_burn, W, D))
+        accepted = 0
+        for i in range(n_steps):
+            for k in range(2):
+                moving, other = (slice(0, half), slice(half, W)) if k == 0 else (slice(half, W), slice(0, half))
+                xs, xo = x[moving], x[other]
+                if move == "stretch":
+                    z = ((a - 1.0)*rng.rand(half) + 1.0)**2/a
+                    xj = xo[rng.randint(half, size=half)]
+                    prop = xj + z[:,np.newaxis]*(xs - xj)
+                    log_z = (D - 1.0)*np.log(z)
+                else:
+                    pick = np.argsort(rng.rand(half, half), axis=1)[:,:s] # s helpers per walker
+                    xj = xo[pick]
+                    prop = xs + np.einsum("hs,hsd->hd", rng.standard_normal((half, s)), xj - xj.mean(axis=1, keepdims=True))
+                    log_z = 0.0
+                lp_prop = pool_call(post, "logp", prop, pool)
+                accept = np.log(rng.rand(half)) < log_z + lp_prop - lp[moving]
+                idx = np.arange(moving.start, moving.stop)[accept]
+                x[idx], lp[idx] = prop[accept], lp_prop[accept]
+                if i >= n_burn:
+                    accepted += accept.sum()
+            if i >= n_burn:
+                states[i - n_burn] = x
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    states = states[::mc_p["thin"]] # (steps, W, D)
+    # Walkers of group c: c*g ... (c+1)*g-1, interleaved step by step
+    draws = states.reshape(len(states), C, g, D).transpose(1, 0, 2, 3).reshape(C, -1, D)[:,:keep]
+    acc_rate = accepted/max(float(W*(n_steps - n_burn)), 1.0)
+    return draws, {"acceptance": acc_rate, "nb_walkers": W, "move": move, "evaluations": W*n_steps}
+
+#==============================================================================
+def mass_windows(n_burn):
+    """
+    Ends of the burn-in windows after which the mass matrix is estimated
+    Stan's schedule: a fast start, slow windows doubling in size and a
+    last fast period to adapt the step size to the final mass matrix
+    """
+    if n_burn >= 175:
+        start, end, size = 75, n_burn - 50, 25
+    else:
+        start, end = int(0.15*n_burn), int(0.9*n_burn)
+        size = end - start
+    ends = []
+    i = start
+    while size > 0 and i + size <= end:
+        if i + 3*size > end: # The last window goes to the end
+            size = end - i
+        i += size
+        ends.append(i)
+        size *= 2
+    return start, ends
+
+class DualAveraging(object):
+    """
+    Step size adaptation of Hoffman & Gelman (2014), one step size per chain
+    """
+    def __init__(self, eps, target, gamma=0.05, t0=10.0, kappa=0.75):
+        self.target, self.gamma, self.t0, self.kappa = target, gamma, t0, kappa
+        self.restart(eps)
+
+    def restart(self, eps):
+        self.mu = np.log(10*eps)
+        self.h_bar = np.zeros_like(eps)
+        self.log_eps_bar = np.zeros_like(eps)
+        self.m = 0
+
+    def update(self, accept_prob):
+        self.m += 1
+        m, t0 = self.m, self.t0
+        self.h_bar = (1 - 1.0/(m + t0))*self.h_bar + (self.target - accept_prob)/(m + t0)
+        log_eps = self.mu - np.sqrt(m)/self.gamma*self.h_bar
+        eta = m**-self.kappa
+        self.log_eps_bar = eta*log_eps + (1 - eta)*self.log_eps_bar
+        return np.exp(log_eps)
+
+    def final(self):
+        return np.exp(self.log_eps_bar)
+
+def kinetic(p, inv_mass):
+    return 0.5*np.sum(p.dot(inv_mass)*p, axis=1)
+
+def momentum(shape, inv_mass, rng):
+    """
+    Momenta with covariance the mass matrix, the inverse of inv_mass
+    """
+    L = np.linalg.cholesky(inv_mass)
+    return np.linalg.solve(L.T, rng.standard_normal(shape).T).T
+
+def leapfrog(post, y, p, lp, grad, eps, inv_mass, n_steps):
+    """
+    n_steps leapfrog steps of all chains (eps: step size per chain)
+    """
+    eps = eps[:,np.newaxis]
+    p = p + 0.5*eps*grad
+    for j in range(n_steps):
+        y = y + eps*p.dot(inv_mass)
+        lp, grad = post.grad_logp_free(y)
+        if j < n_steps - 1:
+            p = p + eps*grad
+    p = p + 0.5*eps*grad
+    return y, p, lp, grad
+
+def initial_mass(post, y, dense=True):
+    """
+    Inverse mass matrix from the Gauss-Newton Hessian at y, so the first
+    trajectories already follow the scales and correlations of the
+    parameters (these span many orders of magnitude for PDecomp)
+    """
+    F = post.fisher_free(y)[0]
+    if not dense:
+        F = np.diag(np.diag(F))
+    val, vec = np.linalg.eigh(F)
+    val = np.maximum(val, 1e-12*max(val.max(), 1e-12))
+    return (vec/val).dot(vec.T)
+
+def initial_step_size(post, y, lp, grad, inv_mass, rng, max_tries=50):
+    """
+    Step size of each chain that accepts about half of one leapfrog step
+    (Hoffman & Gelman, 2014, algorithm 4)
+    """
+    eps = np.ones(len(y))
+    p = momentum(y.shape, inv_mass, rng)
+    H0 = -lp + kinetic(p, inv_mass)
+    def log_ratio(eps):
+        _, p1, lp1, _ = leapfrog(post, y, p, lp, grad, eps, inv_mass, 1)
+        with np.errstate(invalid="ignore"):
+            d = H0 - (-lp1 + kinetic(p1, inv_mass))
+        return np.where(np.isnan(d), -np.inf, d)
+    d = log_ratio(eps)
+    direction = np.where(d > np.log(0.5), 1.0, -1.0)
+    active = np.ones(len(y), dtype=bool)
+    for _ in range(max_tries):
+        active &= direction*d > -direction*np.log(2.0)
+        if not active.any():
+            break
+        eps[active] *= 2.0**direction[active]
+        d = log_ratio(eps)
+    return eps
+
+def hmc(post, mc_p, rng):
+    """
+    Hamiltonian Monte Carlo on nb_chain chains at once
+    Bounded (Uniform) parameters are sampled on the logit scale, and the
+    gradients come from the derivatives of the models (bisip.kernels)
+    The chains start from prior draws moved to the closest mode with
+    Levenberg-Marquardt steps (BatchPosterior.maximize)
+    Each iteration runs n_leapfrog steps (mcmcinv option, default 20),
+    jittered between 1 and 2*n_leapfrog-1 to avoid periodic trajectories
+    During burn-in, the step size of each chain is adapted by dual
+    averaging to accept target_accept (default 0.8) of the trajectories
+    and the mass matrix, initialized from the Gauss-Newton Hessian, is
+    estimated in windows (mass_windows), dense (default) or diagonal if
+    dense_mass is False
+    One iteration costs n_leapfrog model and gradient evaluations, so
+    nb_iter and nb_burn can be much smaller than with Metropolis
+    """
+    C, D = mc_p["nb_chain"], post.ndim
+    n_iter, n_burn, thin = mc_p["nb_iter"], mc_p["nb_burn"], mc_p["thin"]
+    n_leapfrog = mc_p.get("n_leapfrog", 20)
+    x, _ = post.initial(C, rng, oversample=mc_p.get("init_draws", 50))
+    x, _ = post.maximize(x) # Trajectories can't climb from far in the tails
+    y = post.to_free(x)
+    lp, grad = post.grad_logp_free(y)
+    dense = mc_p.get("dense_mass", True)
+    inv_mass = initial_mass(post, y[np.argmax(lp)], dense)
+    eps = initial_step_size(post, y, lp, grad, inv_mass, rng)
+    adapt = DualAveraging(eps, mc_p.get("target_accept", 0.8))
+    start, ends = mass_windows(n_burn)
+    window = []
+    draws = np.empty((C, n_kept(mc_p), D))
+    k, accepted, divergent = 0, 0.0, 0
+    for i in range(n_iter):
+        p = momentum((C, D), inv_mass, rng)
+        H0 = -lp + kinetic(p, inv_mass)
+        n_steps = rng.randint(1, 2*n_leapfrog)
+        y1, p1, lp1, grad1 = leapfrog(post, y, p, lp, grad, eps*rng.uniform(0.9, 1.1), inv_mass, n_steps)
+        with np.errstate(invalid="ignore"):
+            log_alpha = np.minimum(H0 - (-lp1 + kinetic(p1, inv_mass)), 0.0)
+        log_alpha[np.isnan(log_alpha)] = -np.inf
+        accept = np.log(rng.rand(C)) < log_alpha
+        y[accept], lp[accept], grad[accept] = y1[accept], lp1[accept], grad1[accept]
+        if i < n_burn:
+            eps = adapt.update(np.exp(log_alpha))
+            if i >= start:
+                window.append(y.copy())
+            if i + 1 in ends:
+                past = np.array(window) # (n, C, D)
+                past = (past - past.mean(axis=0)).reshape(-1, D) # Within-chain covariance
+                n = len(past)
+                cov = np.atleast_2d(np.cov(past, rowvar=False))
+                if not dense:
+                    cov = np.diag(np.diag(cov))
+                inv_mass = (n/(n + 5.0))*cov + 1e-3*(5.0/(n + 5.0))*np.diag(np.diag(cov)) # Stan's regularization, relative
+                window = []
+                eps = initial_step_size(post, y, lp, grad, inv_mass, rng)
+                adapt.restart(eps)
+            if i + 1 == n_burn:
+                eps = adapt.final()
+        else:
+            accepted += np.exp(log_alpha).sum()
+            divergent += np.sum(log_alpha < -1000)
+            if (i - n_burn) % thin == 0:
+                draws[:,k] = post.from_free(y)[0]
+                k += 1
+    n_after = max(C*(n_iter - n_burn), 1)
+    return draws, {"acceptance": accepted/n_after, "step_size": eps, "inv_mass": inv_mass,
+                   "divergent": divergent, "n_leapfrog": n_leapfrog}
+
+#==============================================================================
+def temperature_ladder(n_temps, t_max, gaps=None):
+    """
+    Temperatures from 1 to t_max, geometric or with the given
+    relative gaps of log(T) between neighbours
+    """
+    if n_temps == 1:
+        return np.ones(1)
+    if gaps is None:
+        gaps = np.ones(n_temps - 1)
+    return t_max**np.r_[0.0, np.cumsum(gaps)/np.sum(gaps)]
+
+def tempering(post, mc_p, rng):
+    """
+    Parallel tempering (replica exchange) of nb_chain ladders of
+    nb_temps chains (default 8), from T = 1 to T = t_max (default 1000)
+    Chain k targets prior*likelihood**(1/T_k). Each iteration moves all
+    chains with random walk Metropolis (scale and covariance tuned per
+    temperature as in batch_metropolis), then proposes swaps between
+    neighbour temperatures, alternating even and odd pairs
+    During burn-in, the ladder is adapted every tune_inter iterations to
+    equalize the swap acceptance rates (Vousden et al., 2016)
+    Only the T = 1 chains are kept. The swap acceptance rates and the
+    temperatures are returned in the info dictionary
+    All chains are evaluated in one batched call, split over n_jobs
+    worker processes if n_jobs > 1
+    """
+    C, D = mc_p["nb_chain"], post.ndim
+    K = mc_p.get("nb_temps", 8)
+    t_max = float(mc_p.get("t_max", 1000.0))
+    n_iter, n_burn, thin = mc_p["nb_iter"], mc_p["nb_burn"], mc_p["thin"]
+    gaps = np.ones(max(K - 1, 1))
+    beta = 1.0/temperature_ladder(K, t_max, gaps)
+    pool = make_pool(post, mc_p)
+    try:
+        x, _ = post.initial(C*K, rng, oversample=mc_p.get("init_draws", 50))
+        x = x[rng.permutation(C*K)].reshape(K, C, D) # (temperature, ladder, parameter)
+        lpri, ll = [a.reshape(K, C) for a in pool_call(post, "log_parts", x.reshape(-1, D), pool)]
+        L = np.tile(initial_proposal(post, mc_p), (K, 1, 1))
+        scale = np.ones(K)
+        draws = np.empty((C, n_kept(mc_p), D))
+        history = np.empty((min(n_burn, n_iter), K, C, D))
+        accepted, tried = np.zeros(K), 0
+        swaps, swap_tries = np.zeros(max(K - 1, 1)), np.zeros(max(K - 1, 1))
+        n_acc, n_adapt, k = 0, 0, 0
+        for i in range(n_iter):
+            if i == n_burn: # Swap rates after burn-in only
+                swaps[:], swap_tries[:] = 0, 0
+            # Metropolis moves at each temperature
+            prop = x + scale[:,np.newaxis,np.newaxis]*np.einsum("kde,kce->kcd", L, rng.standard_normal((K, C, D)))
+            lpri1, ll1 = [a.reshape(K, C) for a in pool_call(post, "log_parts", prop.reshape(-1, D), pool)]
+            with np.errstate(invalid="ignore"):
+                log_alpha = lpri1 + beta[:,np.newaxis]*ll1 - lpri - beta[:,np.newaxis]*ll
+            accept = np.log(rng.rand(K, C)) < np.nan_to_num(log_alpha, nan=-np.inf)
+            x[accept], lpri[accept], ll[accept] = prop[accept], lpri1[accept], ll1[accept]
+            accepted += accept.sum(axis=1)
+            tried += C
+            # Swaps between neighbours (j, j+1)
+            for j in range(i % 2, K - 1, 2):
+                with np.errstate(invalid="ignore"):
+                    log_r = (beta[j] - beta[j+1])*(ll[j+1] - ll[j])
+                swap = np.log(rng.rand(C)) < np.nan_to_num(log_r, nan=-np.inf)
+                for a in (x, ll, lpri):
+                    a[j][swap], a[j+1][swap] = a[j+1][swap], a[j][swap].copy()
+                swaps[j] += swap.sum()
+                swap_tries[j] += C
+            if i < n_burn:
+                history[i] = x
+                if mc_p["adaptive"] and (i+1 >= mc_p["cov_delay"]) and ((i+1) % mc_p["cov_inter"] == 0):
+                    past = history[(i+1)//2:i+1]
+                    past = past - past.mean(axis=0) # Within-chain covariance
+                    for t in range(K):
+                        cov = np.atleast_2d(np.cov(past[:,t].reshape(-1, D), rowvar=False))
+                        cov += np.diag(1e-8*np.diag(cov) + 1e-20)
+                        L[t] = np.linalg.cholesky(cov*2.38**2/D)
+                if (i+1) % mc_p["tune_inter"] == 0:
+                    scale = np.array([tune_scale(sc, a/tried) for (sc, a) in zip(scale, accepted)])
+                    accepted[:], tried = 0, 0
+                    if K > 2:
+                        rate = swaps/np.maximum(swap_tries, 1)
+                        n_adapt += 1
+                        gaps *= np.exp((rate - rate.mean())/(1.0 + 0.1*n_adapt))
+                        beta = 1.0/temperature_ladder(K, t_max, gaps)
+                    swaps[:], swap_tries[:] = 0, 0
+            else:
+                n_acc += accept[0].sum()
+                if (i - n_burn) % thin == 0:
+                    draws[:,k] = x[0]
+                    k += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    n_after = max(C*(n_iter - n_burn), 1)
+    return draws, {"acceptance": n_acc/n_after, "temperatures": 1.0/beta,
+                   "swap_acceptance": swaps/np.maximum(swap_tries, 1)}
+
+#==============================================================================
+def next_beta(ll, beta, target_ess):
+    """
+    Largest inverse temperature after beta at which the effective sample
+    size of the incremental weights exp((beta1 - beta)*ll) is target_ess
+    Returns it and the log of the incremental weights
+    """
+    def log_w(b):
+        return np.where(np.isfinite(ll), (b - beta)*ll, -np.inf)
+    def ess(b):
+        lw = log_w(b)
+        w = np.exp(lw - lw.max())
+        return w.sum()**2/np.sum(w**2)
+    if ess(1.0) >= target_ess:
+        return 1.0, log_w(1.0)
+    lo, hi = beta, 1.0
+    for _ in range(60):
+        mid = 0.5*(lo + hi)
+        if ess(mid) >= target_ess:
+            lo = mid
+        else:
+            hi = mid
+    b = max(lo, beta + 1e-12)
+    return b, log_w(b)
+
+def systematic_resample(w, rng, n=None):
+    """
+    Indices of n particles (default len(w)) resampled with normalized weights w
+    """
+    n = len(w) if n is None else n
+    u = (rng.rand() + np.arange(n))/n
+    return np.minimum(np.searchsorted(np.cumsum(w), u), len(w) - 1)
+
+def smc(post, mc_p, rng):
+    """
+    Sequential Monte Carlo with adaptive likelihood tempering
+    nb_particles (default 2000) prior draws are moved to the posterior
+    through prior*likelihood**beta, with beta from 0 to 1 chosen so the
+    effective sample size of each reweighting is ess (default 0.5)
+    times nb_particles. After each reweighting the particles are
+    resampled and moved with smc_steps (default 10) Metropolis steps,
+    with the proposal covariance of the population
+    The product of the mean incremental weights estimates the evidence
+    p(data|model), returned as log_evidence in the info dictionary
+    At beta = 1 the population is moved until it fills nb_chain chains
+    of the usual length; nb_iter and nb_burn only set that length
+    All particles are evaluated in one batched call, split over n_jobs
+    worker processes if n_jobs > 1
+    """
+    C, D = mc_p["nb_chain"], post.ndim
+    N = mc_p.get("nb_particles", 2000)
+    target_ess = mc_p.get("ess", 0.5)*N
+    n_steps = mc_p.get("smc_steps", 10)
+    pool = make_pool(post, mc_p)
+    def move(x, lpri, ll, beta, scale):
+        # Random walk Metropolis of all particles at inverse temperature beta
+        cov = np.atleast_2d(np.cov(x, rowvar=False))
+        L = np.linalg.cholesky(cov + np.diag(1e-8*np.diag(cov) + 1e-20))*2.38/np.sqrt(D)
+        n_acc = 0
+        for _ in range(n_steps):
+            prop = x + scale*rng.standard_normal((N, D)).dot(L.T)
+            lpri1, ll1 = pool_call(post, "log_parts", prop, pool)
+            with np.errstate(invalid="ignore"):
+                log_alpha = lpri1 + beta*ll1 - lpri - beta*ll
+            accept = np.log(rng.rand(N)) < np.nan_to_num(log_alpha, nan=-np.inf)
+            x[accept], lpri[accept], ll[accept] = prop[accept], lpri1[accept], ll1[accept]
+            n_acc += accept.sum()
+        acc_rate = n_acc/float(N*n_steps)
+        return x, lpri, ll, tune_scale(scale, acc_rate), acc_rate
+    try:
+        x = post.sample_prior(N, rng)
+        lpri, ll = pool_call(post, "log_parts", x, pool)
+        beta, log_z, scale = 0.0, 0.0, 1.0
+        betas, rates = [0.0], []
+        while beta < 1.0:
+            beta, log_w = next_beta(ll, beta, target_ess)
+            m = log_w.max()
+            log_z += m + np.log(np.mean(np.exp(log_w - m)))
+            w = np.exp(log_w - m)
+            idx = systematic_resample(w/w.sum(), rng)
+            x, lpri, ll = x[idx], lpri[idx], ll[idx]
+            x, lpri, ll, scale, acc = move(x, lpri, ll, beta, scale)
+            betas.append(beta)
+            rates.append(acc)
+        # Fill the chains with the population at beta = 1
+        keep = n_kept(mc_p)
+        states = [x.copy()]
+        while len(states)*N < C*keep:
+            x, lpri, ll, scale, acc = move(x, lpri, ll, 1.0, scale)
+            states.append(x.copy())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    states = np.concatenate(states)
+    draws = states[rng.permutation(len(states))[:C*keep]].reshape(C, keep, D)
+    return draws, {"acceptance": np.mean(rates[-1:]), "log_evidence": log_z, "betas": np.array(betas),
+                   "stage_acceptance": np.array(rates), "nb_particles": N}
+
+#==============================================================================
+def laplace(post, mc_p, rng):
+    """
+    Gaussian (Laplace) approximation of the posterior for fast screening
+    The maximum is found with Levenberg-Marquardt steps from the n_starts
+    (default 8) most probable of many prior draws, in the unbounded
+    parameters. The covariance is the inverse of the Gauss-Newton Hessian
+    there. The draws of this Gaussian, mapped back to the bounded
+    parameters, fill the chains, so a few hundred draws per chain
+    (nb_iter - nb_burn) are enough for the results and the fit band
+    The info dictionary holds the maximum (map), the covariance of the
+    unbounded parameters (cov) and the Laplace estimate of the log-evidence
+    """
+    C, D = mc_p["nb_chain"], post.ndim
+    x0, _ = post.initial(mc_p.get("n_starts", 8), rng, oversample=mc_p.get("init_draws", 50))
+    x, lp = post.maximize(x0)
+    best = np.argmax(lp)
+    y = post.to_free(x[best:best+1])
+    F = post.fisher_free(y)[0]
+    val, vec = np.linalg.eigh(F)
+    positive = np.all(val > 0)
+    val = np.maximum(val, 1e-12*max(val.max(), 1e-12))
+    cov = (vec/val).dot(vec.T)
+    keep = n_kept(mc_p)
+    z = rng.standard_normal((C*keep, D))
+    draws = post.from_free(y + (z/np.sqrt(val)).dot(vec.T))[0].reshape(C, keep, D)
+    log_z = lp[best] + 0.5*D*np.log(2*np.pi) - 0.5*np.sum(np.log(val))
+    return draws, {"acceptance": 1.0, "map": x[best], "cov": cov, "log_evidence": log_z,
+                   "positive_definite": positive}
+
+#==============================================================================
+class DecompConditionals(object):
+    """
+    Conditional distributions of the PDecomp posterior
+    zmod = R0*(u - G.a) is linear in a, with a Normal prior on a,
+    so a can be integrated out of p(R0 | data) and drawn exactly from
+    p(a | R0, data). Arrays are batched over C chains
+    """
+    def __init__(self, post):
+        if post.model != "PDecomp":
+            raise ValueError("The gibbs sampler is only for PDecomp, not %s" %post.model)
+        self.post = post
+        self.r0 = post.slices[post.names.index("R0")]
+        self.a = post.slices[post.names.index("a")]
+        if not post.normal[self.a].all() or post.normal[self.r0]:
+            raise ValueError("The gibbs sampler needs a Normal prior on a and a Uniform prior on R0")
+        self.G = post.kernel.G # (2, n_freq, n_coef)
+        self.y = post.zn
+        self.u = post.kernel._unit*np.ones_like(self.y)
+        self.mu, self.lam = post.mu[self.a], post.tau[self.a]
+        self.h0 = self.u - self.G.dot(self.mu) # Response of the prior mean over R0
+
+    def weights(self, theta):
+        # Precision of each data point (C, 2, n_freq)
+        post = self.post
+        if post.noise is None:
+            return post.obs_tau[np.newaxis]*np.ones((len(theta), 1, 1))
+        sd = np.stack([theta[:,sl] for sl in post.noise], axis=1)
+        return 1.0/sd**2*np.ones_like(self.y)[np.newaxis]
+
+    def precision(self, R0, w):
+        # Precision matrix of a given R0 (C, n_coef, n_coef)
+        A = np.einsum("knp,ckn,knq->cpq", self.G, w, self.G)
+        return R0[:,np.newaxis,np.newaxis]**2*A + np.diag(self.lam)
+
+    def log_marginal(self, R0, w):
+        """
+        log p(R0 | noise, data) up to a constant, a integrated out
+        """
+        d = self.y[np.newaxis] - R0[:,np.newaxis,np.newaxis]*self.h0[np.newaxis]
+        b = -R0[:,np.newaxis]*np.einsum("knp,ckn->cp", self.G, w*d)
+        Q = self.precision(R0, w)
+        L = np.linalg.cholesky(Q)
+        c = np.linalg.solve(L, b[:,:,np.newaxis])[:,:,0]
+        quad = np.sum(w*d**2, axis=(1,2)) - np.sum(c**2, axis=1)
+        lp = -0.5*quad - np.sum(np.log(np.diagonal(L, axis1=1, axis2=2)), axis=1)
+        inside = (R0 >= self.post.lower[self.r0][0]) & (R0 <= self.post.upper[self.r0][0])
+        return np.where(inside, lp, -np.inf)
+
+    def draw_a(self, R0, w, rng):
+        """
+        Exact draws of a from p(a | R0, noise, data)
+        """
+        Q = self.precision(R0, w)
+        L = np.linalg.cholesky(Q)
+        r = self.y[np.newaxis] - R0[:,np.newaxis,np.newaxis]*self.u[np.newaxis]
+        b = -R0[:,np.newaxis]*np.einsum("knp,ckn->cp", self.G, w*r) + self.lam*self.mu
+        mean = np.linalg.solve(Q, b[:,:,np.newaxis])[:,:,0]
+        z = rng.standard_normal(mean.shape)[:,:,np.newaxis]
+        return mean + np.linalg.solve(L.transpose(0, 2, 1), z)[:,:,0]
+
+    def draw_noise(self, theta, rng, max_tries=100):
+        """
+        Exact draws of the noise levels (Uniform priors) given R0 and a
+        sd**2 follows an inverse-gamma distribution truncated to the prior
+        """
+        post = self.post
+        r2 = (post.forward(theta) - self.y[np.newaxis])**2
+        n = self.y.shape[1]
+        for j, sl in enumerate(post.noise):
+            half_ss = 0.5*np.sum(r2[:,j], axis=1)
+            lo, hi = post.lower[sl][0], post.upper[sl][0]
+            sd = np.full(len(theta), np.nan)
+            for _ in range(max_tries):
+                bad = ~((sd >= lo) & (sd <= hi))
+                if not bad.any():
+                    break
+                sd[bad] = np.sqrt(half_ss[bad]/rng.gamma(0.5*(n - 1), size=bad.sum()))
+            theta[:,sl] = np.clip(sd, lo, hi)[:,np.newaxis]
+        return theta
+
+def slice_bounded(f, x, fx, lower, upper, rng, max_tries=200):
+    """
+    Slice sampling of C scalars on [lower, upper] with the whole interval
+    as the initial bracket, so only the shrinkage steps are needed
+    """
+    log_y = fx + np.log(rng.rand(len(x)))
+    lo, hi = np.full(len(x), lower), np.full(len(x), upper)
+    new, f_new = x.copy(), fx.copy()
+    todo = np.ones(len(x), dtype=bool)
+    for _ in range(max_tries):
+        x1 = lo + rng.rand(len(x))*(hi - lo)
+        f1 = f(np.where(todo, x1, x))
+        ok = todo & (f1 > log_y)
+        new[ok], f_new[ok] = x1[ok], f1[ok]
+        todo &= ~ok
+        if not todo.any():
+            break
+        left = todo & (x1 < x)
+        lo[left], hi[todo & ~left] = x1[left], x1[todo & ~left]
+    return new, f_new
+
+def gibbs(post, mc_p, rng):
+    """
+    Collapsed Gibbs sampler of the PDecomp model, nb_chain chains at once
+    Each iteration draws
+        R0 from p(R0 | noise, data), with a integrated out (slice sampling)
+        a from p(a | R0, noise, data), exactly (multivariate Normal)
+        the noise levels from p(noise | R0, a, data), exactly, with guess_noise
+    The draws are close to independent, so nb_iter and nb_burn can be
+    orders of magnitude smaller than with Metropolis
+    """
+    C = mc_p["nb_chain"]
+    n_iter, n_burn, thin = mc_p["nb_iter"], mc_p["nb_burn"], mc_p["thin"]
+    cond = DecompConditionals(post)
+    theta, _ = post.initial(C, rng, oversample=mc_p.get("init_draws", 50))
+    draws = np.empty((C, n_kept(mc_p), post.ndim))
+    lower, upper = post.lower[cond.r0][0], post.upper[cond.r0][0]
+    k = 0
+    for i in range(n_iter):
+        w = cond.weights(theta)
+        f = lambda R0: cond.log_marginal(R0, w)
+        R0 = theta[:,cond.r0][:,0]
+        R0, _ = slice_bounded(f, R0, f(R0), lower, upper, rng)
+        theta[:,cond.r0] = R0[:,np.newaxis]
+        theta[:,cond.a] = cond.draw_a(R0, w, rng)
+        if post.noise is not None:
+            theta = cond.draw_noise(theta, rng)
+        if i >= n_burn and (i - n_burn) % thin == 0:
+            draws[:,k] = theta
+            k += 1
+    return draws, {"acceptance": 1.0}
+
+#==============================================================================
+def linear(post, mc_p, rng):
+    """
+    Draws of the exact Gaussian posterior of the RTD model (bisip.rtd)
+    with the smoothing weight and non-negativity options of mcmcinv
+    (rtd_lambda, rtd_nonneg). nb_iter and nb_burn only set the number of
+    draws, a few hundred per chain are enough
+    """
+    if post.model != "RTD":
+        raise ValueError("The linear sampler is only for the RTD model, not %s" %post.model)
+    inv = LinearRTD(post.kernel, post.zn, 1.0/np.sqrt(post.obs_tau),
+                    lam=post.rtd_lambda, nonneg=post.rtd_nonneg).fit()
+    C, keep = mc_p["nb_chain"], n_kept(mc_p)
+    x = inv.sample(C*keep, rng)
+    draws = np.empty((C*keep, post.ndim))
+    draws[:,post.slices[post.names.index("R0")]] = x[:,:1]
+    draws[:,post.slices[post.names.index("m_i")]] = x[:,1:]
+    info = {"acceptance": 1.0, "lambda": inv.lam, "lambdas": inv.lambdas, "evidences": inv.evidence}
+    if not inv.nonneg: # Evidence of the Gaussian model only
+        info["log_evidence"] = inv.log_evidence(inv.lam)
+    return draws.reshape(C, keep, post.ndim), info
+
+#==============================================================================
+def importance(post, mc_p, rng):
+    """
+    Importance resampling of the draws of a previous run of the same
+    sample, given by mc_p["importance"]: parameter names, draws theta
+    (n, ndim) and their log-likelihood log_like (n,) for the old data
+    The draws are weighted by their likelihood ratio for the data of
+    post and resampled (systematic resampling) into nb_chain chains
+    The effective sample size of the weights is returned in the info
+    """
+    prev = mc_p["importance"]
+    if list(prev["names"]) != post.names:
+        raise ValueError("Draws of parameters %s for a model of %s" %(list(prev["names"]), post.names))
+    theta = np.asarray(prev["theta"], dtype=float)
+    with np.errstate(all="ignore"):
+        w, ess = importance_weights(post.log_like(theta) - prev["log_like"])
+    if ess == 0:
+        raise ValueError("All draws have zero likelihood for the new data")
+    C, keep = mc_p["nb_chain"], n_kept(mc_p)
+    idx = rng.permutation(systematic_resample(w, rng, C*keep))
+    draws = theta[idx].reshape(C, keep, post.ndim)
+    return draws, {"acceptance": np.nan, "ess": ess, "n_draws": len(theta)}
+
+def replayed(post, mc_p, rng):
+    """
+    Draws (n_chain, n_draws, ndim) given by mc_p["replay"] with their
+    parameter names, e.g. one sample of a hierarchical joint inversion
+    """
+    given = mc_p["replay"]
+    if list(given["names"]) != post.names:
+        raise ValueError("Draws of parameters %s for a model of %s" %(list(given["names"]), post.names))
+    draws = np.asarray(given["draws"], dtype=float)
+    if draws.shape[:2] != (mc_p["nb_chain"], n_kept(mc_p)):
+        raise ValueError("Draws of shape %s for %d chains of %d draws" %(draws.shape, mc_p["nb_chain"], n_kept(mc_p)))
+    return draws, dict(given.get("info", {}), acceptance=given.get("acceptance", np.nan))
+
+# Name in mcmc["sampler"]: sampler function
+samplers = {"batch": batch_metropolis,
+            "ensemble": ensemble,
+            "hmc": hmc,
+            "tempering": tempering,
+            "smc": smc,
+            "laplace": laplace,
+            "gibbs": gibbs,
+            "linear": linear,
+            "importance": importance,
+            "replay": replayed,
+            }
+
+def run_sampler(MDL, sol, mc_p):
+    """
+    Samples the model of mcmcinv object (sol) with mc_p["sampler"]
+    and replays the draws in the pymc model MDL
+    Information about the run (acceptance rate, ...) is
+    stored in MDL.sampler_info
+    """
+    name = mc_p["sampler"]
+    if name not in samplers:
+        raise ValueError("Unknown sampler %s, use one of %s" %(name, ["pymc"]+sorted(samplers)))
+    post = BatchPosterior(sol, MDL)
+    rng = np.random.RandomState(mc_p.get("seed", None))
+    post.start, post.start_cov = start_state(post, mc_p, rng)
+    start = time.time()
+    draws, info = samplers[name](post, mc_p, rng)
+    info.update(sampler=name, time=time.time()-start, names=post.names)
+    print("\n%s sampler: %d chains x %d draws in %.1f s" %(name, draws.shape[0], draws.shape[1], info["time"]))
+    replay(MDL, post, draws, mc_p)
+    MDL.sampler_info = info
+    return MDL
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 28 11:05:12 2026
+
+Warm-started inversion of time-lapse measurements and profile lines
+Consecutive spectra of a monitoring experiment or of a profile change
+only slightly, so each inversion starts from the posterior of the
+previous one: its draws reweighted to the new data (or its mean) as
+starting points, its covariance as first proposal, and a burn-in
+shortened by warm_burn
+The reweighted draws are also a first-pass estimate of each station,
+available before its MCMC run (sol.first_pass)
+
+Use:
+sols = invert_sequence(['/data/Station%02d.dat' %i for i in range(29)],
+                       'ColeCole', mcmc={"nb_iter": 20000, "nb_burn": 15000},
+                       cc_modes=2)
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from bisip.utils import get_data
+from bisip.posterior import BatchPosterior
+from bisip.samplers import trace_draws
+from bisip.proposals import best_chain, short_burn
+from bisip.reweight import reweight_draws, weighted_moments
+
+def regularized(cov):
+    """
+    Covariance kept positive definite, None if a parameter was stuck
+    """
+    cov = np.atleast_2d(cov)
+    if not (np.all(np.isfinite(cov)) and np.all(np.diag(cov) > 0)):
+        return None
+    return cov + np.diag(1e-8*np.diag(cov))
+
+def warm_state(post, draws, data, rng, reweight=True, n_start=50):
+    """
+    Warm start of the inversion of data from the draws (n_chain, n_draws,
+    ndim) of BatchPosterior post (the previous station)
+    Returns the "warm" entry of the mcmc dictionary (names, starting
+    points theta and proposal covariance cov or None) and the first-pass estimate
+    (None if the draws are not reweighted)
+    """
+    chain = best_chain(post, draws)
+    mean = chain.mean(axis=0)
+    warm = {"names": post.names, "theta": mean[np.newaxis], "cov": regularized(np.cov(chain, rowvar=False))}
+    if not reweight:
+        return warm, None
+    try:
+        w, ess, _ = reweight_draws(post, chain, data)
+    except ValueError: # Measured at other frequencies
+        return warm, None
+    if ess == 0:
+        return warm, None
+    m, c = weighted_moments(chain, w)
+    first = {"ess": ess, "names": post.names, "slices": post.slices, "mean": m,
+             "sd": np.sqrt(np.diag(c)), "weights": w, "theta": chain}
+    warm["theta"] = np.vstack((chain[rng.choice(len(chain), n_start, p=w)], mean))
+    if ess > 10*post.ndim: # Enough draws to trust the new covariance
+        warm["cov"] = regularized(c)
+    return warm, first
+
+def invert_sequence(files, model, mcmc=None, warm_burn=0.1, reweight=True,
+                    n_start=50, seed=None, **options):
+    """
+    Inverts an ordered list of files, each run warm-started from the
+    posterior of the previous one (see warm_state)
+    The first file is inverted with the mcmc parameters, the next ones
+    with nb_burn, cov_delay and cov_inter multiplied by warm_burn
+    options are keyword arguments of mcmcinv (headers, ph_units, cc_modes, ...)
+    Returns the list of mcmcinv objects, with the first-pass estimate
+    of the reweighted draws in sol.first_pass (None for the first file)
+    """
+    from bisip.models import mcmcinv
+    mc_p = dict(mcmcinv.default_mcmc)
+    mc_p.update(mcmc or {})
+    rng = np.random.RandomState(seed)
+    sols = []
+    previous = None
+    for i, f in enumerate(files):
+        print("\nStation %d/%d: %s" %(i+1, len(files), f))
+        data = get_data(f, options.get("headers", 1), options.get("ph_units", "mrad"))
+        run, first = mc_p, None
+        if previous is not None:
+            warm, first = warm_state(previous[0], previous[1], data, rng, reweight, n_start)
+            run = dict(short_burn(mc_p, warm_burn), warm=warm)
+            if first is not None:
+                print("\nFirst pass from the previous station: ESS %.0f of %d draws" %(first["ess"], len(first["weights"])))
+        sol = mcmcinv(model, f, mcmc=run, data=data, **options)
+        sol.first_pass = first
+        sols.append(sol)
+        post = BatchPosterior(sol, sol.MDL)
+        previous = (post, trace_draws(sol.MDL, post, mc_p["nb_chain"]))
+    return sols
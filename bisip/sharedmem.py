@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 10:03:26 2026
+
+Read-only arrays shared with worker processes
+The parent copies the arrays once into shared memory and passes a small
+picklable handle to the workers, which attach to the same memory
+without copying or parsing anything
+Uses multiprocessing.shared_memory (Python >= 3.8), or memory-mapped
+.npy files in a temporary folder on older versions
+
+Use:
+with SharedArrays(load_data(files)) as shared:
+    pool = mp.Pool(4, initializer=init, initargs=(shared.handle,))
+    ...
+# In the worker:
+packed = attach(handle)
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None # Python < 3.8: memory-mapped files
+
+# Keeps the blocks attached by this process alive
+_attached = []
+
+#==============================================================================
+class SharedArrays(object):
+    """
+    Owner of a dictionary of shared arrays
+    handle: picklable description to pass to attach in the workers
+    close() frees the memory, once the workers are done
+    """
+
+    def __init__(self, arrays, folder=None):
+        self.handle = {}
+        self._blocks = []
+        self._folder = None
+        for k, a in arrays.items():
+            a = np.ascontiguousarray(a)
+            if a.dtype.hasobject:
+                raise TypeError("Array %s of objects can't be shared" %k)
+            if shared_memory is not None:
+                shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+                np.ndarray(a.shape, a.dtype, buffer=shm.buf)[...] = a
+                self._blocks.append(shm)
+                self.handle[k] = ("shm", shm.name, a.shape, a.dtype.str)
+            else:
+                if self._folder is None:
+                    self._folder = tempfile.mkdtemp(prefix="bisip_shared_", dir=folder)
+                fname = os.path.join(self._folder, "%s.npy" %k)
+                np.save(fname, a)
+                self.handle[k] = ("npy", fname, a.shape, a.dtype.str)
+
+    def close(self):
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+        if self._folder is not None:
+            shutil.rmtree(self._folder, ignore_errors=True)
+            self._folder = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _open_block(name):
+    """
+    Attaches to an existing block
+    Child processes share the resource tracker of the parent,
+    so only the owner unlinks the block
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python >= 3.13
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+def attach(handle):
+    """
+    Returns the dictionary of read-only arrays described by a handle
+    """
+    arrays = {}
+    for k, (kind, name, shape, dtype) in handle.items():
+        if kind == "shm":
+            shm = _open_block(name)
+            _attached.append(shm)
+            a = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+        else:
+            a = np.load(name, mmap_mode="r")
+        a.flags.writeable = False
+        arrays[k] = a
+    return arrays
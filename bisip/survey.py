@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:02:37 2026
+
+Survey container
+All spectra of a survey (e.g. the stations of a profile) in one file
+The file is an uncompressed npz archive: each array is stored as a
+.npy member that can be memory-mapped in place, so pulling one spectrum
+reads only that spectrum from disk
+
+Use:
+dat_to_survey('/Documents/DataFiles/', 'BravoProfile.npz', ph_units='mrad')
+survey = open_survey('BravoProfile.npz')
+sol = mcmcinv('ColeCole', survey.files[3], data=survey.get_data(3))
+"""
+
+from __future__ import print_function
+
+import json
+import struct
+import zipfile
+import numpy as np
+from bisip.utils import load_data, compute_data, unpack_data, data_labels
+
+#==============================================================================
+def dat_to_survey(source, survey_file, headers=1, ph_units="mrad", meta=None):
+    """
+    Converts .dat files to a survey container
+    Pass a directory, a manifest or a list of paths (see utils.list_data_files)
+    Phases are stored in rad
+    meta is an optional dictionary saved as JSON in the container
+    """
+    packed = load_data(source, headers, ph_units)
+    arrays = {l:packed[l] for l in data_labels}
+    arrays["offsets"] = packed["offsets"]
+    arrays["names"] = packed["names"].astype(str)
+    arrays["files"] = packed["files"].astype(str)
+    arrays["meta"] = np.array(json.dumps(meta or {}))
+    np.savez(survey_file, **arrays) # Stored, not deflated: members can be memory-mapped
+    print("\nSaved %d spectra in:\n" %len(arrays["names"]), survey_file)
+    return survey_file
+
+def open_survey(survey_file):
+    """
+    Opens a survey container for reading
+    """
+    return Survey(survey_file)
+
+def _member_memmap(filename, info):
+    """
+    Memory-maps a stored .npy member of a zip archive
+    """
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError("Compressed survey member %s can't be memory-mapped" %info.filename)
+    with open(filename, 'rb') as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if (dtype.hasobject) or (len(shape) == 0) or (0 in shape):
+        with zipfile.ZipFile(filename) as zf, zf.open(info) as m:
+            return np.lib.format.read_array(m)
+    order = 'F' if fortran else 'C'
+    return np.memmap(filename, dtype=dtype, mode='r', shape=shape, order=order, offset=offset)
+
+#==============================================================================
+class Survey(object):
+    """
+    Memory-mapped survey container
+    survey.names, survey.files: sample names and original file paths
+    survey.meta: metadata dictionary
+    survey.get_data(i): data dictionary of spectrum i (index or name),
+    same as utils.get_data
+    """
+
+    def __init__(self, survey_file):
+        self.filename = survey_file
+        with zipfile.ZipFile(survey_file) as zf:
+            infos = {i.filename[:-len(".npy")]: i for i in zf.infolist()}
+        self._arrays = {k: _member_memmap(survey_file, i) for (k, i) in infos.items()}
+        self.offsets = np.asarray(self._arrays["offsets"])
+        self.names = np.asarray(self._arrays["names"])
+        self.files = np.asarray(self._arrays["files"])
+        self.meta = json.loads(str(self._arrays["meta"]))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return self.get_data(i)
+
+    def index(self, name):
+        """
+        Returns the index of a sample name
+        """
+        return int(np.flatnonzero(self.names == name)[0])
+
+    def get_raw(self, i):
+        """
+        Returns the stored columns of spectrum i (index or name)
+        """
+        if not isinstance(i, (int, np.integer)):
+            i = self.index(i)
+        a, b = self.offsets[i], self.offsets[i+1]
+        return {l:np.array(self._arrays[l][a:b]) for l in data_labels}
+
+    def get_data(self, i):
+        """
+        Returns the data dictionary of spectrum i (index or name)
+        """
+        packed = self.get_raw(i)
+        packed["offsets"] = np.array([0, len(packed["freq"])])
+        return unpack_data(compute_data(packed, ph_units="rad"), 0)
+
+    def packed(self):
+        """
+        Returns all spectra in the packed dictionary of utils.load_data
+        """
+        packed = {l:np.array(self._arrays[l]) for l in data_labels}
+        packed["offsets"] = self.offsets.copy()
+        packed["names"] = self.names.copy()
+        packed["files"] = self.files.copy()
+        return compute_data(packed, ph_units="rad")
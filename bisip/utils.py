@@ -21,7 +21,10 @@ def save_figure(fig, subfolder, fname='Untitled', dpi=144):
     save_path = cwd+"/"+folder+"/"+subfolder+"/"
     print("\nSaving figure:\n", save_path)
     if not os.path.exists(save_path):
-        os.makedirs(save_path)
+        try:
+            os.makedirs(save_path)
+        except OSError: # Created by another exporter thread in the meantime
+            if not os.path.isdir(save_path): raise
     fig.savefig(save_path+fname, dpi=dpi, bbox_inches='tight')
 
 # =============================================================================
@@ -54,28 +57,139 @@ def get_data(filename,headers,ph_units):
     To import data
     Arguments: file name, number of header lines to skip, phase units
     """
-    # Importation des données .DAT
-    dat_file = np.loadtxt("%s"%(filename),skiprows=headers,delimiter=',')
-    labels = ["freq", "amp", "pha", "amp_err", "pha_err"]
-    data = {l:dat_file[:,i] for (i,l) in enumerate(labels)}
+    return unpack_data(load_data([filename], headers, ph_units), 0)
+
+#==============================================================================
+data_labels = ["freq", "amp", "pha", "amp_err", "pha_err"]
+
+def list_data_files(source, ext=".dat"):
+    """
+    Pass a directory, a manifest (text file with one path per line)
+    or a list of paths
+    Returns the list of data file paths
+    """
+    if isinstance(source, basestring):
+        if os.path.isdir(source):
+            return sorted(os.path.join(source, f) for f in os.listdir(source)
+                          if f.lower().endswith(ext))
+        with open(source) as f:
+            return [l.strip() for l in f if l.strip() and not l.startswith("#")]
+    return list(source)
+
+def read_dat(filename, headers):
+    """
+    Fast parser for one comma delimited .dat file
+    Returns a (n_freq, 5) array with freq, amp, pha, amp_err, pha_err
+    """
+    with open(filename) as f:
+        lines = f.read().splitlines()[headers:]
+    lines = [l.split("#")[0] for l in lines] # Comments, as np.loadtxt
+    lines = [l for l in lines if l.strip()]
+    n_cols = lines[0].count(",") + 1 if lines else len(data_labels)
+    try:
+        values = np.fromstring(" ".join(lines).replace(",", " "), sep=" ")
+    except ValueError: # Recent numpy raises on text it cannot parse
+        values = np.empty(0)
+    if values.size != n_cols*len(lines): # Unusual file, let numpy sort it out
+        values = np.loadtxt(filename, skiprows=headers, delimiter=',', ndmin=2)
+        return values[:,:len(data_labels)]
+    return values.reshape(len(lines), -1)[:,:len(data_labels)]
+
+def load_data(source, headers=1, ph_units="mrad"):
+    """
+    Bulk import of many data files (see list_data_files for source)
+    All spectra are stacked end to end in flat arrays and the
+    complex and normalized arrays are computed for all of them at once
+    Spectrum i spans offsets[i]:offsets[i+1]
+    Returns a packed dictionary of plain arrays that can be
+    pickled or put in shared memory, see unpack_data to get one spectrum
+    """
+    files = list_data_files(source)
+    blocks = [read_dat(f, headers) for f in files]
+    counts = np.array([len(b) for b in blocks], dtype=int)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    dat = np.vstack(blocks)
+    packed = {l:np.ascontiguousarray(dat[:,i]) for (i,l) in enumerate(data_labels)}
+    packed["files"] = np.array(files)
+    packed["names"] = np.array([split_filepath(f) for f in files])
+    packed["offsets"] = offsets
+    compute_data(packed, ph_units)
+    return packed
+
+def compute_data(packed, ph_units="mrad"):
+    """
+    Computes phase in rad, complex impedance, errors and
+    normalized arrays of a packed dictionary in place
+    Per spectrum reductions use the offsets of the packed dictionary
+    """
+    starts = packed["offsets"][:-1]
+    counts = np.diff(packed["offsets"])
     if ph_units == "mrad":
-        data["pha"] = data["pha"]/1000                    # mrad to rad
-        data["pha_err"] = data["pha_err"]/1000              # mrad to rad
+        packed["pha"] = packed["pha"]/1000                    # mrad to rad
+        packed["pha_err"] = packed["pha_err"]/1000              # mrad to rad
     if ph_units == "deg":
-        data["pha"] = np.radians(data["pha"])               # deg to rad
-        data["pha_err"] = np.radians(data["pha_err"])       # deg to rad
-    data["phase_range"] = abs(max(data["pha"])-min(data["pha"])) # Range of phase measurements (used in NRMS error calculation)
-    data["Z"]  = data["amp"]*(np.cos(data["pha"]) + 1j*np.sin(data["pha"]))
-    EI = np.sqrt(((data["amp"]*np.cos(data["pha"])*data["pha_err"])**2)+(np.sin(data["pha"])*data["amp_err"])**2)
-    ER = np.sqrt(((data["amp"]*np.sin(data["pha"])*data["pha_err"])**2)+(np.cos(data["pha"])*data["amp_err"])**2)
-    data["Z_err"] = ER + 1j*EI
+        packed["pha"] = np.radians(packed["pha"])               # deg to rad
+        packed["pha_err"] = np.radians(packed["pha_err"])       # deg to rad
+    amp, pha, amp_err, pha_err = packed["amp"], packed["pha"], packed["amp_err"], packed["pha_err"]
+    cos, sin = np.cos(pha), np.sin(pha)
+    packed["phase_range"] = np.maximum.reduceat(pha, starts) - np.minimum.reduceat(pha, starts) # Range of phase measurements (used in NRMS error calculation)
+    packed["Z"] = amp*(cos + 1j*sin)
+    EI = np.sqrt(((amp*cos*pha_err)**2)+(sin*amp_err)**2)
+    ER = np.sqrt(((amp*sin*pha_err)**2)+(cos*amp_err)**2)
+    packed["Z_err"] = ER + 1j*EI
     # Normalization of amplitude
-    data["Z_max"] = max(abs(data["Z"]))  # Maximum amplitude
-    zn, zn_e = data["Z"]/data["Z_max"], data["Z_err"]/data["Z_max"] # Normalization of impedance by max amplitude
-    data["zn"] = np.array([zn.real, zn.imag]) # 2D array with first column = real values, second column = imag values
-    data["zn_err"] = np.array([zn_e.real, zn_e.imag]) # 2D array with first column = real values, second column = imag values
+    packed["Z_max"] = np.maximum.reduceat(abs(packed["Z"]), starts) # Maximum amplitude of each spectrum
+    norm = np.repeat(packed["Z_max"], counts)
+    zn, zn_e = packed["Z"]/norm, packed["Z_err"]/norm # Normalization of impedance by max amplitude
+    packed["zn"] = np.array([zn.real, zn.imag]) # 2D array with first row = real values, second row = imag values
+    packed["zn_err"] = np.array([zn_e.real, zn_e.imag])
+    return packed
+
+def unpack_data(packed, i):
+    """
+    Pass packed dictionary from load_data and spectrum index or sample name
+    Returns the data dictionary of that spectrum, same as get_data
+    Its arrays are views of the packed arrays (read-only in shared memory):
+    copy an array before modifying it
+    """
+    if isinstance(i, basestring):
+        i = int(np.flatnonzero(packed["names"] == i)[0])
+    a, b = packed["offsets"][i], packed["offsets"][i+1]
+    data = {l:packed[l][a:b] for l in data_labels + ["Z", "Z_err"]}
+    data["zn"] = packed["zn"][:,a:b]
+    data["zn_err"] = packed["zn_err"][:,a:b]
+    data["Z_max"] = float(packed["Z_max"][i])
+    data["phase_range"] = float(abs(packed["phase_range"][i]))
     return data
 
+def edit_data(data, amp_err_scale=1.0, pha_err_scale=1.0, keep=None):
+    """
+    Copy of a data dictionary with the amplitude and phase errors
+    multiplied by amp_err_scale and pha_err_scale, and only the
+    frequencies keep (indices or boolean mask) if given
+    The complex and normalized arrays are computed again
+    """
+    keep = np.arange(len(data["freq"])) if keep is None else np.asarray(keep)
+    packed = {l:np.asarray(data[l])[keep].astype(float) for l in data_labels}
+    packed["amp_err"] = amp_err_scale*packed["amp_err"]
+    packed["pha_err"] = pha_err_scale*packed["pha_err"]
+    packed["offsets"] = np.array([0, len(packed["freq"])])
+    return unpack_data(compute_data(packed, ph_units="rad"), 0) # Phases are already in rad
+
+# =============================================================================
+def decomp_grid(w, decomp_poly):
+    """
+    Relaxation time grid of the polynomial decomposition
+    Pass angular frequencies and polynomial order
+    Returns log_tau, cond (inside the measured range),
+    log_taus (powers of log_tau for the polynomial RTD) and tau_10
+    """
+    log_tau = np.linspace(np.floor(min(np.log10(1.0/w)))-1, np.floor(max(np.log10(1.0/w)))+1, 50)
+    cond = (log_tau >= min(log_tau)+1)&(log_tau <= max(log_tau)-1)
+    log_taus = np.array([log_tau**i for i in list(reversed(range(0,decomp_poly+1)))]) # Polynomial approximation for the RTD
+    tau_10 = 10**log_tau # Accelerates sampling
+    return log_tau, cond, log_taus, tau_10
+
 # =============================================================================
 def get_model_type(sol):
     """
@@ -127,3 +241,24 @@ def find_nearest(array,val):
     """
     idx = (np.abs(array-val)).argmin()
     return array[idx]
+
+# =============================================================================
+def decimate_trace(x, y, max_points=2000):
+    """
+    Min/max envelope decimation of a trace before plotting
+    Splits the trace in max_points/2 buckets and keeps the lowest
+    and highest sample of each bucket in iteration order
+    Returns x and y untouched if the trace is already short enough
+    """
+    y = np.asarray(y)
+    n = len(y)
+    if (max_points is None) or (n <= max_points):
+        return x, y
+    n_buckets = max(int(max_points)//2, 1)
+    size = int(np.ceil(n*1.0/n_buckets))
+    padded = np.pad(y, (0, n_buckets*size - n), mode='edge').reshape(n_buckets, size)
+    offsets = size*np.arange(n_buckets)
+    idx = np.concatenate((offsets + padded.argmin(axis=1),
+                          offsets + padded.argmax(axis=1)))
+    idx = np.unique(np.clip(idx, 0, n-1)) # Sorted and in range
+    return np.asarray(x)[idx], y[idx]
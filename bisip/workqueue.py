@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 13:37:05 2026
+
+Work queue on a shared filesystem
+Jobs are JSON files in a queue folder that any number of worker processes,
+on any machine that mounts the folder, pull from:
+    queue/todo/     jobs waiting for a worker
+    queue/leases/   jobs claimed by a worker
+    queue/done/     finished jobs
+    queue/failed/   jobs that failed max_attempts times
+A worker claims a job by renaming it from todo to leases, which only one
+worker can win, writes its own token in the lease and touches the lease
+file while it works (heartbeat)
+A lease that has not been touched for ttl seconds belongs to a dead worker:
+the first worker to see it moves the job back to todo
+A worker whose lease now holds another token (reclaimed and claimed again)
+has lost it: its job is stopped and its result discarded
+Times are compared with the filesystem clock, not the clock of the node
+Jobs of a survey container (see batch.survey_jobs) hold its path and the
+index of their spectrum, so every node memory-maps the shared container
+SQLite locking is unreliable on NFS: submit jobs with outputs "db" off
+and build the result store from the csv files afterwards
+
+Use:
+submit('/shared/queue', read_manifest('campaign.json'))
+work('/shared/queue', work_dir='/shared/campaign')    # On every node
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+import multiprocessing as mp
+
+from bisip.batch import init_worker, run_job
+
+folders = ["todo", "leases", "done", "failed"]
+
+#==============================================================================
+def make_queue(queue_dir):
+    """
+    Creates the folders of a queue
+    """
+    for f in folders:
+        d = os.path.join(queue_dir, f)
+        if not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError: # Created by another worker in the meantime
+                if not os.path.isdir(d): raise
+    return queue_dir
+
+def submit(queue_dir, jobs):
+    """
+    Adds jobs (see batch.make_job) to a queue
+    Each job is written to a temporary file and renamed, so workers
+    never read a partly written job
+    Returns the list of job ids
+    """
+    make_queue(queue_dir)
+    ids = []
+    stamp = "%s-%d-%d" %(socket.gethostname(), os.getpid(), int(1000*time.time()))
+    for i, job in enumerate(jobs):
+        job_id = "%s-%05d" %(stamp, i)
+        job = dict(job, id=job_id, attempts=0)
+        tmp = os.path.join(queue_dir, "todo", ".%s.tmp" %job_id)
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.rename(tmp, os.path.join(queue_dir, "todo", job_id+".json"))
+        ids.append(job_id)
+    print("\nSubmitted %d jobs to %s" %(len(ids), queue_dir))
+    return ids
+
+def status(queue_dir):
+    """
+    Returns the number of jobs in each folder of a queue
+    """
+    return {f: len([x for x in os.listdir(os.path.join(queue_dir, f)) if x.endswith(".json")])
+            for f in folders}
+
+def fs_now(queue_dir):
+    """
+    Current time of the shared filesystem
+    """
+    clock = os.path.join(queue_dir, ".clock-%s-%d" %(socket.gethostname(), os.getpid()))
+    with open(clock, "a"):
+        os.utime(clock, None)
+    now = os.stat(clock).st_mtime
+    os.remove(clock)
+    return now
+
+def write_json(path, job):
+    """
+    Writes a job file atomically (temporary file and rename)
+    """
+    folder, name = os.path.split(path)
+    tmp = os.path.join(folder, ".%s.%s.tmp" %(name, uuid.uuid4().hex))
+    with open(tmp, "w") as f:
+        json.dump(job, f)
+    os.rename(tmp, path)
+
+def read_lease(lease):
+    """
+    Job of a lease file, None if the lease is gone
+    """
+    try:
+        with open(lease) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def reclaim_expired(queue_dir, ttl):
+    """
+    Moves the jobs of expired leases back to todo, also the leases of
+    workers that died while finishing a job (see finish)
+    Returns the number of reclaimed jobs
+    """
+    now = fs_now(queue_dir)
+    n = 0
+    for f in os.listdir(os.path.join(queue_dir, "leases")):
+        if f.endswith(".json"):
+            name = f
+        elif f.endswith(".finishing"):
+            name = f.split(".json.")[0]+".json"
+        else:
+            continue
+        lease = os.path.join(queue_dir, "leases", f)
+        try:
+            if now - os.stat(lease).st_mtime > ttl:
+                os.rename(lease, os.path.join(queue_dir, "todo", name))
+                n += 1
+                print("\nReclaimed expired lease:", f)
+        except OSError: # Finished or reclaimed by another worker
+            pass
+    return n
+
+def claim(queue_dir, owner):
+    """
+    Claims one job of the queue
+    The job gets a new token that identifies this lease
+    Returns (job, lease path) or (None, None) if nothing is left to claim
+    """
+    for f in sorted(os.listdir(os.path.join(queue_dir, "todo"))):
+        if not f.endswith(".json"):
+            continue
+        todo = os.path.join(queue_dir, "todo", f)
+        lease = os.path.join(queue_dir, "leases", f)
+        try:
+            os.utime(todo, None) # A fresh lease, however long the job waited
+            os.rename(todo, lease)
+        except OSError: # Another worker won this one
+            continue
+        job = read_lease(lease)
+        if job is None: # Reclaimed or claimed by another worker meanwhile
+            continue
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["owner"] = owner
+        job["token"] = uuid.uuid4().hex
+        write_json(lease, job)
+        return job, lease
+    return None, None
+
+#==============================================================================
+class Heartbeat(object):
+    """
+    Touches a lease file every interval seconds in a background thread
+    lost is set if the lease disappears or holds another token
+    (reclaimed, and maybe claimed again by another worker)
+    """
+
+    def __init__(self, lease, interval, token):
+        self.lease = lease
+        self.interval = interval
+        self.token = token
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            held = read_lease(self.lease)
+            if (held is None) or (held.get("token") != self.token):
+                self.lost = True
+                return
+            try:
+                os.utime(self.lease, None)
+            except OSError:
+                self.lost = True
+                return
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def finish(queue_dir, job, lease, error, elapsed, max_attempts):
+    """
+    Moves a finished job to done, back to todo for another attempt,
+    or to failed after max_attempts
+    The lease is first renamed to a name of this worker, then its token
+    is checked: a lease claimed again by another worker is put back
+    Returns the destination folder, or "lost"
+    """
+    job.update(error=error, elapsed=elapsed, host=socket.gethostname())
+    if error is None:
+        dest = "done"
+    elif job["attempts"] < max_attempts:
+        dest = "todo"
+    else:
+        dest = "failed"
+    mine = "%s.%s.finishing" %(lease, job["token"])
+    try:
+        os.rename(lease, mine)
+    except OSError: # Lease was reclaimed: the job runs again elsewhere
+        print("\nLost the lease of job %s" %job["id"])
+        return "lost"
+    held = read_lease(mine)
+    if (held is None) or (held.get("token") != job["token"]):
+        try:
+            os.rename(mine, lease) # Not ours, give it back
+        except OSError:
+            pass
+        print("\nLost the lease of job %s" %job["id"])
+        return "lost"
+    write_json(os.path.join(queue_dir, dest, os.path.basename(lease)), job)
+    os.remove(mine)
+    return dest
+
+def _run_child(job, conn):
+    conn.send(run_job(job))
+    conn.close()
+
+def run_leased(job, beat, poll=1.0):
+    """
+    Runs a job in a child process, stopped as soon as the heartbeat
+    loses the lease
+    A worker of a pool (daemonic) can't start a child: the job runs in
+    the worker and its result is discarded if the lease was lost
+    Returns the report of batch.run_job, or None if the lease was lost
+    """
+    if mp.current_process().daemon:
+        report = run_job(job)
+        return None if beat.lost else report
+    start = time.time()
+    reader, writer = mp.Pipe(duplex=False)
+    child = mp.Process(target=_run_child, args=(job, writer))
+    child.start()
+    writer.close()
+    while True:
+        if reader.poll(poll):
+            try:
+                report = reader.recv()
+            except EOFError: # Died while sending
+                report = None
+            child.join()
+            if report is not None:
+                return None if beat.lost else report
+            return job, "Job process died (exit code %s)" %child.exitcode, time.time() - start, []
+        if beat.lost:
+            child.terminate()
+            child.join()
+            return None
+        if not child.is_alive() and not reader.poll():
+            return job, "Job process died (exit code %s)" %child.exitcode, time.time() - start, []
+
+def work(queue_dir, work_dir=None, ttl=300, max_attempts=3, poll=30, wait=False):
+    """
+    Worker loop: claims and runs jobs until the queue is empty
+    Leases are touched every ttl/4 seconds and expire after ttl seconds
+    Each job runs in a child process, stopped if its lease is lost
+    With wait=True the worker keeps polling for new jobs every poll seconds
+    Returns the number of jobs run
+    """
+    make_queue(queue_dir)
+    init_worker(work_dir)
+    owner = "%s:%d" %(socket.gethostname(), os.getpid())
+    n = 0
+    while True:
+        reclaim_expired(queue_dir, ttl)
+        job, lease = claim(queue_dir, owner)
+        if job is None:
+            if wait or status(queue_dir)["leases"]: # Leases may still expire
+                time.sleep(poll)
+                continue
+            break
+        print("\nWorker %s running job %s (%s)" %(owner, job["id"], job["file"]))
+        beat = Heartbeat(lease, ttl/4.0, job["token"])
+        try:
+            report = run_leased(job, beat)
+        finally:
+            beat.stop()
+        if report is None:
+            print("\nLost the lease of job %s, stopped and discarded" %job["id"])
+            continue
+        _, error, elapsed, figure_errors = report
+        job["figure_errors"] = figure_errors
+        dest = finish(queue_dir, job, lease, error, elapsed, max_attempts)
+        print("\nJob %s: %s in %.1f s" %(job["id"], dest, elapsed))
+        if figure_errors:
+            print("Figure errors of job %s: %s" %(job["id"], "; ".join(figure_errors)))
+        n += 1
+    return n
+
+def _work(args, counts):
+    counts.put(work(*args))
+
+def run_workers(queue_dir, n_workers=1, work_dir=None, ttl=300, max_attempts=3, poll=30, wait=False):
+    """
+    Runs n_workers worker processes on this machine
+    They are not pool workers, so each can run its jobs in child processes
+    """
+    args = (queue_dir, work_dir, ttl, max_attempts, poll, wait)
+    if n_workers == 1:
+        return work(*args)
+    counts = mp.Queue()
+    workers = [mp.Process(target=_work, args=(args, counts)) for _ in range(n_workers)]
+    for w in workers:
+        w.start()
+    n = 0
+    for w in workers:
+        w.join()
+    while not counts.empty():
+        n += counts.get()
+    return n
@@ -6,9 +6,7 @@ Created on Fri Sep 29 16:18:50 2017
 """
 
 from setuptools import setup, find_packages
-
-from distutils.core import setup
-from distutils.extension import Extension
+from setuptools import Extension
 from distutils.command.sdist import sdist as _sdist
 import numpy
 
@@ -51,6 +49,7 @@ setup(
   version = '0.0.15',
   license = 'MIT',
   install_requires=['pymc'],
+  entry_points = {'console_scripts': ['bisip = bisip.cli:main']},
   description = 'Bayesian inversion of SIP data',
   long_description = 'README.md',
   author = 'Charles L. Berube',